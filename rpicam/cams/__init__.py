@@ -1,9 +1,32 @@
-from .timelapse_cam import TimelapseCam
-from .live_preview_cam import LivePreviewCam
-from .callbacks import (
-    ExecPoint,
-    Callback,
-    AnnotateFrameWithDt,
-    ExecutionTimeout,
-    PostToTg,
-)
+# Members are imported lazily on first access, so that importing rpicam.cams does not load
+# the camera stack and other heavy dependencies.
+import importlib
+
+_LAZY_MEMBERS = {
+    'TimelapseCam': '.timelapse_cam',
+    'PanoramaTimelapseCam': '.panorama_cam',
+    'LivePreviewCam': '.live_preview_cam',
+    'ExecPoint': '.callbacks',
+    'Callback': '.callbacks',
+    'AnnotateFrameWithDt': '.callbacks',
+    'ExecutionTimeout': '.callbacks',
+    'PostToTg': '.callbacks',
+    'FrameSyncedServoProgram': '.callbacks',
+    'ExposureLock': '.callbacks',
+    'RecordingProgress': '.callbacks',
+    'ReportProgress': '.callbacks',
+}
+
+__all__ = list(_LAZY_MEMBERS)
+
+
+def __getattr__(name):
+    if name not in _LAZY_MEMBERS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_MEMBERS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
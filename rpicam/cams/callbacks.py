@@ -1,15 +1,17 @@
-from typing import Union
+from typing import Dict, Union, Callable, NamedTuple, Optional, TYPE_CHECKING
 from pathlib import Path
 from datetime import datetime
 from enum import Enum, auto
+from threading import Thread
 import time
 from time import sleep
 
-from picamera2 import Picamera2 as PiCamera, MappedArray
-import cv2
-
 from rpicam.utils.logging_utils import get_logger
 from rpicam.utils.telegram_poster import TelegramPoster
+from rpicam.utils.upload_queue import UploadQueue
+
+if TYPE_CHECKING:
+    from picamera2 import Picamera2 as PiCamera
 
 
 class ExecPoint(Enum):
@@ -27,9 +29,28 @@ class ExecPoint(Enum):
 
 
 class Callback:
-    def __init__(self, exec_at: ExecPoint, priority: int = -1):
+    """
+    Base class of functions to run at an ExecPoint of a Cam.
+
+    :param exec_at: The ExecPoint to run at.
+    :param priority: Callbacks of higher priority run first.
+    :param offload: Whether to run on a worker thread of the ExecPoint instead of blocking
+                    the caller. See `CallbackHandler`.
+    :param offload_timeout: Seconds after which a running offloaded call is reported as failed,
+                            and the calls queued behind it are moved to a new worker.
+    """
+
+    def __init__(
+        self,
+        exec_at: ExecPoint,
+        priority: int = -1,
+        offload: bool = False,
+        offload_timeout: Optional[float] = None,
+    ):
         self.exec_at = exec_at
         self.priority = priority
+        self.offload = offload
+        self.offload_timeout = offload_timeout
 
     def __call__(self, *args, **kwargs):
         pass
@@ -45,33 +66,74 @@ class AnnotateFrameWithDt(Callback):
         self._fmt = fmt
         self._color = (0, 255, 0)
         self._origin = (10, 30)
-        self._font = cv2.FONT_HERSHEY_SIMPLEX
+        self._font = None
         self._scale = 1
         self._thickness = 2
 
     def _apply_timestamp(self, request):
+        import cv2
+        from picamera2 import MappedArray
+
+        if self._font is None:
+            self._font = cv2.FONT_HERSHEY_SIMPLEX
         timestamp = time.strftime(self._fmt)
         with MappedArray(request, "main") as m:
             cv2.putText(m.array, timestamp, self._origin, self._font, self._scale, self._color, self._thickness)
 
-    def __call__(self, cam: PiCamera, *args, **kwargs):
+    def __call__(self, cam: 'PiCamera', *args, **kwargs):
         if self._fmt is not None:
             cam.pre_callback = self._apply_timestamp
 
 
+class RecordingProgress(NamedTuple):
+    """
+    Progress of a running recording.
+
+    :param frames_captured: The number of frames captured so far.
+    :param t_end: The time at which capture ends, if known.
+    :param eta: Seconds until capture ends, if known.
+    """
+
+    frames_captured: int
+    t_end: Optional[datetime] = None
+    eta: Optional[float] = None
+
+
+class ReportProgress(Callback):
+    """
+    Calls the given function with a `RecordingProgress` after every captured frame.
+    """
+
+    def __init__(self, fn: Callable[[RecordingProgress], None]):
+        super().__init__(exec_at=ExecPoint.AFTER_FRAME_CAPTURE, priority=-999)
+        self._fn = fn
+        self._n_calls = 0
+
+    def __call__(self, frame_idx: int = None, t_end: datetime = None, *args, **kwargs):
+        self._n_calls += 1
+        frames_captured = frame_idx + 1 if frame_idx is not None else self._n_calls
+        eta = None
+        if t_end is not None:
+            eta = max(0.0, (t_end - datetime.now()).total_seconds())
+        self._fn(RecordingProgress(frames_captured=frames_captured, t_end=t_end, eta=eta))
+
+
 class PostToTg(Callback):
     """
     Posts the created file to Telegram using credentials stored in environment.
+    The file is only queued in a persistent `UploadQueue`, which is drained by a background
+    worker in the process creating this callback, retrying failed uploads.
+
+    :param journal_dir: The directory to journal queued uploads in. See `UploadQueue`.
+    :param kwargs: passed on to `UploadQueue`.
     """
-    def __init__(self):
+    def __init__(self, journal_dir: Path = None, **kwargs):
         super().__init__(exec_at=ExecPoint.AFTER_CONVERT, priority=999)
-        self._poster = TelegramPoster()
+        self.queue = UploadQueue(TelegramPoster(), journal_dir=journal_dir, verbose=True, **kwargs)
+        self.queue.start()
 
     def __call__(self, outfile: Union[str, Path], *args, **kwargs):
-        try:
-            self._poster.send_video(outfile)
-        except Exception:
-            pass
+        self.queue.put(outfile)
 
 
 class ExecutionTimeout(Callback):
@@ -92,3 +154,185 @@ class ExecutionTimeout(Callback):
             if self.timeout >= self.MESSAGE_ABOVE:
                 self._logger.info(f'Execution blocked for {self.timeout} sec at {self.exec_at}.')
             sleep(self.timeout)
+
+
+class FrameSyncedServoProgram(Callback):
+    """
+    Runs a `ServoProgram` on a Servo in the gaps between timelapse frames, so that moves
+    never overlap with an exposure. After each frame, all program ops due before the next
+    frame deadline are started in a background thread, as long as they are planned to
+    finish in time. The first due op is always started; if `block_capture` is set,
+    the next frame capture waits until the servo has settled.
+
+    Register both this callback and its `blocker` with the Cam.
+
+    :param servo: The `Servo` to move.
+    :param program: The `ServoProgram` to run. Time 0 is the first captured frame.
+    :param block_capture: Whether to delay frame capture until the servo has settled.
+    :param verbose: whether to write info logs to stderr.
+    """
+
+    BLOCK_POLL_INTERVAL = 0.01
+
+    def __init__(self, servo, program, block_capture: bool = True, verbose: bool = False):
+        super().__init__(exec_at=ExecPoint.AFTER_FRAME_CAPTURE, priority=-1000)
+        self.servo = servo
+        self.program = program
+        self.block_capture = block_capture
+        self.blocker = ExecutionTimeout(
+            exec_at=ExecPoint.BEFORE_FRAME_CAPTURE, timeout=self.BLOCK_POLL_INTERVAL
+        )
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+        self._t_first = None
+        self._mover = None
+
+    def reset(self):
+        """Restart the program, with time 0 at the next captured frame."""
+        self.program.reset()
+        self._t_first = None
+
+    def _run_ops(self, ops):
+        try:
+            for op in ops:
+                self.servo.run_servo_op(op)
+        finally:
+            self.blocker.blocked = False
+
+    def __call__(self, next_frame_at: float = None, *args, **kwargs):
+        now = time.time()
+        if self._t_first is None:
+            self._t_first = now
+        if self._mover is not None and self._mover.is_alive():
+            return  # previous moves are still running; pick up due ops after the next frame
+        if next_frame_at is None:
+            next_frame_at = now
+        gap = next_frame_at - now
+        ops = self.program.pop_due(next_frame_at - self._t_first)
+        if not len(ops):
+            return
+        planner = self.servo.motion_planner
+        angle = self.servo.angle
+        planned = 0.0
+        n_fit = 0
+        for op in ops:
+            new_angle = self.servo.resolve_target_angle([op], from_angle=angle)
+            move_time = planner.move_time(angle, new_angle)
+            if n_fit > 0 and planned + move_time > gap:
+                break
+            planned += move_time
+            angle = new_angle
+            n_fit += 1
+        if planned > gap:
+            self._logger.warning(
+                f'Servo move needs {round(planned, 2)} sec but only {round(gap, 2)} sec '
+                f'are left until the next frame.'
+            )
+        self.program.push_back(ops[n_fit:])
+        self.blocker.blocked = self.block_capture
+        self._mover = Thread(target=self._run_ops, args=(ops[:n_fit],), daemon=True)
+        self._mover.start()
+
+
+class ExposureLock(Callback):
+    """
+    Meters exposure and white balance with AE and AWB running, then locks ExposureTime,
+    AnalogueGain and ColourGains, so that frames are captured without waiting for
+    convergence and without exposure flicker. Metering happens before the first frame,
+    and again after `remeter_interval` or once the scene luminance (`Lux` in the capture
+    metadata) drifts from the metered one by more than `lux_drift`.
+
+    Register both this callback and its `monitor` with the Cam.
+
+    :param remeter_interval: Seconds after which to meter again. If None, never re-meter on time.
+    :param lux_drift: Relative change of luminance after which to meter again. If None, ignore drift.
+    :param settle_frames: The maximum number of frames to wait for AE and AWB to converge.
+    :param tolerance: Relative change between consecutive frames below which AE and AWB count as converged.
+    :param verbose: whether to write info logs to stderr.
+    """
+
+    LOCKED_CONTROLS = ('ExposureTime', 'AnalogueGain', 'ColourGains')
+    MIN_SETTLE_FRAMES = 3  # frames until enabling AE and AWB takes effect
+
+    def __init__(
+        self,
+        remeter_interval: Optional[float] = 600,
+        lux_drift: Optional[float] = 0.5,
+        settle_frames: int = 30,
+        tolerance: float = 0.02,
+        verbose: bool = False,
+    ):
+        # after any ExecutionTimeout, so that metering sees the scene the frame will show
+        super().__init__(exec_at=ExecPoint.BEFORE_FRAME_CAPTURE, priority=900)
+        self.remeter_interval = remeter_interval
+        self.lux_drift = lux_drift
+        self.settle_frames = settle_frames
+        self.tolerance = tolerance
+        self.monitor = _LuxMonitor(self)
+        self.locked: Optional[Dict] = None
+        self._lux = None
+        self._metered_at = None
+        self._drifted = False
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+
+    def _is_settled(self, prev: Dict, cur: Dict) -> bool:
+        for key in self.LOCKED_CONTROLS:
+            if key not in prev or key not in cur:
+                continue
+            a = prev[key] if isinstance(prev[key], (tuple, list)) else (prev[key],)
+            b = cur[key] if isinstance(cur[key], (tuple, list)) else (cur[key],)
+            if any(abs(x - y) > self.tolerance * max(abs(x), 1e-6) for x, y in zip(a, b)):
+                return False
+        return True
+
+    def meter(self, cam: 'PiCamera'):
+        """Let AE and AWB converge on the current scene, then lock their results."""
+        cam.set_controls({'AeEnable': True, 'AwbEnable': True})
+        prev = None
+        metadata = {}
+        for i in range(max(self.settle_frames, self.MIN_SETTLE_FRAMES)):
+            metadata = cam.capture_metadata()
+            if i >= self.MIN_SETTLE_FRAMES and prev is not None and self._is_settled(prev, metadata):
+                break
+            prev = metadata
+        else:
+            self._logger.warning(f'AE/AWB did not converge within {self.settle_frames} frames.')
+        self.locked = {k: metadata[k] for k in self.LOCKED_CONTROLS if k in metadata}
+        cam.set_controls({'AeEnable': False, 'AwbEnable': False, **self.locked})
+        self._lux = metadata.get('Lux')
+        self._metered_at = time.monotonic()
+        self._drifted = False
+        self._logger.info(f'Locked {self.locked} at {self._lux} lux.')
+
+    def needs_metering(self) -> bool:
+        if self.locked is None or self._drifted:
+            return True
+        return (
+            self.remeter_interval is not None
+            and time.monotonic() - self._metered_at >= self.remeter_interval
+        )
+
+    def observe(self, metadata: Optional[Dict]):
+        """Check the metadata of a captured frame for luminance drift."""
+        if self.lux_drift is None or self._lux is None or not metadata:
+            return
+        lux = metadata.get('Lux')
+        if lux is None or self._drifted:
+            return
+        if abs(lux - self._lux) > self.lux_drift * max(self._lux, 1.0):
+            self._logger.info(f'Luminance drifted from {self._lux} to {lux} lux, metering again.')
+            self._drifted = True
+
+    def __call__(self, cam: 'PiCamera', *args, **kwargs):
+        if self.needs_metering():
+            self.meter(cam)
+
+
+class _LuxMonitor(Callback):
+    """Passes the metadata of captured frames on to an ExposureLock."""
+
+    def __init__(self, lock: ExposureLock):
+        super().__init__(exec_at=ExecPoint.AFTER_FRAME_CAPTURE, priority=-1)
+        self._lock = lock
+
+    def __call__(self, metadata: Dict = None, *args, **kwargs):
+        self._lock.observe(metadata)
@@ -1,14 +1,14 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from time import sleep
+from threading import Event
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from abc import ABC, abstractmethod
 
-from picamera2 import Picamera2 as PiCamera, Preview
-from libcamera import Transform, controls
-
 from rpicam.utils.logging_utils import get_logger
 from rpicam.utils.callback_handler import CallbackHandler
+from rpicam.utils.profiling import PhaseProfiler
+from rpicam.utils.roi import roi_to_scaler_crop, fit_size
 from rpicam.cams.callbacks import ExecPoint, Callback
 
 
@@ -22,6 +22,15 @@ class Cam(ABC):
     :param tmpdir: The location to save any temporary files produced by the Cam.
     :param callbacks: a list of callbacks to be applied in the Cam.
     :param hvflip: whether to rotate camera 180 degrees.
+    :param profiler: An optional profiler to run during every occurrence of its phase.
+    :param stream: whether to run the camera in a continuous video configuration, for frames to
+                   be grabbed from the running stream with low latency, instead of a still one.
+    :param roi: An optional region of interest (x, y, width, height) relative to the full field of
+                view, e.g. (0.25, 0.25, 0.5, 0.5) for the center. It is cropped by the ISP, and
+                frames are fitted into `resolution` at its aspect ratio, so that only its pixels
+                are captured and processed.
+    :param sensor_mode: The index of the sensor mode to use, e.g. a binned one for speed.
+                        See `Picamera2.sensor_modes`. Chosen by libcamera if not supplied.
     :param args: any positional arguments are passed on to the PiCamera constructor.
     :param kwargs: any keyword arguments are passed on to the PiCamera constructor.
     """
@@ -35,19 +44,56 @@ class Cam(ABC):
         callbacks: List[Callback] = (),
         hvflip: bool = False,
         resolution = (1024, 768),
+        profiler: PhaseProfiler = None,
+        stream: bool = False,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        sensor_mode: Optional[int] = None,
         # picamera settings
         *args,
         **kwargs,
     ):
         self._logger = get_logger(self.__class__.__name__, verb=verbose)
-        self._cbh = CallbackHandler(callbacks)
+        self._stop_requested = Event()
+        self._closed = True
+        self._cbh = CallbackHandler(callbacks, profiler=profiler)
         self._cbh.execute_callbacks(ExecPoint.BEFORE_INIT)
+        from picamera2 import Picamera2 as PiCamera
+        from libcamera import Transform, controls
+
         if hvflip:
             transform = Transform(vflip=True, hflip=True)
         else:
             transform = Transform()
         self.cam = PiCamera(*args, **kwargs)
-        self.config = self.cam.create_still_configuration(main={'size':resolution}, transform=transform)
+        self._closed = False
+        self.stream = stream
+        config_kwargs = dict(transform=transform)
+        crop_limits = self.cam.camera_properties['ScalerCropMaximum']
+        if sensor_mode is not None:
+            modes = self.cam.sensor_modes
+            if not 0 <= sensor_mode < len(modes):
+                sizes = [f'{i}: {m["size"]} {m["bit_depth"]} bit' for i, m in enumerate(modes)]
+                raise RuntimeError(f'Unknown sensor mode {sensor_mode}, choose from {sizes}.')
+            mode = modes[sensor_mode]
+            self._logger.info(f'Using sensor mode {sensor_mode}: {mode["size"]} {mode["bit_depth"]} bit.')
+            config_kwargs['sensor'] = {'output_size': mode['size'], 'bit_depth': mode['bit_depth']}
+            crop_limits = mode['crop_limits']
+        if roi is not None:
+            if hvflip:
+                # the crop is given in sensor coordinates, which are not flipped
+                x, y, w, h = roi
+                roi = (1 - x - w, 1 - y - h, w, h)
+            crop = roi_to_scaler_crop(roi, crop_limits)
+            resolution = fit_size(resolution, aspect=crop[2] / crop[3])
+            config_kwargs['controls'] = {'ScalerCrop': crop}
+            self._logger.info(f'Cropping to {crop} on the sensor, at {resolution} px.')
+        if stream:
+            # RGB888 is BGR byte order, matching OpenCV and ffmpeg's bgr24
+            self.config = self.cam.create_video_configuration(
+                main={'size': resolution, 'format': 'RGB888'}, **config_kwargs
+            )
+        else:
+            self.config = self.cam.create_still_configuration(main={'size':resolution}, **config_kwargs)
         self.cam.set_controls({'AwbMode': controls.AwbModeEnum.Indoor})
         self.cam.configure(self.config)
         self.cam.start()
@@ -57,10 +103,53 @@ class Cam(ABC):
         else:
             self._tmpdir = Path(str(tmpdir))
 
+    def __enter__(self) -> 'Cam':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Stop and release the camera. A Cam is a long-lived session: it stays configured and
+        streaming across any number of `record` calls until closed.
+        """
+        if getattr(self, '_closed', True):
+            return
+        self._closed = True
+        self._cbh.shutdown(wait=False)
         self.cam.stop()
         self.cam.close()
 
+    def add_callback(self, cb: Callback):
+        self._cbh.add_callback(cb)
+
+    def remove_callback(self, cb: Callback):
+        self._cbh.remove_callback(cb)
+
+    def get_timing_stats(self) -> Dict[str, Dict[str, Dict]]:
+        """Get latency stats of recording phases and callbacks. See `CallbackHandler.get_timing_stats`."""
+        return self._cbh.get_timing_stats()
+
+    def request_stop(self):
+        """
+        Ask a running `record` call to stop early. Cams that support this raise a
+        `concurrent.futures.CancelledError` from `record` once they have stopped.
+        A request made before `record` is called stops it right away, unless withdrawn
+        with `clear_stop_request`.
+        """
+        self._stop_requested.set()
+
+    def clear_stop_request(self):
+        """
+        Withdraw a pending stop request. Called by whoever starts a recording, before the
+        recording becomes stoppable, so that no request in between is lost.
+        """
+        self._stop_requested.clear()
+
     @abstractmethod
     def record(
         self,
@@ -1,43 +1,61 @@
+from typing import Dict, Optional
 from threading import Thread, Event
 from queue import Queue
 from io import BytesIO
 import time
 
-from PIL import Image
-
 from rpicam.cams.cam import Cam
 from rpicam.cams.callbacks import ExecPoint
-from rpicam.gui.viewer import Viewer
+from rpicam.gui.viewer import Viewer, PreviewFrame
+from rpicam.utils.frame_stats import FrameStats, FrameTiming
 
 
 class LivePreviewCam(Cam):
     """
     Cam for producing a live stream in a GUI window.
+
+    :param hvflip: whether to rotate camera 180 degrees.
+    :param debug_overlay: whether to show latency, fps and drop statistics in the GUI window.
+    :param stats_window: the number of most recent frames to compute statistics over.
     """
 
-    def __init__(self, hvflip: bool = False, *args, **kwargs):
+    def __init__(
+        self,
+        hvflip: bool = False,
+        debug_overlay: bool = False,
+        stats_window: int = 100,
+        *args,
+        **kwargs,
+    ):
         super().__init__(hvflip=hvflip, *args, **kwargs)
-        self._viewer = Viewer()
+        self._stats = FrameStats(window=stats_window)
+        self._viewer = Viewer(stats=self._stats, debug_overlay=debug_overlay)
         self._img_queue = Queue()
         self._event = Event()
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_INIT)
 
-    def _create_frame(self, *args, **kwargs) -> Image:
+    def _create_frame(self, *args, **kwargs) -> PreviewFrame:
         self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_FRAME_CAPTURE, cam=self.cam)
         stream = BytesIO()
         t0 = time.time()
-        self.cam.capture_file(stream, format='jpeg', *args, **kwargs)
+        metadata = self.cam.capture_file(stream, format='jpeg', *args, **kwargs)
+        timing = FrameTiming(captured=FrameTiming.now())
+        if isinstance(metadata, dict):
+            timing.sensor = FrameTiming.from_sensor_timestamp(metadata.get('SensorTimestamp'))
         t1 = time.time()
         self._logger.debug(f'Capturing took {t1 - t0} sec')
         stream.seek(0)
+        from PIL import Image
+
         img = Image.open(stream)
-        self._cbh.execute_callbacks(loc=ExecPoint.AFTER_FRAME_CAPTURE, cam=self.cam)
-        return img
+        self._cbh.execute_callbacks(loc=ExecPoint.AFTER_FRAME_CAPTURE, cam=self.cam, metadata=metadata)
+        return PreviewFrame(image=img, timing=timing)
 
     def _frame_producer(self, spf: int, *args, **kwargs):
         t0 = time.time()
         while not self._event.is_set():
             new_frame = self._create_frame(*args, **kwargs)
+            new_frame.timing.enqueued = FrameTiming.now()
             self._img_queue.put(new_frame)
             t1 = time.time()
             to_sleep = spf - (t1 - t0)
@@ -45,6 +63,15 @@ class LivePreviewCam(Cam):
             if to_sleep > 0:
                 time.sleep(to_sleep)
 
+    def get_stats(self) -> Dict[str, Optional[float]]:
+        """
+        Get rolling statistics of the live preview: achieved fps, displayed and dropped frame
+        counts, and p50/p95/p99 latencies in ms of the capture, queue and end-to-end stages.
+
+        :return: a flat dict of statistics, see `FrameStats.get_stats`.
+        """
+        return self._stats.get_stats()
+
     def record(
         self,
         spf: int = 5,
@@ -61,6 +88,7 @@ class LivePreviewCam(Cam):
         """
         self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_RECORD)
         self._event.clear()
+        self._stats.reset()
         frame_producer = Thread(
             target=self._frame_producer,
             args=args,
@@ -69,4 +97,5 @@ class LivePreviewCam(Cam):
         ).start()
         self._viewer.view_image_queue(self._img_queue)
         self._event.set()
+        self._logger.info(f'Preview statistics: {self.get_stats()}')
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_RECORD)
@@ -0,0 +1,102 @@
+from typing import List, Union
+from pathlib import Path
+
+from rpicam.cams.timelapse_cam import TimelapseCam
+from rpicam.cams.callbacks import ExecPoint
+from rpicam.utils.stack_encoder import StackEncoder
+
+
+class PanoramaTimelapseCam(TimelapseCam):
+    """
+    Timelapse Cam mounted on a Servo. Every interval, the servo sweeps through the given angles
+    and one frame is captured per position, building one stack per position. The stacks are
+    either encoded concurrently into one video per position, or stitched side by side into
+    a single video. The sweep direction alternates between intervals to minimize travel.
+
+    :param servo: The `Servo` moving the camera.
+    :param angles: The servo angles to capture a frame at, from left to right.
+    :param stitch: Whether to stitch the positions side by side into one video.
+    :param args: passed on to `TimelapseCam`.
+    :param kwargs: passed on to `TimelapseCam`.
+    """
+
+    TMPDIR_PREFIX = 'rpicam-panorama-'
+    POSITION_DIR_PREFIX = 'pos_'
+
+    def __init__(self, servo, angles: List[int], stitch: bool = False, *args, **kwargs):
+        if not len(angles):
+            raise RuntimeError('At least one panorama angle must be supplied.')
+        if kwargs.get('stream', False):
+            raise RuntimeError('Panorama timelapses cannot be captured from a stream.')
+        super().__init__(*args, **kwargs)
+        self.servo = servo
+        self.angles = list(angles)
+        self.stitch = stitch
+
+    def _position_dirs(self, stack_dir: Path) -> List[Path]:
+        return [stack_dir / f'{self.POSITION_DIR_PREFIX}{i}' for i in range(len(self.angles))]
+
+    def _capture_frame(self, stack_dir: Path, *args, frame_idx: int = None, **kwargs):
+        """
+        Sweeps the servo through all positions, capturing one frame into the stack of each.
+
+        :param stack_dir: The stack directory, containing one sub-directory per position.
+        :param frame_idx: The index of the interval.
+        :param args: passed on to `TimelapseCam._capture_frame`.
+        :param kwargs: passed on to `TimelapseCam._capture_frame`.
+        :return:
+        """
+        positions = list(zip(self.angles, self._position_dirs(stack_dir)))
+        if frame_idx is not None and frame_idx % 2 == 1:
+            positions = positions[::-1]
+        for angle, pos_dir in positions:
+            pos_dir.mkdir(exist_ok=True)
+            self.servo.move_to(angle)
+            super()._capture_frame(pos_dir, *args, frame_idx=frame_idx, **kwargs)
+
+    def _position_outfile(self, outfile: Path, stack_dir: Path, idx: int) -> Path:
+        if outfile is None:
+            return self._position_dirs(stack_dir)[idx] / 'out.mp4'
+        outfile = Path(str(outfile))
+        return outfile.with_name(f'{outfile.stem}_{self.POSITION_DIR_PREFIX}{idx}{outfile.suffix}')
+
+    def _start_encoders(self, stack_dir: Path, fps: int, outfile: Path) -> List[StackEncoder]:
+        callbacks = self._cbh.get_callbacks(exec_at=ExecPoint.AFTER_CONVERT)
+        pos_dirs = self._position_dirs(stack_dir)
+        if self.stitch:
+            encoders = [
+                StackEncoder(
+                    callbacks=callbacks,
+                    stack_dir=pos_dirs,
+                    fps=fps,
+                    outfile=outfile,
+                    profiler=self._cbh.profiler,
+                )
+            ]
+        else:
+            encoders = [
+                StackEncoder(
+                    callbacks=callbacks,
+                    stack_dir=pos_dir,
+                    fps=fps,
+                    outfile=self._position_outfile(outfile, stack_dir, i),
+                    profiler=self._cbh.profiler,
+                )
+                for i, pos_dir in enumerate(pos_dirs)
+            ]
+        for encoder in encoders:
+            encoder.start()
+        return encoders
+
+    def record(self, outfile: Path, *args, **kwargs) -> Union[Path, List[Path]]:
+        """
+        Records a panorama timelapse. See `TimelapseCam.record`.
+
+        :param outfile: The path of the video. If not stitching, one video per position is created
+                        next to it, with the position index appended to the file name.
+        :return: The path to the created video, or the paths of the per-position videos.
+        """
+        res = super().record(outfile, *args, **kwargs)
+        if self.stitch or outfile is None:
+            return res
+        return [self._position_outfile(outfile, None, i) for i in range(len(self.angles))]
@@ -1,21 +1,41 @@
-from typing import Optional, Union, List
+from typing import Dict, Optional, Sequence, Tuple, Union, List, TYPE_CHECKING
+from concurrent.futures import CancelledError
 from datetime import datetime, timedelta
-from time import sleep, time
+from time import time
 from pathlib import Path
 import shutil
 
-import ffmpeg
-
 from rpicam.cams.cam import Cam
 from rpicam.utils.stack_encoder import StackEncoder
-from rpicam.cams.callbacks import ExecPoint, Callback
+from rpicam.utils.pipe_encoder import PipeEncoder
+from rpicam.cams.callbacks import ExecPoint, Callback, ExposureLock
+from rpicam.utils.exposure_fusion import ExposureFuser
+from rpicam.utils.burst_averaging import accumulate_frame, average_frames
+from rpicam.utils import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class TimelapseCam(Cam):
+    """
+    Cam recording timelapse videos. Per default, frames are captured as still images into a
+    stack, which is encoded after capture. With `stream`, frames are grabbed from the running
+    video stream instead and encoded while capturing, allowing for sub-second frame intervals.
+
+    With `burst`, every frame is the average of a burst of captures, for less noise in low light.
+    Captures are summed straight from the camera buffers into a float buffer that is reused
+    across frames, so memory use does not grow with the burst length.
+
+    With `bracket`, every frame is fused from an exposure bracket instead, for a high dynamic
+    range. Fusion runs in `fusion_workers` processes, overlapping with capture of the next frame.
+    """
 
     DEFAULT_SLEEP_DUR = 1  # sec
     MAX_CONSEQ_OVERTIME_TIL_ERR = 3
     TMPDIR_PREFIX = 'rpicam-timelapse-'
+    BRACKET_SETTLE_FRAMES = 10
+    BRACKET_TOLERANCE = 0.05
 
     def __init__(
         self,
@@ -24,10 +44,17 @@ class TimelapseCam(Cam):
         capture_failover_strategy: str = 'skip',
         hvflip: bool = False,
         callbacks: List[Callback] = (),
+        burst: int = 1,
+        bracket: Sequence[float] = (),
+        fusion_workers: int = 2,
         # picamera settings
         *args,
         **kwargs,
     ):
+        if burst < 1:
+            raise RuntimeError(f'Burst length must be at least 1, got {burst}.')
+        if len(bracket) and (burst > 1 or kwargs.get('stream', False)):
+            raise RuntimeError('Exposure brackets cannot be combined with bursts or streaming.')
         super().__init__(
             verbose=verbose,
             tmpdir=tmpdir,
@@ -36,36 +63,206 @@ class TimelapseCam(Cam):
             *args,
             **kwargs,
         )
+        self._verbose = verbose
         self._capture_failover_strategy = capture_failover_strategy
         self._latest_frame_file: Optional[Path] = None
+        self._pipe_encoder: Optional[PipeEncoder] = None
+        self._fps = None
+        self._outfile = None
+        self.burst = burst
+        self._burst_buffer = None
+        self.bracket = tuple(bracket)
+        self._fusion_error: Optional[RuntimeError] = None
+        self._fuser = (
+            ExposureFuser(workers=fusion_workers, verbose=verbose, on_done=self._on_fused)
+            if len(bracket)
+            else None
+        )
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_INIT)
         self._conseq_overtime_count = 0
+        metrics.CONSECUTIVE_OVERTIME_LIMIT.set(TimelapseCam.MAX_CONSEQ_OVERTIME_TIL_ERR)
 
-    def _capture_frame(self, stack_dir: Path, *args, **kwargs):
+    def _capture_frame(
+        self,
+        stack_dir: Path,
+        *args,
+        frame_idx: int = None,
+        next_frame_at: float = None,
+        t_end: datetime = None,
+        **kwargs,
+    ):
         """
-        Captures a single frame for the timelapse stack.
+        Captures a single frame for the timelapse stack, or into the running encoder if streaming.
+        The capture metadata is passed on to `AFTER_FRAME_CAPTURE` callbacks as `metadata`.
 
         :param stack_dir: The save directory of the created image.
+        :param frame_idx: The index of the frame in the stack. Passed on to frame callbacks.
+        :param next_frame_at: The unix time at which the following frame is due.
+                              Passed on to frame callbacks.
+        :param t_end: The time at which capture of the stack ends. Passed on to frame callbacks.
         :param args: passed to PiCamera().capture()
         :param kwargs: passed to PiCamera().capture()
         :return:
         """
-        self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_FRAME_CAPTURE, cam=self.cam)
-        file_path = stack_dir / f'{datetime.now().timestamp()}.png'
-        self.cam.capture_file(str(file_path), *args, **kwargs)
-        if not file_path.is_file():
-            if self._capture_failover_strategy == 'heal' and self._latest_frame_file is not None:
-                shutil.copy(self._latest_frame_file, file_path)
-            elif self._capture_failover_strategy == 'skip':
-                pass
-            elif self._capture_failover_strategy == 'raise':
-                self._cbh.raise_with_callbacks(RuntimeError(f'Could not capture frame: {file_path}'))
-        self._cbh.execute_callbacks(loc=ExecPoint.AFTER_FRAME_CAPTURE, cam=self.cam)
+        frame_info = dict(frame_idx=frame_idx, next_frame_at=next_frame_at, t_end=t_end)
+        self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_FRAME_CAPTURE, cam=self.cam, **frame_info)
+        if self.stream:
+            metadata = self._stream_frame(stack_dir)
+        elif len(self.bracket):
+            self._raise_fusion_error()
+            metadata = self._capture_bracket(stack_dir / f'{datetime.now().timestamp()}.png')
+        else:
+            file_path = stack_dir / f'{datetime.now().timestamp()}.png'
+            if self.burst > 1:
+                from PIL import Image
+
+                frame, metadata = self._capture_burst()
+                Image.fromarray(frame).save(file_path)
+            else:
+                metadata = self.cam.capture_file(str(file_path), *args, **kwargs)
+            if file_path.is_file():
+                metrics.FRAMES_CAPTURED.inc()
+                self._latest_frame_file = file_path
+            else:
+                metrics.FRAMES_DROPPED.inc()
+                if self._capture_failover_strategy == 'heal' and self._latest_frame_file is not None:
+                    shutil.copy(self._latest_frame_file, file_path)
+                elif self._capture_failover_strategy == 'skip':
+                    pass
+                elif self._capture_failover_strategy == 'raise':
+                    self._cbh.raise_with_callbacks(RuntimeError(f'Could not capture frame: {file_path}'))
+        self._cbh.execute_callbacks(
+            loc=ExecPoint.AFTER_FRAME_CAPTURE, cam=self.cam, metadata=metadata, **frame_info
+        )
+
+    def _stream_frame(self, stack_dir: Path) -> dict:
+        """
+        Grabs the next completed frame of the running stream and queues it for encoding.
+        The encoder is started with the first frame of a recording.
+
+        :param stack_dir: The stack directory, holding the video if no outfile was given.
+        :return: The frame metadata.
+        """
+        if self.burst > 1:
+            frame, metadata = self._capture_burst()
+        else:
+            request = self.cam.capture_request()
+            try:
+                frame = request.make_array('main')
+                metadata = request.get_metadata()
+            finally:
+                # return the buffer to the camera before encoding
+                request.release()
+        if self._pipe_encoder is None:
+            height, width = frame.shape[:2]
+            self._pipe_encoder = PipeEncoder(
+                callbacks=self._cbh.get_callbacks(exec_at=ExecPoint.AFTER_CONVERT),
+                size=(width, height),
+                fps=self._fps,
+                outfile=self._outfile if self._outfile is not None else stack_dir / 'out.mp4',
+                profiler=self._cbh.profiler,
+                verbose=self._verbose,
+            )
+            self._pipe_encoder.start()
+        self._pipe_encoder.write(frame)
+        metrics.FRAMES_CAPTURED.inc()
+        return metadata
+
+    def _capture_burst(self) -> Tuple['np.ndarray', dict]:
+        """
+        Captures `burst` frames and averages them, accumulating in place from the mapped camera
+        buffers.
+
+        :return: The averaged frame as uint8 array, and the metadata of the last capture.
+        """
+        from picamera2 import MappedArray
+
+        metadata = {}
+        for i in range(self.burst):
+            request = self.cam.capture_request()
+            try:
+                with MappedArray(request, 'main', write=False) as m:
+                    self._burst_buffer = accumulate_frame(self._burst_buffer, m.array, first=i == 0)
+                metadata = request.get_metadata()
+            finally:
+                request.release()
+        return average_frames(self._burst_buffer, self.burst), metadata
+
+    def _get_exposure_lock(self) -> Optional[ExposureLock]:
+        for cb in self._cbh.get_callbacks(exec_at=ExecPoint.BEFORE_FRAME_CAPTURE) or ():
+            if isinstance(cb, ExposureLock) and cb.locked is not None:
+                return cb
+        return None
+
+    def _capture_bracket(self, file_path: Path) -> Dict:
+        """
+        Captures one frame per exposure of the bracket, relative to the locked exposure if an
+        ExposureLock is registered, else to the current AE exposure. AE is disabled during the
+        bracket, and the previous exposure settings are restored afterwards. The bracket is
+        then fused into `file_path` in the background.
+
+        :param file_path: The path to save the fused frame at.
+        :return: The metadata of the capture at the base exposure.
+        """
+        lock = self._get_exposure_lock()
+        if lock is not None:
+            base = lock.locked
+        else:
+            base = self.cam.capture_metadata()
+        exposure, gain = base['ExposureTime'], base['AnalogueGain']
+        frames = []
+        base_metadata = {}
+        try:
+            for ev in self.bracket:
+                target = int(exposure * 2 ** ev)
+                self.cam.set_controls({'AeEnable': False, 'ExposureTime': target, 'AnalogueGain': gain})
+                for _ in range(self.BRACKET_SETTLE_FRAMES):
+                    request = self.cam.capture_request()
+                    metadata = request.get_metadata()
+                    # controls take effect some frames after being set
+                    if abs(metadata.get('ExposureTime', target) - target) <= self.BRACKET_TOLERANCE * target:
+                        break
+                    request.release()
+                else:
+                    self._logger.warning(f'Exposure did not reach {target} us for bracket at {ev} EV.')
+                    request = self.cam.capture_request()
+                    metadata = request.get_metadata()
+                try:
+                    frames.append(request.make_array('main'))
+                finally:
+                    request.release()
+                if ev == 0 or not len(base_metadata):
+                    base_metadata = metadata
+        finally:
+            if lock is not None:
+                self.cam.set_controls({'AeEnable': False, **lock.locked})
+            else:
+                self.cam.set_controls({'AeEnable': True})
+        self._fuser.submit(frames, file_path)
+        return base_metadata
+
+    def _on_fused(self, file_path: Path, exc: Optional[BaseException]):
+        """
+        Apply the capture failover strategy to a failed fusion. Runs in a background thread,
+        so errors are raised on the next capture or when encoding, see `_raise_fusion_error`.
+        """
+        if exc is None:
+            self._latest_frame_file = file_path
+        elif self._capture_failover_strategy == 'heal' and self._latest_frame_file is not None:
+            shutil.copy(self._latest_frame_file, file_path)
+        elif self._capture_failover_strategy == 'raise' and self._fusion_error is None:
+            self._fusion_error = RuntimeError(f'Could not fuse frame: {file_path}')
+            self._fusion_error.__cause__ = exc
+
+    def _raise_fusion_error(self):
+        error, self._fusion_error = self._fusion_error, None
+        if error is not None:
+            self._cbh.raise_with_callbacks(error)
 
     def _record_stack(
         self,
         t_start: datetime,
-        sec_per_frame: int,
+        sec_per_frame: float,
         duration: timedelta = None,
         t_end: datetime = None,
         *args,
@@ -94,8 +291,8 @@ class TimelapseCam(Cam):
             t_end = t_start + duration
 
         # sleep until starting
-        while t_start > datetime.now():
-            sleep(TimelapseCam.DEFAULT_SLEEP_DUR)
+        while t_start > datetime.now() and not self._stop_requested.is_set():
+            self._stop_requested.wait(TimelapseCam.DEFAULT_SLEEP_DUR)
 
         # create individual images in tmp_dir/stack_dir_name
         stack_dir_name = str(t_start.timestamp())
@@ -103,35 +300,86 @@ class TimelapseCam(Cam):
         stack_dir.mkdir()
         now = datetime.now()
         self._logger.info(f'Begin timelapse imaging.')
-        while t_end > now:
+        frame_idx = 0
+        while t_end > now and not self._stop_requested.is_set():
             t0 = time()
-            self._capture_frame(stack_dir=stack_dir, *args, **kwargs)
+            self._capture_frame(
+                stack_dir=stack_dir,
+                frame_idx=frame_idx,
+                next_frame_at=t0 + sec_per_frame,
+                t_end=t_end,
+                *args,
+                **kwargs,
+            )
+            frame_idx += 1
             t1 = time()
             capture_dur = t1 - t0
+            metrics.FRAME_CAPTURE_SECONDS.observe(capture_dur)
             sleeptime = sec_per_frame - capture_dur
             if sleeptime < 0:
                 overtime_err = (
                     f'sec_per_frame={sec_per_frame} but frame took {round(capture_dur, 2)} sec.'
                 )
+                metrics.FRAME_OVERTIME.inc()
 
                 if self._conseq_overtime_count >= TimelapseCam.MAX_CONSEQ_OVERTIME_TIL_ERR:
                     self._cbh.raise_with_callbacks(RuntimeError(overtime_err))
                 else:
                     self._logger.warning(overtime_err)
                     self._conseq_overtime_count += 1
+                    metrics.CONSECUTIVE_OVERTIME.set(self._conseq_overtime_count)
             else:
                 self._conseq_overtime_count = 0
-                sleep(sleeptime)
+                metrics.CONSECUTIVE_OVERTIME.set(0)
+                self._stop_requested.wait(sleeptime)
             now = datetime.now()
         self._logger.info('Finished timelapse imaging.')
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_STACK_CAPTURE)
         return stack_dir
 
+    def _start_encoders(
+        self, stack_dir: Path, fps: int, outfile: Path
+    ) -> List[Union[StackEncoder, PipeEncoder]]:
+        """
+        Start encoding the captured stack in the background. If streaming, finish encoding instead.
+
+        :param stack_dir: The directory containing the captured stack.
+        :param fps: The frames per second of the to be created video.
+        :param outfile: The path at which to create the video.
+        :return: The started encoders.
+        """
+        if self._fuser is not None:
+            self._fuser.join()
+            self._raise_fusion_error()
+        if self.stream:
+            encoder, self._pipe_encoder = self._pipe_encoder, None
+            if outfile is not None:
+                # frames went straight into the encoder, leaving the stack dir empty
+                shutil.rmtree(stack_dir, ignore_errors=True)
+            if encoder is None:
+                self._cbh.raise_with_callbacks(RuntimeError('No frames were captured.'))
+            encoder.close()
+            return [encoder]
+        encoder = StackEncoder(
+            callbacks=self._cbh.get_callbacks(exec_at=ExecPoint.AFTER_CONVERT),
+            stack_dir=stack_dir,
+            fps=fps,
+            outfile=outfile,
+            profiler=self._cbh.profiler,
+        )
+        encoder.start()
+        return [encoder]
+
+    def close(self):
+        if getattr(self, '_fuser', None) is not None:
+            self._fuser.close(wait=False)
+        super().close()
+
     def record(
         self,
         outfile: Path,
         fps: int = 24,
-        sec_per_frame: int = 10,
+        sec_per_frame: float = 10,
         t_start: datetime = None,
         duration: timedelta = None,
         t_end: datetime = None,
@@ -153,7 +401,10 @@ class TimelapseCam(Cam):
         :param args: passed to PiCamera().capture()
         :param kwargs: passed to PiCamera().capture()
         :return: The path to the created video file.
+        :raises CancelledError: if `request_stop` was called during capture. No video is created.
         """
+        self._fps = fps
+        self._outfile = outfile
         self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_RECORD)
         if t_start is None:
             t_start = datetime.now()
@@ -161,18 +412,35 @@ class TimelapseCam(Cam):
             raise RuntimeError('Recording start datetime is in the past.')
         else:
             pass
-        stack_dir = self._record_stack(
-            sec_per_frame=sec_per_frame,
-            t_start=t_start,
-            duration=duration,
-            t_end=t_end,
-            *args,
-            **kwargs,
-        )
-        encoder = StackEncoder(callbacks=self._cbh.get_callbacks(exec_at=ExecPoint.AFTER_CONVERT), stack_dir=stack_dir, fps=fps, outfile=outfile)
-        encoder.start()
+        try:
+            stack_dir = self._record_stack(
+                sec_per_frame=sec_per_frame,
+                t_start=t_start,
+                duration=duration,
+                t_end=t_end,
+                *args,
+                **kwargs,
+            )
+            if self._stop_requested.is_set():
+                self._stop_requested.clear()
+                if self._fuser is not None:
+                    self._fuser.join()
+                    self._fusion_error = None
+                if self._pipe_encoder is not None:
+                    self._pipe_encoder.abort()
+                    self._pipe_encoder = None
+                shutil.rmtree(stack_dir, ignore_errors=True)
+                self._logger.info('Recording was stopped before completion.')
+                raise CancelledError('Recording was stopped before completion.')
+            encoders = self._start_encoders(stack_dir=stack_dir, fps=fps, outfile=outfile)
+        finally:
+            # a failed recording must not leave its encoder to the next one
+            if self._pipe_encoder is not None:
+                self._pipe_encoder.abort()
+                self._pipe_encoder = None
         if wait_for_encoder:
             self._logger.info('Waiting for encoder to finish.')
-            encoder.join()
+            for encoder in encoders:
+                encoder.join()
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_RECORD)
         return outfile
@@ -21,8 +21,47 @@ def cam(args=None):
 
 
 @click.group(context_settings=dict(help_option_names=["-h", "--help"]))
-def cli(args=None):
-    pass
+@click_option(
+    '--log_queue',
+    is_flag=True,
+    help='Whether to write logs from a background thread, so that slow stderr never blocks recording.',
+)
+@click_option('--log_json', is_flag=True, help='Whether to write logs as JSON objects, one per line.')
+@click_option(
+    '--log_rate_limit',
+    type=float,
+    default=None,
+    help='If supplied, drop log messages repeated from the same line of code within this many seconds.',
+)
+@click_option(
+    '--metrics_textfile',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='If supplied, periodically write metrics in the Prometheus text format to this file, '
+    'e.g. for the node_exporter textfile collector.',
+)
+@click_option(
+    '--metrics_port',
+    type=int,
+    default=None,
+    help='If supplied, serve metrics in the Prometheus text format at http://localhost:PORT/metrics.',
+)
+def cli(log_queue, log_json, log_rate_limit, metrics_textfile, metrics_port, args=None):
+    if log_queue or log_json or log_rate_limit is not None:
+        from rpicam.utils.logging_utils import configure_logging
+
+        configure_logging(queued=log_queue, json_format=log_json, rate_limit=log_rate_limit)
+    if metrics_textfile is not None:
+        import atexit
+        from rpicam.utils.metrics import MetricsTextfileWriter
+
+        writer = MetricsTextfileWriter(metrics_textfile)
+        writer.start()
+        atexit.register(writer.stop)
+    if metrics_port is not None:
+        from rpicam.utils.metrics import MetricsServer
+
+        MetricsServer(metrics_port).start()
 
 
 cli.add_command(cam)
@@ -36,6 +75,18 @@ def default_servo_args(f):
         default=0,
         help='The initial angle for the servo. Valid choices are "load" from semi-persistent state (gets cleared at reboot), or the integer describing the angle.',
     )(f)
+    f = click_option(
+        '--servo_speed',
+        type=float,
+        default=300.0,
+        help='The assumed servo speed in degrees per second. Determines how long each move waits to settle.',
+    )(f)
+    f = click_option(
+        '--servo_easing',
+        type=click.Choice(['none', 'linear', 'cosine']),
+        default='none',
+        help='The servo trajectory: jump directly to the target angle, or ramp the duty cycle towards it.',
+    )(f)
     return f
 
 
@@ -53,12 +104,17 @@ def default_cam_args(f):
 @click_option('-c', '--cycle', is_flag=True, help='Whether to cycle the given command sequence.')
 @default_servo_args
 @click.argument('ops', type=str, nargs=-1)
-def move(ops, pin, cycle, init_angle, *args, **kwargs):
-    from rpicam.servo import Servo, ServoOpParser
+def move(ops, pin, cycle, init_angle, servo_speed, servo_easing, *args, **kwargs):
+    from rpicam.servo import Servo, ServoOpParser, MotionPlanner
     from rpicam.utils.state import State
 
     ops = [ServoOpParser.parse_servo_op(x) for x in ops]
-    s = Servo(pin, verbose=True, init_angle=init_angle)
+    s = Servo(
+        pin,
+        verbose=True,
+        init_angle=init_angle,
+        motion_planner=MotionPlanner(speed=servo_speed, easing=servo_easing),
+    )
     s.execute_sequence(ops, cycle=cycle)
     s.write_servo_angle(State())
 
@@ -67,43 +123,75 @@ def move(ops, pin, cycle, init_angle, *args, **kwargs):
 @click_option('-s', '--spf', type=float, default=0.5, help='Seconds per frame.')
 @click_option('--servo_pin_ad', type=int, default=7, help='Servo pin for AD axis.')
 @click_option('--servo_pin_ws', type=int, default=None, help='Servo pin for WS axis.')
+@click_option(
+    '--servo_coalesce_window',
+    type=float,
+    default=0.1,
+    help='Seconds to collect further key presses for before moving a servo. '
+    'Key presses arriving while a servo is moving are merged into a single move.',
+)
+@click_option(
+    '--debug_overlay',
+    is_flag=True,
+    help='Whether to show frame latency percentiles, fps and dropped frames in the preview window.',
+)
 @default_servo_args
 @default_cam_args
-def live(spf, servo_pin_ad, servo_pin_ws, init_angle, hvflip, *args, **kwargs):
-    from time import sleep
+def live(
+    spf,
+    servo_pin_ad,
+    servo_pin_ws,
+    servo_coalesce_window,
+    debug_overlay,
+    init_angle,
+    servo_speed,
+    servo_easing,
+    hvflip,
+    *args,
+    **kwargs,
+):
+    import asyncio
     from rpicam.cams import LivePreviewCam
-    from rpicam.platform import Platform
-    from rpicam.servo import Servo, ServoOpParser
+    from rpicam.platform import AsyncPlatform
+    from rpicam.servo import Servo, MotionPlanner
     from rpicam.utils.state import State
 
-    try:
-        lpc = LivePreviewCam(hvflip=hvflip)
-        lpc_args = dict(spf=spf)
-        servos = dict(
-            servo_ad=Servo(
-                servo_pin_ad,
-                verbose=True,
-                servo_name='A/D',
-                on_invalid_angle='ignore',
-                init_angle=init_angle,
+    async def run_live(lpc, servos, servo_name_ws):
+        async with AsyncPlatform(
+            cam=lpc, servos=servos, verbose=True, servo_coalesce_window=servo_coalesce_window
+        ) as p:
+            recording = p.start_recording(spf=spf)
+            keyboard = asyncio.ensure_future(
+                p.keyboard_control(servo_name_ad='servo_ad', servo_name_ws=servo_name_ws)
             )
+            await recording  # ends when the preview window is closed
+            keyboard.cancel()
+            await asyncio.gather(keyboard, return_exceptions=True)
+
+    servos = {}
+    try:
+        lpc = LivePreviewCam(hvflip=hvflip, debug_overlay=debug_overlay)
+        servos['servo_ad'] = Servo(
+            servo_pin_ad,
+            verbose=True,
+            servo_name='A/D',
+            on_invalid_angle='ignore',
+            init_angle=init_angle,
+            motion_planner=MotionPlanner(speed=servo_speed, easing=servo_easing),
         )
         if servo_pin_ws:
             servo_name_ws = 'servo_ws'
             servos[servo_name_ws] = Servo(
-                servo_pin_ws, verbose=True, servo_name='W/S', on_invalid_angle='ignore', init_angle=init_angle
+                servo_pin_ws,
+                verbose=True,
+                servo_name='W/S',
+                on_invalid_angle='ignore',
+                init_angle=init_angle,
+                motion_planner=MotionPlanner(speed=servo_speed, easing=servo_easing),
             )
         else:
             servo_name_ws = None
-        p = Platform(cam=lpc, servos=servos, verbose=True)
-        p.start_recording(**lpc_args)
-        while True:
-            sleep(0.01)
-            wasd = ServoOpParser.interpret_wasd(
-                servo_name_ad='servo_ad', servo_name_ws=servo_name_ws
-            )
-            if wasd is not None:
-                p.submit_servo_sequence(wasd[0], [wasd[1]])
+        asyncio.run(run_live(lpc, servos, servo_name_ws))
 
     except KeyboardInterrupt:
         pass
@@ -113,72 +201,184 @@ def live(spf, servo_pin_ad, servo_pin_ws, init_angle, hvflip, *args, **kwargs):
             servos[k].write_servo_angle(State())
 
 
+UPLOAD_WAIT_TIMEOUT = 300  # sec
+
+
 def _timelapse(
     duration,
     spf,
     fps,
     resolution,
-    outfile,
+    outfiles,
     servo_ops,
     servo_pin,
     cycle_servo_ops,
+    sync_servo_ops,
+    panorama_angles,
+    stitch_panorama,
     init_angle,
+    servo_speed,
+    servo_easing,
     hvflip,
     post_to_tg,
+    stream=False,
+    roi=None,
+    sensor_mode=None,
+    burst=1,
+    bracket_ev=(),
+    fusion_workers=2,
+    lock_exposure=False,
+    remeter_interval=None,
+    remeter_lux_drift=None,
+    profile=None,
+    profile_mode='cprofile',
     tmpdir=None,
     wait_for_encoder=False,
     *args,
     **kwargs,
 ):
+    """
+    Record one timelapse per given output file, all in one camera session: the camera, servo
+    and platform are set up once, so that consecutive files join without startup cost or
+    exposure jumps. Servo sequences restart with every file, unless cycling.
+    """
     from datetime import timedelta
-    from rpicam.cams import TimelapseCam, AnnotateFrameWithDt, PostToTg
+    from rpicam.cams import (
+        TimelapseCam,
+        PanoramaTimelapseCam,
+        AnnotateFrameWithDt,
+        PostToTg,
+        FrameSyncedServoProgram,
+        ExposureLock,
+    )
     from rpicam.platform import Platform
-    from rpicam.servo import Servo
+    from rpicam.servo import Servo, MotionPlanner, ServoProgram
     from rpicam.servo import ServoOpParser
     from rpicam.utils.state import State
+    from rpicam.utils.profiling import PhaseProfiler
 
     callbacks = [AnnotateFrameWithDt()]
+    if lock_exposure:
+        exposure_lock = ExposureLock(
+            remeter_interval=remeter_interval, lux_drift=remeter_lux_drift, verbose=True
+        )
+        callbacks.extend([exposure_lock, exposure_lock.monitor])
+    post_to_tg_cb = None
     if post_to_tg:
-        callbacks.append(PostToTg())
+        post_to_tg_cb = PostToTg()
+        callbacks.append(post_to_tg_cb)
+
+    if servo_ops and panorama_angles:
+        raise RuntimeError('Servo operations cannot be combined with panorama mode.')
+    servo = None
+    if servo_ops or panorama_angles:
+        servo = Servo(
+            servo_pin,
+            verbose=True,
+            init_angle=init_angle,
+            motion_planner=MotionPlanner(speed=servo_speed, easing=servo_easing),
+        )
+    synced = None
+    if servo_ops:
+        servo_ops = servo_ops.split(' ')
+        servo._logger.info(
+            f'Will execute sequence: {servo_ops}{", cycling" if cycle_servo_ops else ""}'
+            f'{", synchronized to frames" if sync_servo_ops else ""}'
+        )
+        servo_ops = [ServoOpParser.parse_servo_op(x) for x in servo_ops]
+        if sync_servo_ops:
+            program = ServoProgram.from_sequence(servo, servo_ops, cycle=cycle_servo_ops)
+            synced = FrameSyncedServoProgram(servo, program, verbose=True)
+            callbacks.extend([synced, synced.blocker])
 
-    cam = TimelapseCam(
+    profiler = PhaseProfiler(profile, mode=profile_mode) if profile is not None else None
+    cam_kwargs = dict(
         callbacks=callbacks,
         verbose=True,
         hvflip=hvflip,
         resolution=resolution,
         tmpdir=tmpdir,
+        profiler=profiler,
+        stream=stream,
+        roi=roi,
+        sensor_mode=sensor_mode,
+        burst=burst,
+        bracket=bracket_ev,
+        fusion_workers=fusion_workers,
     )
-    cam_args = dict(
-        fps=fps,
-        duration=timedelta(minutes=duration),
-        sec_per_frame=spf,
-        outfile=outfile,
-        wait_for_encoder=wait_for_encoder,
-    )
-    if servo_ops:
-        servo = Servo(servo_pin, verbose=True, init_angle=init_angle)
-        servo_ops = servo_ops.split(' ')
-        servo._logger.info(
-            f'Will execute sequence: {servo_ops}{", cycling" if cycle_servo_ops else ""}'
+    if panorama_angles:
+        cam = PanoramaTimelapseCam(
+            servo=servo, angles=panorama_angles, stitch=stitch_panorama, **cam_kwargs
         )
-        servo_ops = [ServoOpParser.parse_servo_op(x) for x in servo_ops]
-
-        p = Platform(cam=cam, servos={'s': servo}, verbose=True)
-        p.start_recording(**cam_args)
-        p.submit_servo_sequence(servo_name='s', sequence=servo_ops, cycle=cycle_servo_ops)
-        p.poll_cam_result()
-        servo.write_servo_angle(State())
-
     else:
-        cam.record(**cam_args)
-
+        cam = TimelapseCam(**cam_kwargs)
+    platform = None
+    if servo_ops and not sync_servo_ops:
+        platform = Platform(cam=cam, servos={'s': servo}, verbose=True)
+    cycling = False
+
+    fut = None
+    with cam:
+        try:
+            for outfile in outfiles:
+                cam_args = dict(
+                    fps=fps,
+                    duration=timedelta(minutes=duration),
+                    sec_per_frame=spf,
+                    outfile=outfile,
+                    wait_for_encoder=wait_for_encoder,
+                )
+                if platform is not None:
+                    fut = platform.start_recording(keep_alive=True, **cam_args)
+                    if not cycling:
+                        platform.submit_servo_sequence(
+                            servo_name='s', sequence=servo_ops, cycle=cycle_servo_ops
+                        )
+                        cycling = cycle_servo_ops
+                    fut.result()
+                else:
+                    if synced is not None and not cycle_servo_ops:
+                        synced.reset()
+                    cam.record(**cam_args)
+                if servo is not None:
+                    servo.write_servo_angle(State())
+        except BaseException:
+            # e.g. interrupted: end a recording queued or running on the platform's camera thread
+            if fut is not None:
+                fut.stop()
+            raise
+        finally:
+            if platform is not None:
+                platform.close()
+        if profiler is not None:
+            from pprint import pformat
+
+            cam._logger.info(f'Timing stats:\n{pformat(cam.get_timing_stats())}')
+            if profile != 'convert' or stream:
+                # stack encoders convert in their own process, which writes its own results
+                profiler.dump()
+    if post_to_tg_cb is not None and wait_for_encoder:
+        # uploads still failing are resumed by the next invocation posting to Telegram
+        post_to_tg_cb.queue.join(timeout=UPLOAD_WAIT_TIMEOUT)
 
 
 @cam.command('timelapse', short_help='Create a timelapse video.')
 @click_option(
     '-d', '--duration', type=int, default=120, help='The total recording duration in min.'
 )
-@click_option('-s', '--spf', type=int, default=10, help='The time between frames in seconds.')
+@click_option(
+    '-s',
+    '--spf',
+    type=float,
+    default=10,
+    help='The time between frames in seconds. Use --stream for sub-second intervals.',
+)
+@click_option(
+    '--stream',
+    is_flag=True,
+    help='Whether to grab frames from a continuous video stream and encode them while capturing, '
+    'instead of capturing and storing still images. Allows for intervals down to the sensor frame rate.',
+)
 @click_option(
     '-f', '--fps', type=int, default=30, help='The number of frames per second in the final video.'
 )
@@ -213,6 +413,24 @@ def _timelapse(
     is_flag=True,
     help='Whether to cycle the given servo operations during timelapse recording.',
 )
+@click_option(
+    '--sync_servo_ops',
+    is_flag=True,
+    help='Whether to schedule servo operations against the frame deadlines, moving only between '
+    'captures and delaying the next capture until the servo has settled.',
+)
+@click_option(
+    '--panorama_angles',
+    type=int,
+    multiple=True,
+    help='Servo angle to capture a frame at in every interval. Repeat for multiple positions '
+    'to record a panorama timelapse, producing one video per position.',
+)
+@click_option(
+    '--stitch_panorama',
+    is_flag=True,
+    help='Whether to stitch the panorama positions side by side into a single video.',
+)
 @click_option(
     '--rotating',
     is_flag=True,
@@ -225,33 +443,138 @@ def _timelapse(
     default=50,
     help='The fill percentage at which oldest files are beginning to be rotated out. Only used when --rotating.'
 )
+@click_option(
+    '--rotate_max_gb',
+    type=float,
+    default=None,
+    help='The total size in GB of stored files at which oldest files are beginning to be rotated out. '
+    'Only used when --rotating.'
+)
+@click_option(
+    '--rotate_max_days',
+    type=float,
+    default=None,
+    help='The age in days after which stored files are rotated out. Only used when --rotating.'
+)
+@click_option(
+    '--retention_tier',
+    type=str,
+    multiple=True,
+    help='A retention tier as MIN_AGE_DAYS[:key=value,...] with keys scale, fps, bitrate and decimate, '
+    'e.g. 7:scale=0.5,decimate=2. Stored files older than MIN_AGE_DAYS are re-encoded in the background '
+    'at lower fidelity. Repeat for multiple tiers by ascending age. Files of the last tier are rotated '
+    'out first. Only used when --rotating.'
+)
 @click_option(
     '--post_to_tg',
     is_flag=True,
     help='Whether to upload the finalized file to Telegram. chat ID to post to and API token must be saved in the'
     ' environment as RPICAM_TG_CHAT_ID and RPICAM_TG_API_TOKEN, respectively.'
 )
+@click_option(
+    '--roi',
+    type=float,
+    nargs=4,
+    default=None,
+    help='A region of interest (x, y, width, height) relative to the full field of view, e.g. '
+    '0.25 0.25 0.5 0.5 for the center. Only this region is captured, fitted into --resolution.',
+)
+@click_option(
+    '--sensor_mode',
+    type=int,
+    default=None,
+    help='The index of the sensor mode to use, e.g. a binned one for faster captures. '
+    'Invalid indices list the available modes.',
+)
+@click_option(
+    '--burst',
+    type=int,
+    default=1,
+    help='The number of captures to average into every frame, for less noise in low light.',
+)
+@click_option(
+    '--bracket_ev',
+    type=float,
+    multiple=True,
+    help='An exposure offset in EV to capture in every interval, e.g. -2. Repeat for an exposure bracket, '
+    'fused into one high dynamic range frame per interval.',
+)
+@click_option(
+    '--fusion_workers',
+    type=int,
+    default=2,
+    help='The number of processes fusing exposure brackets. Only used with --bracket_ev.',
+)
+@click_option(
+    '--lock_exposure',
+    is_flag=True,
+    help='Whether to meter exposure and white balance before the first frame, then lock them, '
+    'for steadier frames and faster captures.',
+)
+@click_option(
+    '--remeter_interval',
+    type=float,
+    default=600,
+    help='The time in seconds after which to meter again. Only used when --lock_exposure.',
+)
+@click_option(
+    '--remeter_lux_drift',
+    type=float,
+    default=0.5,
+    help='The relative change in scene luminance after which to meter again, e.g. 0.5 for 50%. '
+    'Only used when --lock_exposure.',
+)
+@click_option(
+    '--profile',
+    type=click.Choice(['init', 'record', 'stack_capture', 'frame_capture', 'convert']),
+    default=None,
+    help='A phase to profile during every occurrence. Results are written to the working directory, '
+    'and timing stats of all phases and callbacks are logged after recording.',
+)
+@click_option(
+    '--profile_mode',
+    type=click.Choice(['cprofile', 'tracemalloc']),
+    default='cprofile',
+    help='Whether to profile CPU time with cProfile or memory allocations with tracemalloc.',
+)
 @default_servo_args
 @default_cam_args
-def timelapse(out, rotating, rotate_fill_perc, *args, **kwargs):
+def timelapse(
+    out, rotating, rotate_fill_perc, rotate_max_gb, rotate_max_days, retention_tier, *args, **kwargs
+):
     from pathlib import Path
+    from datetime import timedelta
     import tempfile
     from rpicam.utils.rotating_storage import RotatingStorage
+    from rpicam.utils.tiered_retention import TieredRetention, RetentionTier
 
     tmpdir_holder = tempfile.TemporaryDirectory(prefix='rpicam-timelapse-')
     tmpdir = Path(str(tmpdir_holder.name))
 
     if rotating:
-        # persistent tmpdir across iterations to allow for stack encoder to run in background thread
+        # one camera session and persistent tmpdir across files, with encoders running in the background
         outdir = Path(str(out)).stem
-        rot = RotatingStorage(outdir, file_ext='.mp4', file_prefix='timelapse', rotate_fill_perc=rotate_fill_perc)
+        retention = None
+        if len(retention_tier):
+            retention = TieredRetention([RetentionTier.parse(t) for t in retention_tier], verbose=True)
+        rot = RotatingStorage(
+            outdir,
+            file_ext='.mp4',
+            file_prefix='timelapse',
+            rotate_fill_perc=rotate_fill_perc,
+            max_bytes=int(rotate_max_gb * 1e9) if rotate_max_gb is not None else None,
+            max_age=timedelta(days=rotate_max_days) if rotate_max_days is not None else None,
+            retention=retention,
+        )
         try:
-            for filename in rot:
-                _timelapse(tmpdir=tmpdir, outfile=filename, *args, **kwargs)
+            _timelapse(tmpdir=tmpdir, outfiles=rot, *args, **kwargs)
         except KeyboardInterrupt:
             pass
+        finally:
+            if retention is not None:
+                retention.close()
     else:
-        _timelapse(tmpdir=tmpdir, outfile=out, wait_for_encoder=True, *args, **kwargs)
+        _timelapse(tmpdir=tmpdir, outfiles=[out], wait_for_encoder=True, *args, **kwargs)
 
 
 def main():
@@ -1 +1,21 @@
-from .viewer import Viewer
+# Members are imported lazily on first access, see rpicam.cams.
+import importlib
+
+_LAZY_MEMBERS = {
+    'Viewer': '.viewer',
+    'PreviewFrame': '.viewer',
+}
+
+__all__ = list(_LAZY_MEMBERS)
+
+
+def __getattr__(name):
+    if name not in _LAZY_MEMBERS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_MEMBERS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
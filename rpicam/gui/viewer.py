@@ -1,19 +1,37 @@
-from typing import Union
+from typing import Union, NamedTuple, TYPE_CHECKING
 from pathlib import Path
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread
-import tkinter as tk
 
-from PIL import ImageTk, Image
+from rpicam.utils.frame_stats import FrameStats, FrameTiming
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+class PreviewFrame(NamedTuple):
+    """
+    A frame to be displayed in the live view, with its timing information.
+
+    :param image: the PIL image to display.
+    :param timing: the timestamps collected for this frame so far.
+    """
+
+    image: 'Image.Image'
+    timing: FrameTiming
 
 
 class Viewer:
 
     TITLE = 'RPiCam Viewer'
+    OVERLAY_REFRESH_MS = 500
 
-    def __init__(self):
+    def __init__(self, stats: FrameStats = None, debug_overlay: bool = False):
         self._root = None
         self._live_view_panel = None
+        self._overlay_panel = None
+        self._debug_overlay = debug_overlay
+        self.stats = stats if stats is not None else FrameStats()
 
     @staticmethod
     def view_image(path: Union[str, Path]):
@@ -23,6 +41,9 @@ class Viewer:
         :param path: the path to the image to display.
         :returns: None
         """
+        import tkinter as tk
+        from PIL import ImageTk, Image
+
         root = tk.Tk()
         root.title(Viewer.TITLE)
         img = Image.open(path)
@@ -35,28 +56,61 @@ class Viewer:
         # canvas.create_image(0, 0, anchor=tk.NW, image=img)
         root.mainloop()
 
+    def _get_latest_frame(self, queue: Queue) -> PreviewFrame:
+        """
+        Block until a frame is available, then skip ahead to the most recent one.
+        Skipped frames are counted as dropped.
+        """
+        frame = queue.get()
+        queue.task_done()
+        while True:
+            try:
+                newer = queue.get_nowait()
+            except Empty:
+                return frame
+            queue.task_done()
+            self.stats.record_dropped()
+            frame = newer
+
     def _image_queue_consumer(self, queue: Queue):
+        import tkinter as tk
+        from PIL import ImageTk
+
         if self._root is None:
             raise RuntimeError('An active Tk root is required.')
         while True:
-            img = queue.get()
-            img = ImageTk.PhotoImage(img)
+            frame = self._get_latest_frame(queue)
+            img = ImageTk.PhotoImage(frame.image)
             if self._live_view_panel is None:
                 self._live_view_panel = tk.Label(image=img)
                 self._live_view_panel.pack(side='left')
             else:
                 self._live_view_panel.configure(image=img)
                 self._live_view_panel.image = img
-            queue.task_done()
+            frame.timing.displayed = FrameTiming.now()
+            self.stats.record_displayed(frame.timing)
+
+    def _refresh_overlay(self):
+        self._overlay_panel.configure(text=self.stats.format_overlay())
+        self._root.after(self.OVERLAY_REFRESH_MS, self._refresh_overlay)
 
     def view_image_queue(self, queue: Queue):
         """
-        Display Images from the given queue in a Tk GUI window.
+        Display frames from the given queue in a Tk GUI window. If the display falls behind,
+        only the most recent frame is shown and the others are counted as dropped.
 
-        :param queue: A Queue containing PIL images.
+        :param queue: A Queue containing `PreviewFrame`s.
         :return: None
         """
+        import tkinter as tk
+
         self._root = tk.Tk()
         self._root.title(Viewer.TITLE)
+        if self._debug_overlay:
+            self._overlay_panel = tk.Label(
+                self._root, justify='left', anchor='nw', font=('TkFixedFont', 9)
+            )
+            self._overlay_panel.pack(side='bottom', fill='x')
+            self._refresh_overlay()
         Thread(target=self._image_queue_consumer, args=(queue,), daemon=True).start()
         self._root.mainloop()
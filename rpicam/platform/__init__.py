@@ -1 +1,2 @@
-from .platform import Platform
+from .platform import Platform, CoordinatedMove, RecordingFuture, SequenceCoalescer
+from .async_platform import AsyncPlatform
@@ -0,0 +1,264 @@
+from typing import Dict, Tuple, Optional, Any
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from functools import partial
+from threading import Event, Lock
+import asyncio
+
+from rpicam.cams.cam import Cam
+from rpicam.servo.servo import Servo
+from rpicam.servo.servo_ops import ServoOpParser
+from rpicam.platform.platform import CoordinatedMove, SequenceCoalescer
+from rpicam.utils.keyboard_input import KeyboardReader
+from rpicam.utils.logging_utils import get_logger
+from rpicam.utils.upload_queue import UploadQueue
+
+
+class AsyncPlatform:
+    """
+    Runs a Cam and any number of Servos as tasks on one asyncio event loop.
+    Blocking hardware calls are run in executors: one thread for the camera and one per servo,
+    so that each device only ever executes one call at a time. Use as an async context manager;
+    all tasks are cancelled and all executors shut down on exit. Running servo sequences,
+    including cycled ones, are stopped before their next op.
+
+    :param cam: The Cam to record with.
+    :param servos: The Servos to control, by name.
+    :param verbose: whether to write info logs to stderr.
+    :param servo_coalesce_window: Seconds to wait for further servo sequences after receiving one.
+                                  Queued sequences consisting only of moves are merged into a
+                                  single move to their combined target angle.
+                                  If None, execute every sequence separately.
+    """
+
+    def __init__(
+        self,
+        cam: Cam,
+        servos: Dict[Tuple[str, str], Servo] = None,
+        verbose: bool = False,
+        servo_coalesce_window: Optional[float] = 0.0,
+    ):
+        self.cam = cam
+        self.servos = servos if servos is not None else {}
+        self.servo_coalesce_window = servo_coalesce_window
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+        self._loop = None
+        self._cam_executor = None
+        self._io_executor = None
+        self._servo_executors = {}
+        self._servo_qs = {}
+        self._cycling = set()
+        self._servo_stop = Event()
+        self._tasks = []
+
+    async def __aenter__(self) -> 'AsyncPlatform':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        """Start the servo worker tasks on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._servo_stop.clear()
+        self._cam_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cam')
+        self._io_executor = ThreadPoolExecutor(thread_name_prefix='io')
+        for sn in self.servos.keys():
+            self._servo_executors[sn] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'servo-{sn}'
+            )
+            self._servo_qs[sn] = asyncio.Queue()
+            self._tasks.append(asyncio.ensure_future(self._servo_worker(sn)))
+
+    async def close(self):
+        """Cancel all tasks started by this platform and wait for running hardware calls to end."""
+        if self._loop is None:
+            return  # never started
+        # cancelling a task does not interrupt its executor call, so end servo sequences early
+        self._servo_stop.set()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        executors = [self._cam_executor, self._io_executor, *self._servo_executors.values()]
+        await self._loop.run_in_executor(
+            None, lambda: [ex.shutdown(wait=True) for ex in executors if ex is not None]
+        )
+        self._servo_executors = {}
+        self._servo_qs = {}
+        self._cycling = set()
+        self._loop = None
+
+    def _forget_task(self, task: asyncio.Task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.append(task)
+        task.add_done_callback(self._forget_task)
+        return task
+
+    async def _run_servo_call(self, servo_name: Tuple[str, str], fn, *args, **kwargs):
+        return await self._loop.run_in_executor(
+            self._servo_executors[servo_name], partial(fn, *args, **kwargs)
+        )
+
+    async def _servo_worker(self, servo_name: Tuple[str, str]):
+        q = self._servo_qs[servo_name]
+        servo = self.servos[servo_name]
+        held_back = None
+        while True:
+            job = held_back if held_back is not None else await q.get()
+            held_back = None
+            if isinstance(job, CoordinatedMove):
+                await self._run_servo_call(servo_name, job.run, servo_name)
+                continue
+            coalescer = SequenceCoalescer(servo)
+            if self.servo_coalesce_window is None or not coalescer.add(job):
+                args, kwargs = job
+                await self._run_servo_call(
+                    servo_name, servo.execute_sequence, *args, stop=self._servo_stop, **kwargs
+                )
+                continue
+
+            deadline = self._loop.time() + self.servo_coalesce_window
+            while True:
+                try:
+                    nxt = q.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - self._loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        nxt = await asyncio.wait_for(q.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if not coalescer.add(nxt):
+                    held_back = nxt
+                    break
+            if coalescer.n_merged > 1:
+                self._logger.info(f'Coalesced {coalescer.n_merged} servo sequences for {servo_name}.')
+            await self._run_servo_call(servo_name, servo.run_servo_op, coalescer.op)
+
+    async def record(self, *args, **kwargs) -> Any:
+        """
+        Record on `self.cam` with the given arguments, in the camera executor.
+        Recordings submitted while another one is running are executed afterwards.
+        Cancelling asks the Cam to stop the running recording early.
+
+        :param args: arguments passed on to `self.cam.record()`
+        :param kwargs: keyword arguments passed on to `self.cam.record()`
+        :return: The result of `self.cam.record()`.
+        """
+        lock = Lock()
+        state = dict(started=False, cancelled=False)
+
+        def run_record():
+            with lock:
+                if state['cancelled']:
+                    raise CancelledError('Recording was cancelled before it started.')
+                self.cam.clear_stop_request()
+                state['started'] = True
+            return self.cam.record(*args, **kwargs)
+
+        self._logger.info(f'Starting recording: args={args}, kwargs={kwargs}')
+        try:
+            res = await self._loop.run_in_executor(self._cam_executor, run_record)
+        except asyncio.CancelledError:
+            with lock:
+                state['cancelled'] = True
+                if state['started']:
+                    self.cam.request_stop()
+            raise
+        self._logger.info('Recording done.')
+        return res
+
+    def start_recording(self, *args, **kwargs) -> asyncio.Task:
+        """
+        Start recording on `self.cam` in a task. See `record`.
+
+        :return: The task, resolving to the result of `self.cam.record()`.
+        """
+        return self._spawn(self.record(*args, **kwargs))
+
+    def submit_servo_sequence(self, servo_name: Tuple[str, str], *args, **kwargs):
+        """
+        Submit a servo operation sequence to the servo with name `servo_name`.
+
+        :param servo_name: The name of the servo as given in `self.servos`.
+        :param args: arguments passed on to the `execute_sequence` function of the requested servo.
+        :param kwargs: keyword arguments passed on the the `execute_sequence` function of the requested servo.
+        """
+        if SequenceCoalescer.is_cycled((args, kwargs)):
+            self._cycling.add(servo_name)
+        self._servo_qs[servo_name].put_nowait((args, kwargs))
+
+    async def move_servos(self, targets: Dict[Tuple[str, str], int]):
+        """
+        Move several servos to absolute angles concurrently, such that they arrive together.
+        The move starts once all given servos have finished their previously submitted sequences.
+        Servos that were submitted a cycled sequence cannot be moved. See `Platform.move_servos`.
+
+        :param targets: The target angle for each servo, by name as given in `self.servos`.
+        """
+        unknown = [sn for sn in targets if sn not in self.servos]
+        if unknown:
+            raise RuntimeError(f'Unknown servo names: {unknown}')
+        cycling = [sn for sn in targets if sn in self._cycling]
+        if cycling:
+            raise RuntimeError(f'Cannot move servos running a cycled sequence: {cycling}')
+        move = CoordinatedMove(self.servos, targets)
+        for sn in move.targets:
+            self._servo_qs[sn].put_nowait(move)
+        await self._loop.run_in_executor(self._io_executor, move.wait)
+
+    async def keyboard_control(
+        self,
+        servo_name_ad: Tuple[str, str],
+        servo_name_ws: Tuple[str, str] = None,
+        reader: KeyboardReader = None,
+    ):
+        """
+        Control servos with WASD key presses until cancelled. The keyboard is watched with an
+        event loop reader, so no time is spent while no key is pressed.
+
+        :param servo_name_ad: The name of the Servo to be controlled by the A/D keys.
+        :param servo_name_ws: The name of the Servo to be controlled by the W/S keys.
+        :param reader: The KeyboardReader to use. Defaults to one reading from stdin.
+        """
+        keys = asyncio.Queue()
+        reader = reader if reader is not None else KeyboardReader()
+
+        def on_readable():
+            try:
+                for c in reader.read_available():
+                    keys.put_nowait(c)
+            except EOFError:
+                self._loop.remove_reader(reader.fileno())
+
+        with reader:
+            self._loop.add_reader(reader.fileno(), on_readable)
+            try:
+                while True:
+                    c = await keys.get()
+                    wasd = ServoOpParser.interpret_key(c, servo_name_ad, servo_name_ws)
+                    if wasd is not None:
+                        self.submit_servo_sequence(wasd[0], [wasd[1]])
+            finally:
+                self._loop.remove_reader(reader.fileno())
+
+    async def upload(self, path, queue: UploadQueue):
+        """
+        Queue a file for upload. Returns once the upload is journaled; it is then uploaded and
+        retried on failure by the queue's worker, which must be started by the caller.
+
+        :param path: The file to upload.
+        :param queue: The persistent `UploadQueue` to upload through.
+        """
+        await self._loop.run_in_executor(self._io_executor, queue.put, path)
+
+    def start_upload(self, path, queue: UploadQueue) -> asyncio.Task:
+        """Start queueing a file for upload in a task. See `upload`."""
+        return self._spawn(self.upload(path, queue))
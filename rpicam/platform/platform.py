@@ -1,76 +1,317 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Optional, Callable
+from collections import deque
+from concurrent.futures import Future
 from queue import Queue, Empty
-from threading import Thread
-from time import sleep
+from threading import Thread, Barrier, BrokenBarrierError, Event, Lock
+from time import monotonic
 
 from rpicam.cams.cam import Cam
+from rpicam.cams.callbacks import RecordingProgress, ReportProgress
 from rpicam.servo.servo import Servo
+from rpicam.servo.servo_ops import ServoOp
 from rpicam.utils.logging_utils import get_logger
 
 
+def _get_sequence_args(args, kwargs) -> Tuple[Optional[List[ServoOp]], bool]:
+    """Get the sequence and cycle arguments of a job submitted for `Servo.execute_sequence`."""
+    sequence = args[0] if len(args) else kwargs.get('sequence')
+    cycle = args[1] if len(args) > 1 else kwargs.get('cycle', False)
+    return sequence, bool(cycle)
+
+
+class CoordinatedMove:
+    """
+    A move of several servos to absolute target angles, started together and stretched
+    to the travel time of the longest axis so that all servos arrive at the same time.
+
+    :param servos: The Servos to move, by name.
+    :param targets: The target angle for each servo, by name.
+    :param timeout: Seconds to wait for all servos to become idle before giving up.
+    """
+
+    def __init__(
+        self,
+        servos: Dict[Tuple[str, str], Servo],
+        targets: Dict[Tuple[str, str], int],
+        timeout: float = None,
+    ):
+        self.targets = dict(targets)
+        self.duration = None
+        self._servos = servos
+        self._ready_at = {}
+        self._start_at = None
+        self._start = Barrier(len(self.targets), action=self._plan, timeout=timeout)
+        self._done = Event()
+        self._remaining = len(self.targets)
+        self._lock = Lock()
+
+    def _plan(self):
+        self._start_at = max(self._ready_at.values())
+        self.duration = max(
+            self._servos[sn].motion_planner.travel_time(self._servos[sn].angle, angle)
+            for sn, angle in self.targets.items()
+        )
+
+    def run(self, servo_name: Tuple[str, str]):
+        """Move the given servo once all participating servos are ready. Called by servo workers."""
+        servo = self._servos[servo_name]
+        try:
+            self._ready_at[servo_name] = servo.backend.time()
+            self._start.wait()
+            # start together also on backends with per-thread clocks
+            servo.backend.wait_until(self._start_at)
+            servo.move_to(self.targets[servo_name], duration=self.duration)
+        except BrokenBarrierError:
+            pass
+        finally:
+            with self._lock:
+                self._remaining -= 1
+                if self._remaining == 0:
+                    self._done.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for all servos to finish the move.
+
+        :param timeout: Seconds to wait at most.
+        :return: Whether the move finished in time.
+        """
+        return self._done.wait(timeout)
+
+
+class SequenceCoalescer:
+    """
+    Merges servo jobs consisting only of moves into a single move to their combined target
+    angle. The servo workers of `Platform` and `AsyncPlatform` feed it all jobs arriving within
+    their coalescing window, until one cannot be merged.
+
+    :param servo: The Servo the jobs are submitted to.
+    """
+
+    def __init__(self, servo: Servo):
+        self.servo = servo
+        self.target = None
+        self.n_merged = 0
+
+    @staticmethod
+    def is_cycled(job) -> bool:
+        """Whether the job is a cycled sequence, which never ends."""
+        return not isinstance(job, CoordinatedMove) and _get_sequence_args(*job)[1]
+
+    @staticmethod
+    def get_sequence(job) -> Optional[Tuple[ServoOp, ...]]:
+        """
+        Get the sequence of a submitted servo job if it can be merged with others,
+        i.e. if it is not cycled and consists only of moves without sleeps.
+        """
+        if isinstance(job, CoordinatedMove):
+            return None
+        sequence, cycle = _get_sequence_args(*job)
+        if cycle or sequence is None:
+            return None
+        for op in sequence:
+            if op.sleep or (op.angle is None and op.sense is None):
+                return None
+        return tuple(sequence)
+
+    def add(self, job) -> bool:
+        """
+        Merge the given job, if possible.
+
+        :param job: A `CoordinatedMove`, or the args and kwargs of a sequence job.
+        :return: Whether the job was merged.
+        """
+        sequence = self.get_sequence(job)
+        if sequence is None:
+            return False
+        self.target = self.servo.resolve_target_angle(sequence, from_angle=self.target)
+        self.n_merged += 1
+        return True
+
+    @property
+    def op(self) -> ServoOp:
+        """The move to the combined target angle of all merged jobs."""
+        return ServoOp(angle=self.target)
+
+
+class RecordingFuture(Future):
+    """
+    Future of a recording submitted to a `Platform`. Cancelling a pending recording
+    removes it from the queue. Like any Future, a running recording cannot be cancelled;
+    use `stop` to end it early instead.
+    """
+
+    def __init__(self, cam: Cam):
+        super().__init__()
+        self._cam = cam
+
+    def stop(self) -> bool:
+        """
+        Cancel the recording if pending, or ask the Cam to stop it early if running. A stopped
+        recording resolves with a `CancelledError` once the Cam has stopped, without being
+        `cancelled()`.
+
+        :return: Whether the recording was cancelled or asked to stop.
+        """
+        if self.cancel():
+            return True
+        if self.running():
+            self._cam.request_stop()
+            return True
+        return False
+
+
 class Platform:
+    """
+    Runs a Cam and any number of Servos concurrently.
 
-    CAM_RES_POLL_TIMEOUT = 2
+    :param cam: The Cam to record with.
+    :param servos: The Servos to control, by name.
+    :param verbose: whether to write info logs to stderr.
+    :param servo_coalesce_window: Seconds to wait for further servo sequences after receiving one.
+                                  Queued sequences consisting only of moves are merged into a
+                                  single move to their combined target angle.
+                                  If None, execute every sequence separately.
+    """
 
     def __init__(
-        self, cam: Cam, servos: Dict[Tuple[str, str], Servo] = None, verbose: bool = False
+        self,
+        cam: Cam,
+        servos: Dict[Tuple[str, str], Servo] = None,
+        verbose: bool = False,
+        servo_coalesce_window: Optional[float] = 0.0,
     ):
         self.cam = cam
         self.servos = servos if servos is not None else {}
+        self.servo_coalesce_window = servo_coalesce_window
         self._logger = get_logger(self.__class__.__name__, verb=verbose)
         self._cam_in_q = Queue()
-        self._cam_out_q = Queue()
+        self._unpolled_recordings = deque()
         self._servo_in_qs = {k: Queue() for k in self.servos.keys()}
+        self._cycling = set()
         self._cam_thread = Thread(target=self._cam_worker, name='cam_worker', daemon=False)
         self._servo_threads = [
             Thread(target=self._servo_worker, kwargs=dict(servo_name=sn), daemon=True)
             for sn in self.servos.keys()
         ]
 
+        # the cam is set up on construction, so servos can start right away
         self._cam_thread.start()
-        sleep(Platform.CAM_RES_POLL_TIMEOUT)  # initial sleep for cam setup before servos start
-
         for st in self._servo_threads:
             st.start()
 
     def __del__(self):
         self._cam_in_q.join()
-        self._cam_out_q.join()
+
+    def close(self):
+        """
+        End the camera thread once all submitted recordings have concluded,
+        including those submitted with `keep_alive`. Recordings left behind by a camera
+        thread that already ended are cancelled.
+        """
+        # a cancelled sentinel, skipped by the worker, which then ends as it is not kept alive
+        sentinel = Future()
+        sentinel.cancel()
+        self._cam_in_q.put((sentinel, None, (), {}, False))
+        self._cam_thread.join()
+        # the thread ends early after a recording without `keep_alive`; drop what it left behind
+        while True:
+            try:
+                fut = self._cam_in_q.get_nowait()[0]
+            except Empty:
+                break
+            fut.cancel()
+            self._cam_in_q.task_done()
 
     def _cam_worker(self):
         keep_alive = True
         while keep_alive:
-            args, kwargs, keep_alive = self._cam_in_q.get()
-            self._logger.info(f'Starting recording: args={args}, kwargs={kwargs}')
+            fut, progress_callback, args, kwargs, keep_alive = self._cam_in_q.get()
+            # stopping a future requests a stop, which must survive until record starts
+            self.cam.clear_stop_request()
+            if fut.set_running_or_notify_cancel():
+                self._run_recording(fut, progress_callback, *args, **kwargs)
+            self._cam_in_q.task_done()
+
+    def _run_recording(self, fut: Future, progress_callback, *args, **kwargs):
+        cb = ReportProgress(progress_callback) if progress_callback is not None else None
+        if cb is not None:
+            self.cam.add_callback(cb)
+        self._logger.info(f'Starting recording: args={args}, kwargs={kwargs}')
+        try:
             res = self.cam.record(*args, **kwargs)
+        except Exception as e:
+            self._logger.info(f'Recording ended with {e.__class__.__name__}.')
+            fut.set_exception(e)
+        else:
             self._logger.info('Recording done.')
-            self._cam_in_q.task_done()
-            self._cam_out_q.put(res)
+            fut.set_result(res)
+        finally:
+            if cb is not None:
+                self.cam.remove_callback(cb)
 
     def _servo_worker(self, servo_name: Tuple[str, str]):
+        q = self._servo_in_qs[servo_name]
+        servo = self.servos[servo_name]
+        held_back = None
         while True:
-            args, kwargs = self._servo_in_qs[servo_name].get()
-            self.servos[servo_name].execute_sequence(*args, **kwargs)
-            self._servo_in_qs[servo_name].task_done()
+            job = held_back if held_back is not None else q.get()
+            held_back = None
+            if isinstance(job, CoordinatedMove):
+                job.run(servo_name)
+                q.task_done()
+                continue
+            coalescer = SequenceCoalescer(servo)
+            if self.servo_coalesce_window is None or not coalescer.add(job):
+                args, kwargs = job
+                servo.execute_sequence(*args, **kwargs)
+                q.task_done()
+                continue
+
+            deadline = monotonic() + self.servo_coalesce_window
+            while True:
+                try:
+                    nxt = q.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+                if not coalescer.add(nxt):
+                    held_back = nxt
+                    break
+            if coalescer.n_merged > 1:
+                self._logger.info(f'Coalesced {coalescer.n_merged} servo sequences for {servo_name}.')
+            servo.run_servo_op(coalescer.op)
+            for _ in range(coalescer.n_merged):
+                q.task_done()
 
     def poll_cam_result(self):
-        while True:
-            try:
-                return self._cam_out_q.get(timeout=self.CAM_RES_POLL_TIMEOUT)
-            except Empty:
-                pass
+        """
+        Wait for the oldest recording whose result has not been polled yet, and return its result.
+        """
+        return self._unpolled_recordings.popleft().result()
 
-    def start_recording(self, keep_alive: bool = False, *args, **kwargs):
+    def start_recording(
+        self,
+        keep_alive: bool = False,
+        progress_callback: Callable[[RecordingProgress], None] = None,
+        *args,
+        **kwargs,
+    ) -> RecordingFuture:
         """
-        Start recording on `self.cam` with the given arguments.
+        Start recording on `self.cam` with the given arguments. Recordings submitted
+        while another one is running are executed afterwards, in order.
 
         :param keep_alive: Whether to keep the camera thread alive after this
                            recording concludes. This prevents the main thread
                            from exiting.
+        :param progress_callback: Called with a `RecordingProgress` after every captured frame.
         :param args: arguments passed on to `self.cam.record()`
         :param kwargs: keyword arguments passed on to `self.cam.record()`
+        :return: A future resolving to the result of `self.cam.record()`.
         """
-        self._cam_in_q.put((args, kwargs, keep_alive))
+        fut = RecordingFuture(self.cam)
+        self._unpolled_recordings.append(fut)
+        self._cam_in_q.put((fut, progress_callback, args, kwargs, keep_alive))
+        return fut
 
     def submit_servo_sequence(self, servo_name: Tuple[str, str], *args, **kwargs):
         """
@@ -81,4 +322,34 @@ class Platform:
         :param args: arguments passed on to the `execute_sequence` function of the requested servo.
         :param kwargs: keyword arguments passed on the the `execute_sequence` function of the requested servo.
         """
+        if SequenceCoalescer.is_cycled((args, kwargs)):
+            # cycled sequences never end, so this servo cannot join coordinated moves anymore
+            self._cycling.add(servo_name)
         self._servo_in_qs[servo_name].put((args, kwargs))
+
+    def move_servos(
+        self, targets: Dict[Tuple[str, str], int], wait: bool = True, timeout: float = None
+    ) -> CoordinatedMove:
+        """
+        Move several servos to absolute angles concurrently, such that they arrive together.
+        The move starts once all given servos have finished their previously submitted sequences,
+        and takes as long as the longest single-axis move. Servos that were submitted a cycled
+        sequence never finish it, so they cannot be moved.
+
+        :param targets: The target angle for each servo, by name as given in `self.servos`.
+        :param wait: Whether to block until all servos have arrived.
+        :param timeout: Seconds to wait for all servos to become idle before giving up the move.
+        :return: The submitted `CoordinatedMove`, which can be waited on.
+        """
+        unknown = [sn for sn in targets if sn not in self.servos]
+        if unknown:
+            raise RuntimeError(f'Unknown servo names: {unknown}')
+        cycling = [sn for sn in targets if sn in self._cycling]
+        if cycling:
+            raise RuntimeError(f'Cannot move servos running a cycled sequence: {cycling}')
+        move = CoordinatedMove(self.servos, targets, timeout=timeout)
+        for sn in move.targets:
+            self._servo_in_qs[sn].put(move)
+        if wait:
+            move.wait()
+        return move
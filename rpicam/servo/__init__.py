@@ -1,2 +1,5 @@
 from .servo import Servo
+from .motion import MotionPlanner
+from .gpio_backend import GPIOBackend, RPiGPIOBackend, SimulatedGPIOBackend
 from .servo_ops import ServoOp, cw, ccw, full_cw, full_ccw, noon, pause, ServoOpParser
+from .servo_program import ServoProgram
@@ -0,0 +1,181 @@
+from typing import List, NamedTuple, Optional
+from abc import ABC, abstractmethod
+from threading import Lock, local, main_thread, current_thread
+import os
+import time
+
+
+class GPIOBackend(ABC):
+    """
+    Interface to the GPIO pins and PWM used to drive Servos. Also provides the clock
+    Servos use to wait for moves to finish, so that simulated backends can skip waiting.
+    """
+
+    @abstractmethod
+    def setup_output(self, pin: int):
+        """Configure the given BOARD pin as output."""
+        pass
+
+    @abstractmethod
+    def pwm(self, pin: int, freq: float):
+        """
+        Create a PWM driver on the given BOARD pin.
+
+        :return: An object with the `start`, `ChangeDutyCycle` and `stop` methods of `RPi.GPIO.PWM`.
+        """
+        pass
+
+    @abstractmethod
+    def cleanup(self, pin: int = None):
+        """Release the given pin, or all pins if not supplied."""
+        pass
+
+    def sleep(self, sec: float):
+        time.sleep(sec)
+
+    def time(self) -> float:
+        return time.monotonic()
+
+    def wait_until(self, t: float):
+        """Sleep until the clock reaches `t`. Used to join threads moving servos together."""
+        self.sleep(max(0.0, t - self.time()))
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """
+    GPIO backend using `RPi.GPIO` in BOARD numbering mode. `RPi.GPIO` is only imported
+    once the first backend is created.
+    """
+
+    _GPIO = None
+
+    def __init__(self):
+        if RPiGPIOBackend._GPIO is None:
+            import RPi.GPIO as GPIO
+
+            GPIO.setmode(GPIO.BOARD)
+            RPiGPIOBackend._GPIO = GPIO
+        self._gpio = RPiGPIOBackend._GPIO
+
+    def setup_output(self, pin: int):
+        self._gpio.setup(pin, self._gpio.OUT)
+
+    def pwm(self, pin: int, freq: float):
+        return self._gpio.PWM(pin, freq)
+
+    def cleanup(self, pin: int = None):
+        if pin is None:
+            self._gpio.cleanup()
+        else:
+            self._gpio.cleanup(pin)
+
+
+class DutyCycleEvent(NamedTuple):
+    """
+    A duty cycle change recorded by the `SimulatedGPIOBackend`.
+
+    :param t: The virtual time of the change in seconds.
+    :param pin: The BOARD pin.
+    :param duty_cycle: The new duty cycle in percent. None if PWM was stopped.
+    """
+
+    t: float
+    pin: int
+    duty_cycle: Optional[float]
+
+
+class SimulatedPWM:
+    def __init__(self, backend: 'SimulatedGPIOBackend', pin: int, freq: float):
+        self._backend = backend
+        self.pin = pin
+        self.freq = freq
+
+    def start(self, duty_cycle: float):
+        self._backend.record(self.pin, duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle: float):  # noqa: N802 - mirrors RPi.GPIO.PWM
+        self._backend.record(self.pin, duty_cycle)
+
+    def stop(self):
+        self._backend.record(self.pin, None)
+
+
+class SimulatedGPIOBackend(GPIOBackend):
+    """
+    GPIO backend without hardware. Duty cycle changes are recorded in `self.timeline`
+    against a virtual clock, which `sleep` advances instantly.
+
+    Every thread has its own virtual clock, starting at the clock of the main thread when the
+    thread first uses the backend, so that sleeps of concurrent threads overlap like real ones.
+    Threads join their clocks with `wait_until`; `latest` is the end of all simulated activity.
+    """
+
+    def __init__(self):
+        self.timeline: List[DutyCycleEvent] = []
+        self._local = local()
+        self._main_now = 0.0
+        self._latest = 0.0
+        self._lock = Lock()
+
+    def _get_clock(self) -> float:
+        now = getattr(self._local, 'now', None)
+        if now is None:
+            now = self._local.now = self._main_now
+        return now
+
+    def _set_clock(self, now: float):
+        self._local.now = now
+        if current_thread() is main_thread():
+            self._main_now = now
+        self._latest = max(self._latest, now)
+
+    def setup_output(self, pin: int):
+        pass
+
+    def pwm(self, pin: int, freq: float) -> SimulatedPWM:
+        return SimulatedPWM(self, pin, freq)
+
+    def cleanup(self, pin: int = None):
+        pass
+
+    def record(self, pin: int, duty_cycle: Optional[float]):
+        with self._lock:
+            self.timeline.append(DutyCycleEvent(self._get_clock(), pin, duty_cycle))
+
+    def sleep(self, sec: float):
+        with self._lock:
+            self._set_clock(self._get_clock() + max(0.0, sec))
+
+    def time(self) -> float:
+        """Get the virtual time of the calling thread."""
+        with self._lock:
+            return self._get_clock()
+
+    def latest(self) -> float:
+        """Get the latest virtual time reached by any thread."""
+        with self._lock:
+            return self._latest
+
+    def get_timeline(self, pin: int = None) -> List[DutyCycleEvent]:
+        """Get the recorded duty cycle changes, optionally only of the given pin."""
+        with self._lock:
+            return [ev for ev in self.timeline if pin is None or ev.pin == pin]
+
+
+BACKEND_ENV_VAR = 'RPICAM_GPIO_BACKEND'
+_BACKENDS = {'rpi': RPiGPIOBackend, 'sim': SimulatedGPIOBackend}
+_default_backend = None
+
+
+def get_default_backend() -> GPIOBackend:
+    """
+    Get the shared default GPIO backend. Uses `RPi.GPIO` unless the environment variable
+    RPICAM_GPIO_BACKEND is set to 'sim'.
+    """
+    global _default_backend
+    if _default_backend is None:
+        name = os.getenv(BACKEND_ENV_VAR, 'rpi')
+        if name not in _BACKENDS:
+            raise RuntimeError(f'Invalid GPIO backend: {name}. Valid: {list(_BACKENDS)}')
+        _default_backend = _BACKENDS[name]()
+    return _default_backend
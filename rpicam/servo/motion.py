@@ -0,0 +1,79 @@
+from typing import List, Tuple
+import math
+
+
+class MotionPlanner:
+    """
+    Plans servo moves as a list of (angle, dwell) steps. The time spent on a move
+    scales with its angular distance instead of being fixed.
+
+    :param speed: The assumed angular speed of the servo in degrees per second.
+    :param min_settle: Seconds to wait after the final step of each move, to let the horn settle.
+    :param easing: The trajectory to use. 'none' jumps directly to the target angle,
+                   'linear' ramps the duty cycle in equal steps, 'cosine' ramps it
+                   with smooth acceleration and deceleration.
+    :param step_interval: Seconds between intermediate duty cycle updates of eased trajectories.
+                          Values below one PWM period (20 ms at 50 Hz) have no effect.
+    """
+
+    DEFAULT_SPEED = 300.0  # deg/sec; a full 180° sweep plus settling takes ~0.7 sec
+    DEFAULT_MIN_SETTLE = 0.1  # sec
+    EASINGS = ('none', 'linear', 'cosine')
+
+    def __init__(
+        self,
+        speed: float = DEFAULT_SPEED,
+        min_settle: float = DEFAULT_MIN_SETTLE,
+        easing: str = 'none',
+        step_interval: float = 0.02,
+    ):
+        if speed <= 0:
+            raise RuntimeError(f'Servo speed must be positive: {speed}')
+        if easing not in self.EASINGS:
+            raise RuntimeError(f'Invalid easing supplied: {easing}. Valid: {self.EASINGS}')
+        self.speed = speed
+        self.min_settle = min_settle
+        self.easing = easing
+        self.step_interval = step_interval
+
+    def travel_time(self, from_angle: float, to_angle: float) -> float:
+        """Seconds needed to travel between the given angles at the configured speed."""
+        return abs(to_angle - from_angle) / self.speed
+
+    def move_time(self, from_angle: float, to_angle: float) -> float:
+        """Total seconds a planned move takes, including settling."""
+        return self.travel_time(from_angle, to_angle) + self.min_settle
+
+    @staticmethod
+    def _ease(frac: float, easing: str) -> float:
+        if easing == 'cosine':
+            return (1 - math.cos(math.pi * frac)) / 2
+        return frac
+
+    def plan(
+        self, from_angle: float, to_angle: float, duration: float = None, easing: str = None
+    ) -> List[Tuple[float, float]]:
+        """
+        Plan a move between two angles.
+
+        :param from_angle: The current angle.
+        :param to_angle: The target angle.
+        :param duration: Travel time to stretch the move to. If not supplied, use the
+                         travel time implied by the configured speed. Never shorter than that.
+        :param easing: Override the configured easing for this move.
+        :return: A list of (angle, dwell) tuples: set the angle, then wait for dwell seconds.
+        """
+        easing = self.easing if easing is None else easing
+        travel = self.travel_time(from_angle, to_angle)
+        if duration is not None:
+            travel = max(travel, duration)
+        if easing == 'none' or travel <= self.step_interval:
+            return [(to_angle, travel + self.min_settle)]
+        n_steps = int(math.ceil(travel / self.step_interval))
+        dwell = travel / n_steps
+        steps = [
+            (from_angle + (to_angle - from_angle) * self._ease(i / n_steps, easing), dwell)
+            for i in range(1, n_steps + 1)
+        ]
+        steps[-1] = (to_angle, dwell + self.min_settle)
+        return steps
@@ -1,13 +1,12 @@
 from typing import List, Union
-import time
-import RPi.GPIO as GPIO
+from threading import Event
 
 from rpicam.servo.servo_ops import ServoOp, full_cw, full_ccw, noon, pause
+from rpicam.servo.motion import MotionPlanner
+from rpicam.servo.gpio_backend import GPIOBackend, get_default_backend
 from rpicam.utils.logging_utils import get_logger
 from rpicam.utils.state import State
 
-GPIO.setmode(GPIO.BOARD)
-
 
 class Servo:
 
@@ -23,15 +22,19 @@ class Servo:
         hacked: bool = False,
         on_invalid_angle: str = 'raise',
         init_angle: Union[int, str] = 0,
+        motion_planner: MotionPlanner = None,
+        backend: GPIOBackend = None,
     ):
         self.pin = board_pin
         self.angle = None
         self.hacked = hacked
+        self.motion_planner = motion_planner if motion_planner is not None else MotionPlanner()
         self._on_invalid_angle = on_invalid_angle
         self._servo_name = f'({servo_name})' if servo_name is not None else ''
         self._logger = get_logger(f'{self.__class__.__name__}{self._servo_name}', verb=verbose)
-        GPIO.setup(self.pin, GPIO.OUT)
-        self._pwm = GPIO.PWM(self.pin, freq)
+        self._backend = backend if backend is not None else get_default_backend()
+        self._backend.setup_output(self.pin)
+        self._pwm = self._backend.pwm(self.pin, freq)
         self._initialize_servo_pos()
         if init_angle == 'guess':
             init_angle = self.MOCK_INIT_ASSUMED_ANGLE
@@ -50,37 +53,98 @@ class Servo:
         if init_angle != 0:
             self._run_servo_op(angle=init_angle)
 
+    @property
+    def backend(self) -> GPIOBackend:
+        return self._backend
+
     def __del__(self):
-        self._pwm.stop()
-        GPIO.cleanup()
+        if hasattr(self, '_pwm'):
+            self._pwm.stop()
+            self._backend.cleanup(self.pin)
 
     def _initialize_servo_pos(self):
         """Move servo to starting position: 0°"""
 
         self._logger.info('Move: ??° ==> 0°')
         self._pwm.start(12.5)
-        time.sleep(0.5)
+        self._backend.sleep(0.5)
         self._pwm.ChangeDutyCycle(12.5)
-        time.sleep(0.5)
+        self._backend.sleep(0.5)
         self._pwm.ChangeDutyCycle(0)
-        time.sleep(0.5)
+        self._backend.sleep(0.5)
         self.angle = 0
 
     @staticmethod
     def _angle_to_duty_cycle(angle: int) -> float:
         return ((180 - angle) / 18.0) + 2.5
 
-    def _calculate_new_angle(self, sense: str, angle: int) -> int:
-        if self.angle is None:
+    def _calculate_new_angle(self, sense: str, angle: int, from_angle: int = None) -> int:
+        from_angle = self.angle if from_angle is None else from_angle
+        if from_angle is None:
             raise RuntimeError('Servo position is not initialized.')
         if sense == 'CW':
-            new_angle = self.angle + angle
+            new_angle = from_angle + angle
         elif sense == 'CCW':
-            new_angle = self.angle - angle
+            new_angle = from_angle - angle
         else:
             raise RuntimeError(f'Invalid sense supplied: {sense}')
         return new_angle
 
+    def _resolve_angle(self, angle: int = None, sense: str = None, from_angle: int = None) -> int:
+        """Get the absolute target angle of a move op, relative to `from_angle` or the current angle."""
+        if sense is None:
+            return angle
+        elif angle is None:
+            return 0 if sense == 'CCW' else 180
+        else:
+            return self._calculate_new_angle(sense, angle, from_angle=from_angle)
+
+    def _check_angle(self, new_angle: int) -> bool:
+        """Check whether the angle is valid, and handle invalid angles as configured."""
+        if not self.hacked and not 0 <= new_angle <= 180:
+            invalid_angle_mess = f'Invalid angle supplied: {new_angle}'
+            if self._on_invalid_angle == 'raise':
+                raise RuntimeError(invalid_angle_mess)
+            elif self._on_invalid_angle == 'warn':
+                self._logger.warning(invalid_angle_mess)
+            elif self._on_invalid_angle == 'ignore':
+                pass
+            return False
+        return True
+
+    def resolve_target_angle(self, sequence: List[ServoOp], from_angle: int = None) -> int:
+        """
+        Get the angle the servo would end up at after executing a sequence of move ops,
+        without moving it. Ops leading to invalid angles are handled as in `run_servo_op`.
+
+        :param sequence: A list of `ServoOp`s without sleeps.
+        :param from_angle: The angle to start from. If not supplied, use the current angle.
+        :return: The resulting absolute angle.
+        """
+        target = self.angle if from_angle is None else from_angle
+        for op in sequence:
+            if op.angle is None and op.sense is None:
+                continue
+            new_angle = self._resolve_angle(op.angle, op.sense, from_angle=target)
+            if self._check_angle(new_angle):
+                target = new_angle % 181
+        return target
+
+    def _move(self, new_angle: int, duration: float = None, easing: str = None):
+        """
+        Drive the servo from its current angle to `new_angle` as planned by `self.motion_planner`.
+
+        :param new_angle: The target angle.
+        :param duration: Optional travel time to stretch the move to.
+        :param easing: Optional easing overriding the one of `self.motion_planner`.
+        :return: None
+        """
+        steps = self.motion_planner.plan(self.angle, new_angle, duration=duration, easing=easing)
+        for step_angle, dwell in steps:
+            self._pwm.ChangeDutyCycle(self._angle_to_duty_cycle(step_angle))
+            self._backend.sleep(dwell)
+        self._pwm.ChangeDutyCycle(0)
+
     def _run_servo_op(
         self,
         angle: int = None,
@@ -100,54 +164,63 @@ class Servo:
         if all(x is None for x in (angle, sense, sleep)):
             return  # no-op
         if angle is None and sense is None:
-            time.sleep(sleep)
+            self._backend.sleep(sleep)
             return
-        if sense is None:
-            new_angle = angle
-        elif angle is None:
-            new_angle = 0 if sense == 'CCW' else 180
-        else:
-            new_angle = self._calculate_new_angle(sense, angle)
-        if not self.hacked and not 0 <= new_angle <= 180:
-            invalid_angle_mess = f'Invalid angle supplied: {new_angle}'
-            if self._on_invalid_angle == 'raise':
-                raise RuntimeError(invalid_angle_mess)
-            elif self._on_invalid_angle == 'warn':
-                self._logger.warning(invalid_angle_mess)
-            elif self._on_invalid_angle == 'ignore':
-                pass
+        new_angle = self._resolve_angle(angle, sense)
+        if not self._check_angle(new_angle):
             return
         if self.angle == new_angle:
             return
         if abs(self.angle - new_angle) < Servo.PRECISION_THRESHOLD_ANGLE:
             self._logger.warning('Operation under precision threshold.')
-        new_duty_cycle = self._angle_to_duty_cycle(new_angle)
         self._logger.info(f'Move: {self.angle}° ==> {new_angle}°')
-        self._pwm.ChangeDutyCycle(new_duty_cycle)
-        time.sleep(0.7)  # mandatory to allow operation
-        self._pwm.ChangeDutyCycle(0)
+        self._move(new_angle)
         self.angle = new_angle % 181
         if sleep:
-            time.sleep(sleep)
+            self._backend.sleep(sleep)
+
+    def move_to(self, angle: int, duration: float = None):
+        """
+        Move to an absolute angle, optionally stretching the move to take `duration` seconds
+        of travel. Stretched moves ramp the duty cycle, so that the servo arrives at the end of
+        the given duration instead of at its own speed.
+
+        :param angle: The target angle.
+        :param duration: Travel time to stretch the move to. Never shorter than the planned one.
+        :return: None
+        """
+        if not self._check_angle(angle) or self.angle == angle:
+            return
+        easing = None
+        if duration is not None and self.motion_planner.easing == 'none':
+            easing = 'linear'
+        self._logger.info(f'Move: {self.angle}° ==> {angle}°')
+        self._move(angle, duration=duration, easing=easing)
+        self.angle = angle % 181
 
     def run_servo_op(self, servo_op: ServoOp):
         self._run_servo_op(*servo_op)
 
-    def execute_sequence(self, sequence: List[ServoOp], cycle: bool = False):
+    def execute_sequence(self, sequence: List[ServoOp], cycle: bool = False, stop: Event = None):
         """
         Execute a sequence of `ServoOp`s.
 
         :param sequence: A list of `ServoOp`s to execute.
         :param cycle: Whether to run the given sequence in a cycle
-                      until recieving a KeyboardInterupt.
+                      until recieving a KeyboardInterupt or `stop` being set.
                       If so, returns to starting angle each time.
+        :param stop: An optional event to stop at, checked before every op.
         :return:
         """
         try:
             starting_angle = self.angle
             while True:
                 for tup in sequence:
+                    if stop is not None and stop.is_set():
+                        return
                     self.run_servo_op(tup)
+                if stop is not None and stop.is_set():
+                    return
                 if cycle:
                     self._run_servo_op(starting_angle)
                 else:
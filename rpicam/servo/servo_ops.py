@@ -29,17 +29,17 @@ pause = ServoOp(sleep=1)
 
 class ServoOpParser:
     @staticmethod
-    def interpret_wasd(
-        servo_name_ad: str, servo_name_ws: str = None
+    def interpret_key(
+        c: Optional[str], servo_name_ad: str, servo_name_ws: str = None
     ) -> Optional[Tuple[str, ServoOp]]:
         """
-        Get a char from keyboard input, and emit the corresponding servo name and ServoOp.
+        Emit the servo name and ServoOp corresponding to a WASD key press.
 
+        :param c: The pressed key.
         :param servo_name_ad: The name of the Servo to be controlled by the A/D keys.
         :param servo_name_ws: The name of the Servo to be controlled by the W/S keys.
         :returns: A tuple of the selected servo name, and the ServoOp to execute.
         """
-        c = get_char_keyboard_nonblock()
         if c == 'a':
             return servo_name_ad, ccw
         elif c == 'd':
@@ -55,6 +55,20 @@ class ServoOpParser:
                 else:
                     return None
 
+    @staticmethod
+    def interpret_wasd(
+        servo_name_ad: str, servo_name_ws: str = None
+    ) -> Optional[Tuple[str, ServoOp]]:
+        """
+        Get a char from keyboard input, and emit the corresponding servo name and ServoOp.
+
+        :param servo_name_ad: The name of the Servo to be controlled by the A/D keys.
+        :param servo_name_ws: The name of the Servo to be controlled by the W/S keys.
+        :returns: A tuple of the selected servo name, and the ServoOp to execute.
+        """
+        c = get_char_keyboard_nonblock()
+        return ServoOpParser.interpret_key(c, servo_name_ad, servo_name_ws)
+
     @staticmethod
     def parse_servo_op(s: str) -> ServoOp:
         ops_map = {
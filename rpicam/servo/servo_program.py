@@ -0,0 +1,87 @@
+from typing import List, Tuple
+
+from rpicam.servo.servo_ops import ServoOp
+
+
+class ServoProgram:
+    """
+    A time-indexed servo program: each entry is a move `ServoOp` together with the
+    number of seconds after program start at which it becomes due.
+
+    :param entries: A list of (seconds after start, `ServoOp`) tuples.
+    :param period: If given, repeat the program every `period` seconds.
+    """
+
+    def __init__(self, entries: List[Tuple[float, ServoOp]], period: float = None):
+        if period is not None and period <= 0:
+            raise RuntimeError(f'Program period must be positive: {period}')
+        self.entries = sorted(entries, key=lambda x: x[0])
+        self.period = period
+        self._next_idx = 0
+        self._cycle_offset = 0.0
+
+    @classmethod
+    def from_sequence(cls, servo, sequence: List[ServoOp], cycle: bool = False) -> 'ServoProgram':
+        """
+        Build a program from a sequence of `ServoOp`s as used by `Servo.execute_sequence`.
+        Sleeps are turned into time offsets, and each move is assumed to take as long
+        as planned by the servo's motion planner.
+
+        :param servo: The `Servo` the program will run on. Used to simulate the sequence.
+        :param sequence: A list of `ServoOp`s.
+        :param cycle: Whether to repeat the sequence, returning to the starting angle each time.
+        :return: The ServoProgram.
+        """
+        planner = servo.motion_planner
+        start_angle = angle = servo.angle
+        t = 0.0
+        entries = []
+        for op in sequence:
+            if op.angle is not None or op.sense is not None:
+                new_angle = servo.resolve_target_angle([op], from_angle=angle)
+                entries.append((t, ServoOp(angle=op.angle, sense=op.sense)))
+                t += planner.move_time(angle, new_angle)
+                angle = new_angle
+            if op.sleep:
+                t += op.sleep
+        period = None
+        if cycle:
+            entries.append((t, ServoOp(angle=start_angle)))
+            period = t + planner.move_time(angle, start_angle)
+        return cls(entries, period=period)
+
+    def reset(self):
+        self._next_idx = 0
+        self._cycle_offset = 0.0
+
+    def pop_due(self, elapsed: float) -> List[ServoOp]:
+        """
+        Get all ops that are due at `elapsed` seconds after program start and have not been
+        returned yet.
+
+        :param elapsed: Seconds since program start.
+        :return: The due `ServoOp`s in order.
+        """
+        due = []
+        while len(self.entries):
+            if self._next_idx >= len(self.entries):
+                if self.period is None:
+                    break
+                self._next_idx = 0
+                self._cycle_offset += self.period
+            t, op = self.entries[self._next_idx]
+            if t + self._cycle_offset > elapsed:
+                break
+            due.append(op)
+            self._next_idx += 1
+        return due
+
+    def push_back(self, ops: List[ServoOp]):
+        """Return ops obtained from `pop_due` to the program, to be due again immediately."""
+        for _ in ops:
+            if self._next_idx == 0:
+                if self.period is None or self._cycle_offset == 0:
+                    break
+                self._next_idx = len(self.entries)
+                self._cycle_offset -= self.period
+            self._next_idx -= 1
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def accumulate_frame(
+    buffer: Optional['np.ndarray'], frame: 'np.ndarray', first: bool
+) -> 'np.ndarray':
+    """
+    Add a frame to a float accumulation buffer in place. The buffer is only reallocated if
+    missing or of a different shape than the frame, so it can be reused across bursts.
+
+    :param buffer: The buffer of previous calls, or None.
+    :param frame: The frame to add.
+    :param first: Whether the frame is the first of a burst, overwriting the buffer.
+    :return: The buffer holding the sum.
+    """
+    import numpy as np
+
+    if buffer is None or buffer.shape != frame.shape:
+        buffer = np.empty(frame.shape, dtype=np.float32)
+    if first:
+        np.copyto(buffer, frame)
+    else:
+        np.add(buffer, frame, out=buffer)
+    return buffer
+
+
+def average_frames(buffer: 'np.ndarray', n: int) -> 'np.ndarray':
+    """
+    Get the rounded average of `n` frames summed up with `accumulate_frame`.
+    The buffer is overwritten.
+
+    :param buffer: The buffer holding the sum.
+    :param n: The number of summed frames.
+    :return: The average as uint8 array.
+    """
+    import numpy as np
+
+    buffer *= 1 / n
+    buffer += 0.5  # round when truncating to uint8
+    return buffer.astype(np.uint8)
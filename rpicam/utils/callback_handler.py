@@ -1,16 +1,97 @@
 #!/usr/bin/env python3
 
-from typing import List, Optional
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Condition, Lock, Thread
+import time
+
 from rpicam.cams.callbacks import Callback, ExecPoint
+from rpicam.utils.logging_utils import get_logger
+from rpicam.utils.profiling import PHASES, LatencyStats, PhaseProfiler
+
+_PHASE_STARTS = {start: phase for phase, (start, _) in PHASES.items()}
+_PHASE_ENDS = {end: phase for phase, (_, end) in PHASES.items()}
+
+
+class _Watchdog:
+    """Calls a function if a watched operation is not finished before its deadline."""
+
+    def __init__(self):
+        self._cond = Condition()
+        self._deadlines: Dict[int, Tuple[float, Callable]] = {}
+        self._tokens = count()
+        Thread(target=self._run, name='callback-watchdog', daemon=True).start()
+
+    def watch(self, timeout: float, on_timeout: Callable) -> int:
+        with self._cond:
+            token = next(self._tokens)
+            self._deadlines[token] = (time.monotonic() + timeout, on_timeout)
+            self._cond.notify()
+        return token
+
+    def unwatch(self, token: int):
+        with self._cond:
+            self._deadlines.pop(token, None)
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not len(self._deadlines):
+                    self._cond.wait()
+                    continue
+                token, (deadline, on_timeout) = min(self._deadlines.items(), key=lambda x: x[1][0])
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                del self._deadlines[token]
+                self._cond.release()
+                try:
+                    on_timeout()
+                finally:
+                    self._cond.acquire()
 
 
 class CallbackHandler:
-    def __init__(self, callbacks: List[Callback] = None):
+    """
+    Executes Callbacks at their ExecPoints, by descending priority.
+
+    Callbacks with `offload` set do not block the caller: they are run on a single worker thread
+    per ExecPoint, created on first use, so that offloaded callbacks of one ExecPoint are executed
+    in order. Exceptions raised by offloaded callbacks, and callbacks exceeding their
+    `offload_timeout`, are passed to the `ON_EXCEPTION` callbacks instead of being raised.
+    A worker stuck in a callback past its timeout is abandoned, and the calls queued behind it
+    continue on a new worker.
+    At most `MAX_PENDING` offloaded calls are queued per ExecPoint, further calls are dropped.
+
+    Every callback invocation is timed, as is every phase between a pair of ExecPoints
+    (see `rpicam.utils.profiling.PHASES`), e.g. the capture of a frame. See `get_timing_stats`.
+
+    :param callbacks: The callbacks to execute.
+    :param profiler: An optional profiler to run during every occurrence of its phase.
+    """
+
+    MAX_PENDING = 100
+
+    def __init__(self, callbacks: List[Callback] = None, profiler: PhaseProfiler = None):
         self._callbacks = {}
         callbacks = callbacks if callbacks is not None else []
         for cb in callbacks:
             self._callbacks.setdefault(cb.exec_at, []).append(cb)
         self._sort_callbacks()
+        self._executors: Dict[ExecPoint, ThreadPoolExecutor] = {}
+        self._abandoned: Set[ThreadPoolExecutor] = set()
+        self._queued: Dict[ExecPoint, Deque[Tuple[Callback, tuple, dict]]] = {}
+        self._pending: Dict[ExecPoint, int] = {}
+        self._lock = Lock()
+        self._watchdog = None
+        self.profiler = profiler
+        self._callback_stats: Dict[Tuple[ExecPoint, str], LatencyStats] = {}
+        self._phase_stats: Dict[str, LatencyStats] = {}
+        self._phase_started: Dict[str, float] = {}
+        self._logger = get_logger(self.__class__.__name__, verb=False)
 
     def _sort_callbacks(self):
         for k in self._callbacks.keys():
@@ -20,21 +101,157 @@ class CallbackHandler:
         self._callbacks.setdefault(cb.exec_at, []).append(cb)
         self._sort_callbacks()
 
+    def remove_callback(self, cb: Callback):
+        if cb in self._callbacks.get(cb.exec_at, []):
+            self._callbacks[cb.exec_at].remove(cb)
+
     def get_callbacks(self, exec_at: ExecPoint) -> Optional[List[Callback]]:
         return self._callbacks.get(exec_at)
 
     def execute_callbacks(self, loc: ExecPoint, *args, **kwargs):
         """
-        Run all callbacks associated with loc in order.
+        Run all callbacks associated with loc in order. Offloaded callbacks are only submitted
+        to the worker of loc, so they may finish after inline callbacks of lower priority.
 
         :param loc: The execution point.
         :param args: passed on to Callbacks for the given loc.
         :param kwargs: passed on to Callbacks for the given loc.
         :return:
         """
-        if loc in self._callbacks:
-            for cb in self._callbacks[loc]:
+        if loc in _PHASE_ENDS:
+            self._end_phase(_PHASE_ENDS[loc])
+        for cb in self._callbacks.get(loc, ()):
+            if cb.offload:
+                self._submit(loc, cb, args, kwargs)
+                continue
+            t0 = time.perf_counter()
+            try:
                 cb(*args, **kwargs)
+            finally:
+                self._record_callback(loc, cb, time.perf_counter() - t0)
+        if loc in _PHASE_STARTS:
+            self._start_phase(_PHASE_STARTS[loc])
+
+    def _start_phase(self, phase: str):
+        if self.profiler is not None and self.profiler.phase == phase:
+            self.profiler.start()
+        self._phase_started[phase] = time.perf_counter()
+
+    def _end_phase(self, phase: str):
+        t0 = self._phase_started.pop(phase, None)
+        if t0 is not None:
+            self._phase_stats.setdefault(phase, LatencyStats()).record(time.perf_counter() - t0)
+        if self.profiler is not None and self.profiler.phase == phase:
+            self.profiler.stop()
+
+    def _record_callback(self, loc: ExecPoint, cb: Callback, duration: float):
+        key = (loc, cb.__class__.__name__)
+        self._callback_stats.setdefault(key, LatencyStats()).record(duration)
+
+    def get_timing_stats(self) -> Dict[str, Dict[str, Dict]]:
+        """
+        Get latency stats of all phases that occurred, and of all callbacks executed,
+        by ExecPoint and callback class. See `LatencyStats.summary`.
+        """
+        return {
+            'phases': {phase: stats.summary() for phase, stats in self._phase_stats.items()},
+            'callbacks': {
+                f'{loc.name}/{name}': stats.summary()
+                for (loc, name), stats in self._callback_stats.items()
+            },
+        }
+
+    @staticmethod
+    def _make_executor(loc: ExecPoint) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'callbacks-{loc.name.lower()}')
+
+    def _submit(self, loc: ExecPoint, cb: Callback, args, kwargs):
+        # calls are queued here, and each task of the worker runs the next one, so that the
+        # queue can be handed over to a new worker if the current one gets stuck
+        with self._lock:
+            n_pending = self._pending.get(loc, 0)
+            if n_pending < self.MAX_PENDING:
+                self._pending[loc] = n_pending + 1
+                self._queued.setdefault(loc, deque()).append((cb, args, kwargs))
+                if loc not in self._executors:
+                    self._executors[loc] = self._make_executor(loc)
+                executor = self._executors[loc]
+                executor.submit(self._run_next, loc, executor)
+                return
+        self._report(
+            loc, RuntimeError(f'Dropped {cb!r}: {self.MAX_PENDING} calls pending at {loc.name}.')
+        )
+
+    def _run_next(self, loc: ExecPoint, executor: ThreadPoolExecutor):
+        with self._lock:
+            if executor in self._abandoned:
+                return
+            cb, args, kwargs = self._queued[loc].popleft()
+        self._run_offloaded(loc, executor, cb, args, kwargs)
+
+    def _on_timeout(self, loc: ExecPoint, executor: ThreadPoolExecutor, cb: Callback, call: Dict):
+        """Report a callback exceeding its timeout, and hand the calls queued behind it to a new worker."""
+        with self._lock:
+            if not call['done'] and self._executors.get(loc) is executor:
+                self._abandoned.add(executor)
+                # the stuck call is no longer pending, its thread ends once it returns
+                self._pending[loc] -= 1
+                executor.shutdown(wait=False, cancel_futures=True)
+                new = self._executors[loc] = self._make_executor(loc)
+                for _ in range(len(self._queued[loc])):
+                    new.submit(self._run_next, loc, new)
+        self._report(
+            loc,
+            TimeoutError(f'{cb!r} at {loc.name} exceeded its timeout of {cb.offload_timeout} sec.'),
+        )
+
+    def _run_offloaded(self, loc: ExecPoint, executor: ThreadPoolExecutor, cb: Callback, args, kwargs):
+        token = None
+        call = dict(done=False)
+        if cb.offload_timeout is not None:
+            with self._lock:
+                if self._watchdog is None:
+                    self._watchdog = _Watchdog()
+            token = self._watchdog.watch(
+                cb.offload_timeout, lambda: self._on_timeout(loc, executor, cb, call)
+            )
+        t0 = time.perf_counter()
+        try:
+            cb(*args, **kwargs)
+        except Exception as e:
+            self._report(loc, e)
+        finally:
+            self._record_callback(loc, cb, time.perf_counter() - t0)
+            if token is not None:
+                self._watchdog.unwatch(token)
+            with self._lock:
+                call['done'] = True
+                if executor in self._abandoned:
+                    self._abandoned.discard(executor)
+                else:
+                    self._pending[loc] -= 1
+
+    def _report(self, loc: ExecPoint, exc: Exception):
+        """Pass an exception of an offloaded callback to the ON_EXCEPTION callbacks."""
+        self._logger.error(f'Offloaded callback failed at {loc.name}: {exc!r}')
+        if loc == ExecPoint.ON_EXCEPTION:
+            return
+        try:
+            self.execute_callbacks(ExecPoint.ON_EXCEPTION, exc=exc)
+        except Exception as e:
+            self._logger.error(f'Exception callback failed: {e!r}')
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the workers of offloaded callbacks. They are re-created when needed again.
+
+        :param wait: Whether to wait for all submitted offloaded calls to finish.
+        """
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors = {}
+        for executor in executors:
+            executor.shutdown(wait=wait)
 
     def raise_with_callbacks(self, exc: Exception):
         """
@@ -45,4 +262,3 @@ class CallbackHandler:
         """
         self.execute_callbacks(ExecPoint.ON_EXCEPTION, exc=exc)
         raise exc
-
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from threading import BoundedSemaphore, Condition
+from typing import Callable, List, Optional, Set, TYPE_CHECKING
+import time
+
+from rpicam.utils.logging_utils import get_logger
+from rpicam.utils import metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def fuse_exposures(frames: List['np.ndarray']) -> 'np.ndarray':
+    """
+    Fuse an exposure bracket into one frame with Mertens exposure fusion.
+
+    :param frames: uint8 frames of the same scene at different exposures.
+    :return: The fused uint8 frame.
+    """
+    import cv2
+    import numpy as np
+
+    fused = cv2.createMergeMertens().process(frames)
+    return np.clip(fused * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def fuse_exposures_to_file(frames: List['np.ndarray'], path: str) -> str:
+    """Fuse an exposure bracket and save the fused frame at path. See `fuse_exposures`."""
+    from PIL import Image
+
+    Image.fromarray(fuse_exposures(frames)).save(path)
+    return path
+
+
+class ExposureFuser:
+    """
+    Fuses exposure brackets into frames of a stack in a pool of worker processes, so that
+    fusion of one frame overlaps with capture of the next. At most `max_pending` brackets are
+    queued or being fused: further submissions block until a worker is done, so that capture
+    slows down to the rate of fusion instead of piling up frames in memory.
+
+    :param workers: The number of worker processes.
+    :param max_pending: The maximum number of brackets in flight. Defaults to twice `workers`.
+    :param verbose: whether to write info logs to stderr.
+    :param on_done: Called with the path and the exception, or None on success, once a bracket
+                    has been fused. Runs in a background thread.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = None,
+        verbose: bool = False,
+        on_done: Callable[[Path, Optional[BaseException]], None] = None,
+    ):
+        if workers < 1:
+            raise RuntimeError(f'At least one fusion worker is required, got {workers}.')
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else 2 * workers
+        self._slots = BoundedSemaphore(self.max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Set[Future] = set()
+        self._lock = Condition()
+        self._on_done_cb = on_done
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+
+    def _make_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, frames: List['np.ndarray'], path: Path) -> Future:
+        """
+        Fuse a bracket into a frame file in the background. Blocks while `max_pending`
+        brackets are in flight.
+
+        :param frames: The exposure bracket.
+        :param path: The path to save the fused frame at.
+        :return: A future resolving to the path of the fused frame.
+        """
+        t0 = time.monotonic()
+        self._slots.acquire()
+        waited = time.monotonic() - t0
+        if waited > 0.01:
+            self._logger.info(f'Capture waited {round(waited, 2)} sec for exposure fusion.')
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._make_pool()
+            fut = self._pool.submit(fuse_exposures_to_file, frames, str(path))
+            self._pending.add(fut)
+        fut.add_done_callback(lambda f: self._on_done(f, Path(str(path))))
+        return fut
+
+    def _on_done(self, fut: Future, path: Path):
+        try:
+            if fut.cancelled():
+                return
+            exc = fut.exception()
+            if exc is not None:
+                metrics.FRAMES_DROPPED.inc()
+                self._logger.error(f'Exposure fusion failed: {exc!r}')
+            else:
+                metrics.FRAMES_CAPTURED.inc()
+            if self._on_done_cb is not None:
+                self._on_done_cb(path, exc)
+        finally:
+            # only count as done once handled, so that `join` covers the callback
+            with self._lock:
+                self._pending.discard(fut)
+                self._lock.notify_all()
+            self._slots.release()
+
+    def join(self):
+        """Wait for all submitted brackets to be fused and handled."""
+        with self._lock:
+            self._lock.wait_for(lambda: not len(self._pending))
+
+    def close(self, wait: bool = True):
+        """Stop the worker processes. They are re-created when needed again."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
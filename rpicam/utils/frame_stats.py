@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from typing import Dict, Optional, Sequence
+from collections import deque
+from threading import Lock
+import time
+
+
+def percentile(values: Sequence[float], perc: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of the given values.
+
+    :param values: the values to get the percentile of.
+    :param perc: the percentile in [0, 100].
+    :return: the percentile, or None if no values are given.
+    """
+    if not len(values):
+        return None
+    s = sorted(values)
+    idx = min(len(s) - 1, max(0, int(round(perc / 100 * (len(s) - 1)))))
+    return s[idx]
+
+
+class FrameTiming:
+    """
+    Timestamps of a single preview frame along the capture-to-display path.
+    All timestamps are seconds on the `time.monotonic()` clock.
+
+    :param sensor: the time at which the sensor started reading out the frame, if known.
+    :param captured: the time at which the capture call returned.
+    :param enqueued: the time at which the frame was put into the display queue.
+    :param displayed: the time at which the frame was handed to the GUI.
+    """
+
+    __slots__ = ('sensor', 'captured', 'enqueued', 'displayed')
+
+    def __init__(
+        self,
+        sensor: float = None,
+        captured: float = None,
+        enqueued: float = None,
+        displayed: float = None,
+    ):
+        self.sensor = sensor
+        self.captured = captured
+        self.enqueued = enqueued
+        self.displayed = displayed
+
+    @staticmethod
+    def now() -> float:
+        return time.monotonic()
+
+    @staticmethod
+    def from_sensor_timestamp(sensor_timestamp_ns: Optional[int]) -> Optional[float]:
+        """
+        Convert a libcamera `SensorTimestamp` (ns, CLOCK_MONOTONIC) to seconds.
+        """
+        if sensor_timestamp_ns is None:
+            return None
+        return sensor_timestamp_ns / 1e9
+
+
+class FrameStats:
+    """
+    Rolling latency, frame rate and drop statistics over the last `window` displayed frames.
+    Thread safe, as frames are produced and displayed from different threads.
+
+    :param window: the number of most recent frames to compute statistics over.
+    """
+
+    PERCENTILES = (50, 95, 99)
+    STAGES = {
+        'capture': ('sensor', 'captured'),
+        'queue': ('enqueued', 'displayed'),
+        'total': ('sensor', 'displayed'),
+    }
+
+    def __init__(self, window: int = 100):
+        self._lock = Lock()
+        self._timings = deque(maxlen=window)
+        self.frames_displayed = 0
+        self.frames_dropped = 0
+
+    def record_displayed(self, timing: FrameTiming):
+        with self._lock:
+            self._timings.append(timing)
+            self.frames_displayed += 1
+
+    def record_dropped(self, n: int = 1):
+        with self._lock:
+            self.frames_dropped += n
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self.frames_displayed = 0
+            self.frames_dropped = 0
+
+    def _stage_latencies(self, start: str, end: str):
+        lats = []
+        for t in self._timings:
+            t0 = getattr(t, start)
+            t1 = getattr(t, end)
+            if start == 'sensor' and t0 is None:
+                t0 = t.captured
+            if t0 is not None and t1 is not None:
+                lats.append(t1 - t0)
+        return lats
+
+    def get_stats(self) -> Dict[str, Optional[float]]:
+        """
+        Get the current statistics. Latencies are given in milliseconds, keyed as
+        `<stage>_p<percentile>_ms` for the stages `capture` (sensor to capture return),
+        `queue` (enqueue to display) and `total` (sensor to display).
+
+        :return: a flat dict of statistics.
+        """
+        with self._lock:
+            stats = {
+                'frames_displayed': self.frames_displayed,
+                'frames_dropped': self.frames_dropped,
+                'fps': None,
+            }
+            displayed = [t.displayed for t in self._timings if t.displayed is not None]
+            if len(displayed) > 1 and displayed[-1] > displayed[0]:
+                stats['fps'] = (len(displayed) - 1) / (displayed[-1] - displayed[0])
+            for stage, (start, end) in self.STAGES.items():
+                lats = self._stage_latencies(start, end)
+                for p in self.PERCENTILES:
+                    val = percentile(lats, p)
+                    stats[f'{stage}_p{p}_ms'] = val * 1000 if val is not None else None
+        return stats
+
+    def format_overlay(self) -> str:
+        """
+        Format the current statistics as a short multi-line string for display.
+        """
+        s = self.get_stats()
+
+        def fmt(v):
+            return '-' if v is None else f'{v:.0f}'
+
+        lines = [
+            f'fps: {"-" if s["fps"] is None else round(s["fps"], 1)} '
+            f'shown: {s["frames_displayed"]} dropped: {s["frames_dropped"]}'
+        ]
+        for stage in self.STAGES:
+            lines.append(
+                f'{stage} ms p50/p95/p99: '
+                + '/'.join(fmt(s[f'{stage}_p{p}_ms']) for p in self.PERCENTILES)
+            )
+        return '\n'.join(lines)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
+from typing import List, Optional, Iterator
+from collections import deque
+import selectors
 import termios, fcntl, sys, os
-from time import sleep
 
 
 def get_char_keyboard_nonblock():
@@ -27,9 +29,83 @@ def get_char_keyboard_nonblock():
     return c
 
 
+class KeyboardReader:
+    """
+    Context manager reading single key presses from a terminal. The terminal is put into
+    cbreak mode (no line buffering, no echo) once on entry and restored on exit. Waiting for
+    keys blocks in `select` instead of polling, and every received key is delivered,
+    including auto-repeats of held keys.
+
+    :param fd: The file descriptor to read from. Defaults to stdin.
+               If it is not a terminal, it is read as is.
+    """
+
+    READ_SIZE = 1024
+
+    def __init__(self, fd: int = None):
+        self._fd = fd
+        self._old_attrs = None
+        self._selector = None
+        self._keys = deque()
+
+    def __enter__(self) -> 'KeyboardReader':
+        if self._fd is None:
+            self._fd = sys.stdin.fileno()
+        if os.isatty(self._fd):
+            self._old_attrs = termios.tcgetattr(self._fd)
+            newattr = termios.tcgetattr(self._fd)
+            newattr[3] = newattr[3] & ~termios.ICANON & ~termios.ECHO
+            newattr[6][termios.VMIN] = 1
+            newattr[6][termios.VTIME] = 0
+            termios.tcsetattr(self._fd, termios.TCSANOW, newattr)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._fd, selectors.EVENT_READ)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        if self._old_attrs is not None:
+            termios.tcsetattr(self._fd, termios.TCSAFLUSH, self._old_attrs)
+            self._old_attrs = None
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def read_available(self) -> List[str]:
+        """
+        Read all keys that can be read without blocking. Call when the file descriptor is
+        readable, e.g. from an event loop reader callback.
+
+        :return: The received keys in order.
+        """
+        data = os.read(self._fd, self.READ_SIZE)
+        if not len(data):
+            raise EOFError('Keyboard input was closed.')
+        return list(data.decode(errors='ignore'))
+
+    def read_key(self, timeout: float = None) -> Optional[str]:
+        """
+        Wait for the next key press.
+
+        :param timeout: Seconds to wait at most. If not supplied, wait indefinitely.
+        :return: The key, or None if the timeout expired.
+        """
+        if self._selector is None:
+            raise RuntimeError('KeyboardReader must be used as a context manager.')
+        while not len(self._keys):
+            if not self._selector.select(timeout):
+                return None
+            self._keys.extend(self.read_available())
+        return self._keys.popleft()
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            yield self.read_key()
+
+
 if __name__ == '__main__':
-    while True:
-        sleep(0.01)
-        c = get_char_keyboard_nonblock()
-        if c:
+    with KeyboardReader() as kb:
+        for c in kb:
             print(f'Supplied char: {c}')
@@ -1,4 +1,19 @@
+from typing import Dict, Optional, Set, Tuple
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import sys
+import time
+
+_PLAIN_LEVEL_NAMES = {
+    lvl: logging.getLevelName(lvl)
+    for lvl in (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL)
+}
 
 logging.addLevelName(logging.DEBUG, "\033[1;32m%s\033[1;0m" % logging.getLevelName(logging.DEBUG))
 logging.addLevelName(logging.INFO, "\033[1;34m%s\033[1;0m" % logging.getLevelName(logging.INFO))
@@ -8,9 +23,156 @@ logging.addLevelName(
 logging.addLevelName(logging.ERROR, "\033[1;41m%s\033[1;0m" % logging.getLevelName(logging.ERROR))
 
 
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        d = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'name': record.name,
+            'level': _PLAIN_LEVEL_NAMES.get(record.levelno, str(record.levelno)),
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            d['exc_info'] = record.exc_text
+        return json.dumps(d)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops records repeated from the same call site within `interval` seconds. The next record
+    let through from that call site reports how many were dropped.
+
+    :param interval: The minimum number of seconds between records from one call site.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._lock = Lock()
+        self._last: Dict[Tuple[str, int, str, int], Tuple[float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # messages are mostly f-strings, so identify repeats by call site instead of message
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            last, n_suppressed = self._last.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._last[key] = (last, n_suppressed + 1)
+                return False
+            self._last[key] = (now, 0)
+        if n_suppressed:
+            record.msg = f'{record.msg} (suppressed {n_suppressed} similar messages)'
+        return True
+
+
+class _BackgroundQueueHandler(QueueHandler):
+    """
+    A QueueHandler that writes directly to its fallback handler when no listener is running,
+    i.e. in forked child processes or after `shutdown_logging`.
+    """
+
+    def __init__(self, q, fallback: logging.Handler):
+        super().__init__(q)
+        self._pid = os.getpid()
+        self._fallback = fallback
+
+    def emit(self, record: logging.LogRecord):
+        if os.getpid() != self._pid or _LoggingConfig.listener is None:
+            self._fallback.handle(record)
+        else:
+            super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the message arguments in the calling thread, but leave formatting to the listener.
+        Unlike `QueueHandler.prepare`, the exception info is kept, with its traceback rendered
+        to `exc_text` right away.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+class _LoggingConfig:
+    queued = False
+    json_format = False
+    rate_limit_filter: Optional[RateLimitFilter] = None
+    queue = None
+    listener: Optional[QueueListener] = None
+    logger_names: Set[str] = set()
+
+
+def _get_formatter() -> logging.Formatter:
+    if _LoggingConfig.json_format:
+        return JsonFormatter()
+    logstring = (
+        '\033[1;32m[%(asctime)s]\033[1;0m \033[1m%(name)s\033[1;0m - %(levelname)s - %(message)s'
+    )
+    return logging.Formatter(logstring, '%Y-%m-%d %H:%M:%S')
+
+
+def _make_handler(level: int) -> logging.Handler:
+    ch = logging.StreamHandler()
+    ch.setFormatter(_get_formatter())
+    if _LoggingConfig.queued:
+        ch = _BackgroundQueueHandler(_LoggingConfig.queue, fallback=ch)
+    ch.setLevel(level)
+    if _LoggingConfig.rate_limit_filter is not None:
+        ch.addFilter(_LoggingConfig.rate_limit_filter)
+    return ch
+
+
+def configure_logging(queued: bool = False, json_format: bool = False, rate_limit: float = None):
+    """
+    Configure how loggers provided by `get_logger` write their records. Applies to existing
+    and future loggers.
+
+    :param queued: Whether to only put records into a queue in the logging thread, and write
+                   them to stderr in a background thread, so that slow stderr never blocks.
+    :param json_format: Whether to write records as JSON objects, one per line.
+    :param rate_limit: If supplied, drop records repeated from the same line of code within
+                       this many seconds.
+    """
+    shutdown_logging()
+    _LoggingConfig.queued = queued
+    _LoggingConfig.json_format = json_format
+    _LoggingConfig.rate_limit_filter = RateLimitFilter(rate_limit) if rate_limit else None
+    if queued:
+        _LoggingConfig.queue = queue.SimpleQueue()
+        # records are only formatted in the listener, see `_BackgroundQueueHandler.prepare`
+        writer = logging.StreamHandler(sys.stderr)
+        writer.setFormatter(_get_formatter())
+        _LoggingConfig.listener = QueueListener(_LoggingConfig.queue, writer)
+        _LoggingConfig.listener.start()
+    for name in _LoggingConfig.logger_names:
+        logger = logging.getLogger(name)
+        level = logger.handlers[0].level if len(logger.handlers) else logger.level
+        logger.handlers.clear()
+        logger.addHandler(_make_handler(level))
+
+
+def shutdown_logging():
+    """Write all queued records and stop the background writer, if running."""
+    if _LoggingConfig.listener is not None:
+        _LoggingConfig.listener.stop()
+        _LoggingConfig.listener = None
+
+
+atexit.register(shutdown_logging)
+
+
 def get_logger(initname, verb=False):
     """
     This function provides a logger to all scripts used in this project.
+    Its output is set up as configured with `configure_logging`.
 
     :param initname: The name of the logger to show up in log.
     :param verb: Toggle verbosity
@@ -21,15 +183,10 @@ def get_logger(initname, verb=False):
         logger.setLevel(logging.INFO if verb else logging.WARNING)
     else:
         logger.setLevel(verb)  # TODO: hacky shit
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO if verb else logging.WARNING)
-    logstring = (
-        '\033[1;32m[%(asctime)s]\033[1;0m \033[1m%(name)s\033[1;0m - %(levelname)s - %(message)s'
-    )
-    formatter = logging.Formatter(logstring, '%Y-%m-%d %H:%M:%S')
-    ch.setFormatter(formatter)
+    ch = _make_handler(logging.INFO if verb else logging.WARNING)
     if logger.hasHandlers():
         logger.handlers.clear()
     logger.addHandler(ch)
     logger.propagate = False
+    _LoggingConfig.logger_names.add(initname)
     return logger
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+from typing import Dict, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+from pathlib import Path
+from threading import Event, Lock, Thread
+import math
+import os
+import tempfile
+import time
+
+from rpicam.utils.logging_utils import get_logger
+
+
+class MetricsRegistry:
+    """Holds metrics by name and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, '_Metric'] = {}
+        self._lock = Lock()
+
+    def register(self, metric: '_Metric'):
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional['_Metric']:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return '+Inf' if v > 0 else '-Inf'
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric(ABC):
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, registry: MetricsRegistry = None):
+        self.name = name
+        self.documentation = documentation
+        self._lock = Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Get the samples of this metric as tuples of name suffix, labels and value."""
+        pass
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    TYPE = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1):
+        if amount < 0:
+            raise ValueError('Counters can only be increased.')
+        with self._lock:
+            self._value += amount
+
+    def samples(self):
+        return [('', '', self._value)]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    TYPE = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def samples(self):
+        return [('', '', self._value)]
+
+
+class Histogram(_Metric):
+    """
+    Counts observations into cumulative buckets.
+
+    :param buckets: The upper bounds of the buckets. An infinite bucket is always added.
+    """
+
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = sorted(set(buckets) | {math.inf})
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the wrapped block in seconds."""
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - t0)
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        res = []
+        cumulative = 0
+        for upper, n in zip(self.buckets, counts):
+            cumulative += n
+            res.append(('_bucket', f'{{le="{_format_value(upper)}"}}', cumulative))
+        res.append(('_sum', '', total))
+        res.append(('_count', '', count))
+        return res
+
+
+def write_textfile(path: Path, registry: MetricsRegistry = None):
+    """
+    Atomically write the metrics to a file, e.g. for the node_exporter textfile collector.
+
+    :param path: The file to write, which should end in `.prom`.
+    :param registry: The registry to render. Defaults to the global registry.
+    """
+    path = Path(str(path))
+    registry = registry if registry is not None else REGISTRY
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write(registry.render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class MetricsTextfileWriter:
+    """
+    Writes the metrics to a file periodically in a background thread, and once more on `stop`.
+
+    :param path: The file to write, which should end in `.prom`.
+    :param interval: Seconds between writes.
+    :param registry: The registry to render. Defaults to the global registry.
+    """
+
+    def __init__(self, path: Path, interval: float = 15, registry: MetricsRegistry = None):
+        self.path = Path(str(path))
+        self.interval = interval
+        self._registry = registry
+        self._stop = Event()
+        self._thread = None
+        self._logger = get_logger(self.__class__.__name__, verb=False)
+
+    def _run(self):
+        while True:
+            try:
+                write_textfile(self.path, self._registry)
+            except OSError as e:
+                self._logger.warning(f'Could not write metrics to {self.path}: {e}')
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='metrics-textfile', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            write_textfile(self.path, self._registry)
+
+
+class MetricsServer:
+    """
+    Serves the metrics at `/metrics` over HTTP in a background thread.
+
+    :param port: The port to listen on. If 0, pick a free port, see `port` after `start`.
+    :param host: The address to listen on. Defaults to localhost only.
+    :param registry: The registry to render. Defaults to the global registry.
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1', registry: MetricsRegistry = None):
+        self.host = host
+        self.port = port
+        self._registry = registry if registry is not None else REGISTRY
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+
+# metrics of the capture, encode, storage and upload pipeline
+FRAME_CAPTURE_SECONDS = Histogram(
+    'rpicam_frame_capture_seconds',
+    'Duration of capturing a single timelapse frame, including frame callbacks.',
+)
+FRAMES_CAPTURED = Counter('rpicam_frames_captured_total', 'Timelapse frames captured.')
+FRAMES_DROPPED = Counter(
+    'rpicam_frames_dropped_total', 'Timelapse frames that could not be captured and were skipped.'
+)
+FRAME_OVERTIME = Counter(
+    'rpicam_frame_overtime_total', 'Timelapse frames that took longer than the frame interval.'
+)
+CONSECUTIVE_OVERTIME = Gauge(
+    'rpicam_consecutive_overtime',
+    'Current number of consecutive overtime frames. Recording fails when this exceeds '
+    'rpicam_consecutive_overtime_limit.',
+)
+CONSECUTIVE_OVERTIME_LIMIT = Gauge(
+    'rpicam_consecutive_overtime_limit',
+    'Number of consecutive overtime frames tolerated before recording fails.',
+)
+ENCODE_QUEUE_DEPTH = Gauge('rpicam_encode_queue_depth', 'Stack encoders currently running.')
+ENCODE_SECONDS = Histogram(
+    'rpicam_encode_seconds', 'Duration of encoding a stack into a video.',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600),
+)
+ENCODE_FAILURES = Counter('rpicam_encode_failures_total', 'Stack encoders exiting with an error.')
+UPLOAD_SECONDS = Histogram('rpicam_upload_seconds', 'Duration of uploading a video.')
+UPLOAD_FAILURES = Counter('rpicam_upload_failures_total', 'Failed video uploads.')
+DISK_FILL_PERCENT = Gauge('rpicam_disk_fill_percent', 'Fill percentage of the storage disk.')
+STORAGE_MANAGED_BYTES = Gauge(
+    'rpicam_storage_managed_bytes', 'Total size of the files managed by the rotating storage.'
+)
+STORAGE_ROTATIONS = Counter(
+    'rpicam_storage_rotations_total', 'Files deleted by the rotating storage.'
+)
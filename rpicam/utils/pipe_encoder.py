@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+from queue import Queue
+from typing import List, Optional, Tuple
+from threading import Thread
+import time
+from rpicam.utils.callback_handler import CallbackHandler
+from rpicam.cams.callbacks import ExecPoint, Callback
+from rpicam.utils.logging_utils import get_logger
+from rpicam.utils.profiling import PhaseProfiler
+from rpicam.utils import metrics
+
+
+class PipeEncoder:
+    """
+    Encodes raw frames into a video while they are captured, by writing them to the stdin of
+    an ffmpeg process. Frames are handed to a writer thread through a bounded queue, so capture
+    only blocks once ffmpeg falls `max_queued` frames behind.
+
+    :param callbacks: Callbacks to run before and after conversion.
+    :param size: The frame size (width, height) in px.
+    :param fps: The frames per second of the video.
+    :param outfile: The path of the video.
+    :param pix_fmt: The ffmpeg pixel format of written frames.
+    :param max_queued: The maximum number of frames waiting to be written to ffmpeg.
+    :param profiler: An optional profiler to run during conversion, if it profiles the convert phase.
+    :param verbose: whether to write info logs to stderr.
+    """
+
+    def __init__(
+        self,
+        callbacks: List[Callback],
+        size: Tuple[int, int],
+        fps: int,
+        outfile: Path,
+        pix_fmt: str = 'bgr24',
+        max_queued: int = 8,
+        profiler: PhaseProfiler = None,
+        verbose: bool = False,
+    ):
+        self._cbh = CallbackHandler(callbacks, profiler=profiler)
+        self._size = size
+        self._fps = fps
+        self._outfile = Path(str(outfile))
+        self._pix_fmt = pix_fmt
+        self._frames = Queue(maxsize=max_queued)
+        self._process = None
+        self._writer: Optional[Thread] = None
+        self._finisher: Optional[Thread] = None
+        self._aborted = False
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+
+    def _run_ffmpeg(self):
+        """Start the ffmpeg process reading raw frames from its stdin."""
+        import ffmpeg
+
+        width, height = self._size
+        return (
+            ffmpeg.input(
+                'pipe:', format='rawvideo', pix_fmt=self._pix_fmt, s=f'{width}x{height}', framerate=self._fps
+            )
+            .output(str(self._outfile), pix_fmt='yuv420p')
+            .run_async(pipe_stdin=True, quiet=True)
+        )
+
+    def start(self):
+        """Start ffmpeg, waiting for frames."""
+        self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_CONVERT, stack_dir=None)
+        if self._outfile.is_file():
+            self._outfile.unlink()
+        self._process = self._run_ffmpeg()
+        self._writer = Thread(target=self._write_frames, name='pipe-encoder-writer', daemon=True)
+        self._writer.start()
+        self._logger.info('Begin video conversion.')
+
+    def _write_frames(self):
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                break
+            try:
+                self._process.stdin.write(frame)
+            except (BrokenPipeError, ValueError):
+                # ffmpeg exited early, its exit code is checked when finishing
+                pass
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def write(self, frame):
+        """
+        Queue a frame for encoding. Blocks while `max_queued` frames are waiting.
+
+        :param frame: An array of shape (height, width, channels) matching `pix_fmt`.
+        """
+        import numpy as np
+
+        self._frames.put(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        """Finish encoding after all queued frames, in the background. See `join`."""
+        if self._finisher is not None:
+            return
+        self._frames.put(None)
+        metrics.ENCODE_QUEUE_DEPTH.inc()
+        self._finisher = Thread(target=self._finish, args=(time.monotonic(),), daemon=True)
+        self._finisher.start()
+
+    def _finish(self, t0: float):
+        try:
+            self._writer.join()
+            returncode = self._process.wait()
+            metrics.ENCODE_SECONDS.observe(time.monotonic() - t0)
+            if returncode != 0 or not self._outfile.is_file():
+                metrics.ENCODE_FAILURES.inc()
+                if not self._aborted:
+                    self._logger.error(f'Error during processing: ffmpeg exited with {returncode}.')
+                return
+            self._logger.info('Finished video conversion.')
+            self._cbh.execute_callbacks(loc=ExecPoint.AFTER_CONVERT, outfile=self._outfile)
+            self._cbh.shutdown(wait=True)
+        finally:
+            metrics.ENCODE_QUEUE_DEPTH.dec()
+
+    def abort(self):
+        """Stop ffmpeg and remove the partial video."""
+        self._aborted = True
+        if self._process is not None:
+            self._process.kill()
+        self.close()
+        self.join()
+        if self._outfile.is_file():
+            self._outfile.unlink()
+
+    def join(self, timeout: float = None):
+        """Wait for encoding to finish after `close`."""
+        if self._finisher is not None:
+            self._finisher.join(timeout)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+from typing import Dict, Optional, Tuple
+from collections import deque
+from pathlib import Path
+from threading import Lock
+import io
+import os
+
+from rpicam.cams.callbacks import ExecPoint
+from rpicam.utils.frame_stats import percentile
+from rpicam.utils.logging_utils import get_logger
+
+# phases of a recording, as the ExecPoints they start and end at
+PHASES: Dict[str, Tuple[ExecPoint, ExecPoint]] = {
+    'init': (ExecPoint.BEFORE_INIT, ExecPoint.AFTER_INIT),
+    'record': (ExecPoint.BEFORE_RECORD, ExecPoint.AFTER_RECORD),
+    'stack_capture': (ExecPoint.BEFORE_STACK_CAPTURE, ExecPoint.AFTER_STACK_CAPTURE),
+    'frame_capture': (ExecPoint.BEFORE_FRAME_CAPTURE, ExecPoint.AFTER_FRAME_CAPTURE),
+    'convert': (ExecPoint.BEFORE_CONVERT, ExecPoint.AFTER_CONVERT),
+}
+
+
+class LatencyStats:
+    """
+    Aggregates durations: count, mean and maximum over all, percentiles over a rolling window.
+
+    :param window: The number of most recent durations to compute percentiles over.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._durations = deque(maxlen=window)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._lock = Lock()
+
+    def record(self, duration: float):
+        with self._lock:
+            self._durations.append(duration)
+            self._count += 1
+            self._total += duration
+            self._max = max(self._max, duration)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Get the aggregated stats, durations in milliseconds."""
+        with self._lock:
+            durations = list(self._durations)
+            count, total, max_ = self._count, self._total, self._max
+
+        def ms(v):
+            return round(v * 1000, 2) if v is not None else None
+
+        return {
+            'count': count,
+            'mean_ms': ms(total / count) if count else None,
+            'p50_ms': ms(percentile(durations, 50)),
+            'p95_ms': ms(percentile(durations, 95)),
+            'p99_ms': ms(percentile(durations, 99)),
+            'max_ms': ms(max_) if count else None,
+        }
+
+
+class PhaseProfiler:
+    """
+    Profiles every occurrence of a phase, with cProfile for CPU time or tracemalloc for
+    memory allocations. Results of all occurrences are accumulated until `dump`.
+    Only the thread entering the phase is profiled by cProfile.
+
+    :param phase: The phase to profile, one of `PHASES`.
+    :param mode: 'cprofile' or 'tracemalloc'.
+    :param out_dir: The directory to write results to on `dump`.
+    :param top: The number of entries to include in the summary.
+    """
+
+    MODES = ('cprofile', 'tracemalloc')
+
+    def __init__(self, phase: str, mode: str = 'cprofile', out_dir: Path = Path('.'), top: int = 25):
+        if phase not in PHASES:
+            raise RuntimeError(f'Unknown phase "{phase}", choose from {list(PHASES)}.')
+        if mode not in self.MODES:
+            raise RuntimeError(f'Unknown profiling mode "{mode}", choose from {self.MODES}.')
+        self.phase = phase
+        self.mode = mode
+        self.out_dir = Path(str(out_dir))
+        self.top = top
+        self._profile = None
+        self._snapshot_before = None
+        self._alloc_diffs = {}
+        self._logger = get_logger(self.__class__.__name__, verb=True)
+
+    @property
+    def start_at(self) -> ExecPoint:
+        return PHASES[self.phase][0]
+
+    @property
+    def stop_at(self) -> ExecPoint:
+        return PHASES[self.phase][1]
+
+    def start(self):
+        if self.mode == 'cprofile':
+            import cProfile
+
+            if self._profile is None:
+                self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            self._snapshot_before = tracemalloc.take_snapshot()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            if self._profile is not None:
+                self._profile.disable()
+        elif self._snapshot_before is not None:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            for diff in snapshot.compare_to(self._snapshot_before, 'lineno'):
+                key = str(diff.traceback)
+                size, count = self._alloc_diffs.get(key, (0, 0))
+                self._alloc_diffs[key] = (size + diff.size_diff, count + diff.count_diff)
+            self._snapshot_before = None
+
+    def summary(self) -> str:
+        """Get the top entries of the accumulated results as text."""
+        if self.mode == 'cprofile':
+            if self._profile is None:
+                return ''
+            import pstats
+
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+            return out.getvalue()
+        top = sorted(self._alloc_diffs.items(), key=lambda x: abs(x[1][0]), reverse=True)[: self.top]
+        return '\n'.join(f'{size / 1024:+.1f} KiB, {count:+d} blocks: {loc}' for loc, (size, count) in top)
+
+    def dump(self, tag: str = None) -> Optional[Path]:
+        """
+        Write the accumulated results to `out_dir`: a `.prof` file loadable with `pstats`
+        for cProfile, or a text summary for tracemalloc. File names contain the process id,
+        so that processes profiling concurrently or one after another, e.g. stack encoders,
+        do not overwrite each other's results.
+
+        :param tag: An optional name to append to the file name, e.g. of the encoded video.
+        :return: The path written to, or None if the phase did not occur.
+        """
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        suffix = f'{self.phase}-{os.getpid()}' + (f'-{tag}' if tag is not None else '')
+        if self.mode == 'cprofile':
+            if self._profile is None:
+                return None
+            out = self.out_dir / f'rpicam-profile-{suffix}.prof'
+            self._profile.dump_stats(str(out))
+        else:
+            if not len(self._alloc_diffs):
+                return None
+            out = self.out_dir / f'rpicam-tracemalloc-{suffix}.txt'
+            out.write_text(self.summary() + '\n')
+        self._logger.info(f'Wrote {self.mode} results of phase "{self.phase}" to {out}.')
+        return out
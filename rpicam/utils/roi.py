@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+from typing import Tuple
+
+
+def roi_to_scaler_crop(
+    roi: Tuple[float, float, float, float], crop_limits: Tuple[int, int, int, int]
+) -> Tuple[int, int, int, int]:
+    """
+    Convert a region of interest to a `ScalerCrop` rectangle in sensor pixels.
+
+    :param roi: The region as (x, y, width, height), relative to the full field of view in [0, 1].
+    :param crop_limits: The largest possible crop (x, y, width, height) in sensor pixels,
+                        e.g. the `crop_limits` of the sensor mode in use.
+    :return: The crop (x, y, width, height) in sensor pixels.
+    """
+    x, y, w, h = roi
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 - x and 0 < h <= 1 - y):
+        raise RuntimeError(f'Invalid region of interest {roi}: must lie within (0, 0, 1, 1).')
+    x0, y0, max_w, max_h = crop_limits
+    return (
+        x0 + int(round(x * max_w)),
+        y0 + int(round(y * max_h)),
+        int(round(w * max_w)),
+        int(round(h * max_h)),
+    )
+
+
+def fit_size(size: Tuple[int, int], aspect: float) -> Tuple[int, int]:
+    """
+    Get the largest size of the given aspect ratio that fits into `size`, in even pixels.
+
+    :param size: The (width, height) to fit into.
+    :param aspect: The ratio of width to height.
+    """
+    width, height = size
+    if width / height > aspect:
+        width = height * aspect
+    else:
+        height = width / aspect
+    return max(2, int(width) // 2 * 2), max(2, int(height) // 2 * 2)
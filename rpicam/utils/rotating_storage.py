@@ -1,42 +1,190 @@
 #!/usr/bin/env python3
 
+from typing import List, Optional, Tuple
+import glob
+import heapq
+import re
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
 from rpicam.utils.logging_utils import get_logger
+from rpicam.utils import metrics
+from rpicam.utils.tiered_retention import TieredRetention
 
 
 class RotatingStorage:
     """
     Provide rotating storage for long running camera jobs. When storage
     crosses threshold, delete oldest file in the job directory.
+
+    The managed files are indexed once at startup in a heap keyed by creation time,
+    and files handed out by the iterator are added to the index once they exist.
+    Before handing out a new file name, enough of the oldest files are deleted in a
+    single pass to keep all retention budgets with the expected size of the next file.
+
+    With tiered retention, aging files are re-encoded into lower fidelity tiers in the background
+    instead, and files in the final tier are the first to be deleted when over budget.
+
+    :param storage_dir: The job directory.
+    :param file_prefix: The prefix of managed file names.
+    :param file_ext: The extension of managed file names.
+    :param rotate_fill_perc: The disk fill percentage to stay below. If None, not enforced.
+    :param max_bytes: The total size of managed files to stay below. If None, not enforced.
+    :param max_age: The age after which managed files are deleted. If None, not enforced.
+    :param expected_file_size: The expected size of the next file in bytes. If not supplied,
+                               use the mean size of the managed files.
+    :param retention: The tiered retention to move aging files through. If not supplied,
+                      files are kept at full fidelity until deleted.
     """
+
     def __init__(
         self,
         storage_dir: Path,
         file_prefix: str = 'file',
         file_ext: str = '.mp4',
-        rotate_fill_perc: int = 90,
+        rotate_fill_perc: Optional[int] = 90,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[timedelta] = None,
+        expected_file_size: Optional[int] = None,
+        retention: TieredRetention = None,
     ):
         self.storage_dir = Path(str(storage_dir))
         self._file_prefix = file_prefix
         self._file_ext = file_ext
         self._rotate_fill_perc = rotate_fill_perc
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._expected_file_size = expected_file_size
+        self._retention = retention
         self._logger = get_logger(self.__class__.__name__, verb=True)
+        self._name_re = re.compile(rf'^{re.escape(file_prefix)}_(\d+)_(\d+)')
 
         if self.storage_dir.is_file():
             raise RuntimeError(f'Storage dir is a file: {storage_dir}')
         self.storage_dir.mkdir(exist_ok=True)
 
-    def _get_disk_fill_perc(self):
-        total, used, free = shutil.disk_usage(self.storage_dir)
-        return round(used / total * 100, 1)
+        self._heap: List[Tuple[float, str, int]] = []
+        self._managed_bytes = 0
+        self._issued: List[Path] = []
+        self._build_index()
+
+    def _creation_time(self, p: Path, mtime: float) -> float:
+        m = self._name_re.match(p.name)
+        if m is not None:
+            return float(f'{m.group(1)}.{m.group(2)}')
+        return mtime
+
+    def _index_file(self, p: Path, push: bool = True):
+        st = p.stat()
+        entry = (self._creation_time(p, st.st_mtime), str(p), st.st_size)
+        self._managed_bytes += st.st_size
+        if push:
+            heapq.heappush(self._heap, entry)
+        else:
+            self._heap.append(entry)
+
+    def _build_index(self):
+        if self._retention is not None:
+            partial_prefix = TieredRetention.PARTIAL_PREFIX
+            for p in self.storage_dir.glob(f'{partial_prefix}{self._file_prefix}_*{self._file_ext}'):
+                p.unlink()
+        for p in self.storage_dir.glob(f'{self._file_prefix}_*{self._file_ext}'):
+            self._index_file(p, push=False)
+        heapq.heapify(self._heap)
+        self._logger.info(
+            f'Indexed {len(self._heap)} files with {round(self._managed_bytes / 1e6, 1)} MB.'
+        )
+
+    def _index_issued(self):
+        """
+        Add previously handed out files to the index once they have been created. Writers may
+        create several files from one name instead, with a suffix appended to its stem, e.g.
+        one video per panorama position. All of them are indexed.
+        """
+        still_missing = []
+        for p in self._issued:
+            written = list(p.parent.glob(f'{glob.escape(p.stem)}_*{glob.escape(p.suffix)}'))
+            if p.is_file():
+                written.append(p)
+            if len(written):
+                for w in written:
+                    self._index_file(w)
+            else:
+                still_missing.append(p)
+        self._issued = still_missing
+
+    def _get_expected_file_size(self) -> int:
+        if self._expected_file_size is not None:
+            return self._expected_file_size
+        if not len(self._heap):
+            return 0
+        return self._managed_bytes // len(self._heap)
+
+    def _rotate_oldest_element(self) -> int:
+        """Delete the oldest managed file, and return its size in bytes."""
+        _, oldest, size = heapq.heappop(self._heap)
+        oldest = Path(oldest)
+        self._managed_bytes -= size
+        if oldest.is_file():
+            oldest.unlink()
+            metrics.STORAGE_ROTATIONS.inc()
+            self._logger.info(f'Rotated out oldest file: {oldest.name}')
+        return size
 
-    def _rotate_oldest_element(self):
-        oldest = sorted([x for x in self.storage_dir.glob(f'{self._file_prefix}_*{self._file_ext}')])[0]
-        oldest.unlink()
-        self._logger.info(f'Rotated out oldest file: {oldest.name}')
+    def _rotate_final_tier(self, to_free: int) -> int:
+        """Delete the oldest files in the final retention tier, and return the freed bytes."""
+        final_tier = self._retention.final_tier
+        final = sorted(e for e in self._heap if TieredRetention.get_tier(e[1]) == final_tier)
+        freed = 0
+        removed = set()
+        for entry in final:
+            if freed >= to_free:
+                break
+            p = Path(entry[1])
+            if p.is_file():
+                p.unlink()
+                metrics.STORAGE_ROTATIONS.inc()
+                self._logger.info(f'Rotated out oldest file of final retention tier: {p.name}')
+            freed += entry[2]
+            removed.add(entry)
+        if len(removed):
+            self._heap = [e for e in self._heap if e not in removed]
+            heapq.heapify(self._heap)
+            self._managed_bytes -= freed
+        return freed
+
+    def _apply_retention(self):
+        """Update the index with finished re-encodings and submit files due for a lower tier."""
+        for src, dst, size in self._retention.pop_finished():
+            idx = next((i for i, e in enumerate(self._heap) if e[1] == str(src)), None)
+            if idx is None:
+                # source was rotated out while being re-encoded
+                if dst.is_file():
+                    dst.unlink()
+                continue
+            if size is None:
+                continue
+            created, _, old_size = self._heap[idx]
+            # the creation time is unchanged, so replacing in place keeps the heap invariant
+            self._heap[idx] = (created, str(dst), size)
+            self._managed_bytes += size - old_size
+        now = datetime.now().timestamp()
+        for created, p, _ in self._heap:
+            due = self._retention.get_due_tier(created, now)
+            if due > TieredRetention.get_tier(p) and not self._retention.is_pending(p):
+                self._retention.submit(Path(p), due)
+
+    def _get_bytes_to_free(self) -> int:
+        expected = self._get_expected_file_size()
+        to_free = 0
+        if self._max_bytes is not None:
+            to_free = max(to_free, self._managed_bytes + expected - self._max_bytes)
+        if self._rotate_fill_perc is not None:
+            total, used, free = shutil.disk_usage(self.storage_dir)
+            metrics.DISK_FILL_PERCENT.set(round(used / total * 100, 1))
+            to_free = max(to_free, used + expected - int(total * self._rotate_fill_perc / 100))
+        return to_free
 
     def _get_new_element_name(self):
         unixtime = str(datetime.now().timestamp()).replace('.', '_')
@@ -50,16 +198,27 @@ class RotatingStorage:
         Iterator to get a new file name in the job storage directory while possibly rotating
         out existing files if storages gets too full.
         """
-        while self._get_disk_fill_perc() > self._rotate_fill_perc:
-            try:
+        self._index_issued()
+        if self._retention is not None:
+            self._apply_retention()
+        if self._max_age is not None:
+            cutoff = (datetime.now() - self._max_age).timestamp()
+            while len(self._heap) and self._heap[0][0] < cutoff:
                 self._rotate_oldest_element()
-            except IndexError:
-                break
-        if self._get_disk_fill_perc() > self._rotate_fill_perc:
+        to_free = self._get_bytes_to_free()
+        freed = 0
+        if to_free > 0 and self._retention is not None:
+            freed += self._rotate_final_tier(to_free)
+        while freed < to_free and len(self._heap):
+            freed += self._rotate_oldest_element()
+        if freed < to_free:
             still_too_full_msg = 'Could not free up enough storage.'
             self._logger.error(still_too_full_msg)
             raise RuntimeError(still_too_full_msg)
-        return self._get_new_element_name()
+        metrics.STORAGE_MANAGED_BYTES.set(self._managed_bytes)
+        name = self._get_new_element_name()
+        self._issued.append(Path(name))
+        return name
 
 
 if __name__ == '__main__':
@@ -1,43 +1,88 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
-from typing import List
+from typing import List, Union
 from multiprocessing import Process
+from threading import Thread
+import time
 from rpicam.utils.callback_handler import CallbackHandler
-
-import ffmpeg
 from rpicam.cams.callbacks import ExecPoint, Callback
 from rpicam.utils.logging_utils import get_logger
+from rpicam.utils.profiling import PhaseProfiler
+from rpicam.utils import metrics
 
 
 class StackEncoder(Process):
-    def __init__(self, callbacks: List[Callback], stack_dir: Path, fps: int, outfile: Path):
+    """
+    Encodes a stack of PNG images into a video in a separate process.
+
+    :param callbacks: Callbacks to run before and after conversion.
+    :param stack_dir: The directory containing the stack. If a list of directories is given,
+                      their stacks are placed side by side in the video.
+    :param fps: The frames per second of the video.
+    :param outfile: The path of the video. If not supplied, create out.mp4 in the (first) stack dir.
+    :param profiler: An optional profiler to run during conversion, if it profiles the convert phase.
+    """
+
+    def __init__(
+        self,
+        callbacks: List[Callback],
+        stack_dir: Union[Path, List[Path]],
+        fps: int,
+        outfile: Path,
+        profiler: PhaseProfiler = None,
+    ):
         super().__init__()
-        self._cbh = CallbackHandler(callbacks)
-        self._stack_dir = stack_dir
+        self._cbh = CallbackHandler(callbacks, profiler=profiler)
+        self._stack_dirs = stack_dir if isinstance(stack_dir, (list, tuple)) else [stack_dir]
+        self._stack_dir = self._stack_dirs[0]
         self._fps = fps
         self._outfile = outfile
         self._logger = get_logger(initname=self.__class__.__name__)
 
+    def start(self):
+        """Start encoding, and record its duration and outcome from a watcher thread."""
+        super().start()
+        metrics.ENCODE_QUEUE_DEPTH.inc()
+        Thread(target=self._watch, args=(time.monotonic(),), daemon=True).start()
+
+    def _watch(self, t0: float):
+        self.join()
+        metrics.ENCODE_QUEUE_DEPTH.dec()
+        metrics.ENCODE_SECONDS.observe(time.monotonic() - t0)
+        if self.exitcode != 0:
+            metrics.ENCODE_FAILURES.inc()
+
     def run(self):
         """
         Convert a stack of images to a video file using ffmpeg-python.
         """
+        import ffmpeg
+
         self._cbh.execute_callbacks(loc=ExecPoint.BEFORE_CONVERT, stack_dir=self._stack_dir)
         self._logger.info('Begin video conversion.')
         outfile = Path(str(self._outfile)) if self._outfile is not None else self._stack_dir / 'out.mp4'
         if outfile.is_file():
             outfile.unlink()
-        (
-            ffmpeg.input(f'{str(self._stack_dir)}/*.png', pattern_type='glob', framerate=self._fps)
-            .output(str(outfile), pix_fmt='yuv420p')
-            .run(quiet=True)
-        )
+        inputs = [
+            ffmpeg.input(f'{str(d)}/*.png', pattern_type='glob', framerate=self._fps)
+            for d in self._stack_dirs
+        ]
+        if len(inputs) > 1:
+            stream = ffmpeg.filter(inputs, 'hstack', inputs=len(inputs))
+        else:
+            stream = inputs[0]
+        stream.output(str(outfile), pix_fmt='yuv420p').run(quiet=True)
         if not outfile.is_file():
             self._cbh.raise_with_callbacks(
                 RuntimeError('Error during processing: output file not found.')
             )
-        for f in self._stack_dir.glob('*.png'):
-            f.unlink()
+        for d in self._stack_dirs:
+            for f in d.glob('*.png'):
+                f.unlink()
         self._logger.info('Finished video conversion.')
         self._cbh.execute_callbacks(loc=ExecPoint.AFTER_CONVERT, outfile=outfile)
+        # the process exits after run, so finish offloaded callbacks first
+        self._cbh.shutdown(wait=True)
+        if self._cbh.profiler is not None and self._cbh.profiler.phase == 'convert':
+            self._cbh.profiler.dump(tag=outfile.stem)
@@ -2,30 +2,130 @@
 
 import os
 import json
+import copy
+import fcntl
+import tempfile
+from contextlib import contextmanager
 from pprint import pformat
 from pathlib import Path
-from typing import Union, List, Hashable, Optional, Any, Dict
+from typing import Union, List, Hashable, Optional, Any, Dict, Tuple
 from multiprocessing import Lock
 
 from rpicam.utils.logging_utils import get_logger
 
 
 class State:
+    """
+    Semi-persistent key-value store in a JSON file in TMPDIR, safe to share between threads,
+    processes and separate CLI invocations.
+
+    The file contents are cached in memory and only re-read when the file changed on disk.
+    Writes take an exclusive `fcntl` lock on a companion lock file, merge the pending changes
+    into the current file contents, and replace the file atomically.
+
+    :param lock: An optional additional lock to hold while writing.
+    :param autoflush: Whether to write every change immediately. If False, changes are
+                      collected until `flush` or `close` is called, or the context is exited.
+    """
 
     STATE_FILE_NAME = 'rpicam-state.json'
+    LOCK_FILE_SUFFIX = '.lock'
 
-    def __init__(self, lock: Lock = None):
+    def __init__(self, lock: Lock = None, autoflush: bool = True):
         tmpdir = os.getenv('TMPDIR', '/tmp')
         self.sfp = Path(tmpdir) / self.STATE_FILE_NAME
+        self._lock_fp = self.sfp.with_name(self.sfp.name + self.LOCK_FILE_SUFFIX)
         self._logger = get_logger(self.__class__.__name__, verb=True)
-        if not self.sfp.is_file():
-            with open(self.sfp, 'w') as fout:
-                json.dump({}, fout)
-            self.sfp.touch(exist_ok=True)
         self.lock = lock
+        self.autoflush = autoflush
+        self._data = None
+        self._file_sig = None
+        self._pending: List[Tuple[List[str], Any]] = []
+        if not self.sfp.is_file():
+            with self._file_lock(exclusive=True):
+                if not self.sfp.is_file():
+                    self._write_atomic({})
+
+    def __enter__(self) -> 'State':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def __repr__(self):
-        return pformat(json.loads(self.sfp.read_text()))
+        return pformat(self._get_data())
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if exclusive and self.lock is not None:
+            self.lock.acquire()
+        try:
+            with open(self._lock_fp, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            if exclusive and self.lock is not None:
+                self.lock.release()
+
+    def _get_file_sig(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.sfp)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _read_file(self) -> Dict:
+        try:
+            return json.loads(self.sfp.read_text())
+        except FileNotFoundError:
+            return {}
+
+    def _write_atomic(self, d: Dict):
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{self.sfp.name}.', dir=str(self.sfp.parent))
+        try:
+            with os.fdopen(fd, 'w') as fout:
+                json.dump(d, fout, indent=2)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(tmp_path, self.sfp)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _normalize_keys(k: Union[Hashable, List[Hashable]]) -> List[str]:
+        if isinstance(k, str) or not isinstance(k, (list, tuple)):
+            k = [k]
+        return [str(x) for x in k]
+
+    def _apply(self, d: Dict, k: List[str], v):
+        subd = d
+        for key in k[:-1]:
+            new_subd = subd.setdefault(key, {})
+            if not isinstance(new_subd, dict):
+                self._logger.warning(f'Overwriting State structure when writing keys!')
+                subd[key] = {}
+            else:
+                subd[key] = new_subd
+            subd = subd[key]
+        subd[k[-1]] = v
+
+    def _get_data(self) -> Dict:
+        """Get the cached contents, re-reading the file only if it changed on disk."""
+        sig = self._get_file_sig()
+        if self._data is None or sig != self._file_sig:
+            with self._file_lock(exclusive=False):
+                sig = self._get_file_sig()
+                data = self._read_file()
+            for k, v in self._pending:
+                self._apply(data, k, v)
+            self._data = data
+            self._file_sig = sig
+        return self._data
 
     def __getitem__(self, k: Union[Hashable, List[Hashable]]) -> Optional[Any]:
         """
@@ -36,10 +136,8 @@ class State:
         :param k: the list of keys or single key.
         :returns: the values at the given key(s).
         """
-        d = json.loads(self.sfp.read_text())
-        if isinstance(k, str):
-            k = [k]
-        k = [str(x) for x in k]
+        d = self._get_data()
+        k = self._normalize_keys(k)
         prev_k = None
         while len(k):
             if not isinstance(d, dict):
@@ -50,7 +148,7 @@ class State:
             prev_k = k.pop(0)
         if d == {}:
             d = None
-        return d
+        return copy.deepcopy(d)
 
     def __setitem__(self, k: Union[Hashable, List[Hashable]], v):
         """
@@ -62,30 +160,28 @@ class State:
         :param k: the list of keys or single key.
         :param v: the value to set at the given key(s).
         """
-        if self.lock is not None:
-            self.lock.acquire()
-
-        d = json.loads(self.sfp.read_text())
-        if isinstance(k, str):
-            k = [k]
-        k = [str(x) for x in k]
-
-        subd = d
-        for key in k[:-1]:
-            new_subd = subd.setdefault(key, {})
-            if not isinstance(new_subd, dict):
-                self._logger.warning(f'Overwriting State structure when writing keys!')
-                subd[key] = {}
-            else:
-                subd[key] = new_subd
-            subd = subd[key]
-        subd[k[-1]] = v
-
-        with open(self.sfp, 'w') as fout:
-            json.dump(d, fout, indent=2)
-
-        if self.lock is not None:
-            self.lock.release()
+        k = self._normalize_keys(k)
+        v = copy.deepcopy(v)
+        self._apply(self._get_data(), k, v)
+        self._pending.append((k, v))
+        if self.autoflush:
+            self.flush()
+
+    def flush(self):
+        """Write all pending changes, merged into the current contents of the file."""
+        if not len(self._pending):
+            return
+        with self._file_lock(exclusive=True):
+            data = self._read_file()
+            for k, v in self._pending:
+                self._apply(data, k, v)
+            self._write_atomic(data)
+            self._file_sig = self._get_file_sig()
+        self._pending = []
+        self._data = data
+
+    def close(self):
+        self.flush()
 
 
 if __name__ == '__main__':
@@ -1,47 +1,155 @@
 #!/usr/bin/env python3
 
 import os
-from typing import Union
+import uuid
+from typing import BinaryIO, List, Tuple, Union
 from pathlib import Path
 
-import requests
-
 from rpicam.utils.logging_utils import get_logger
+from rpicam.utils import metrics
+
+
+class MultipartStream:
+    """
+    A multipart/form-data request body that streams file parts from disk instead of
+    loading them into memory. Its length is known up front, so it is sent with a
+    Content-Length header instead of chunked.
+
+    :param fields: The form fields, as tuples of name and value.
+    :param files: The file fields, as tuples of name, file name and open binary file.
+    """
+
+    def __init__(self, fields: List[Tuple[str, str]], files: List[Tuple[str, str, BinaryIO]]):
+        self.boundary = uuid.uuid4().hex
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(self._part_header(name) + f'\r\n{value}\r\n'.encode())
+        for name, filename, fobj in files:
+            self._parts.append(self._part_header(name, filename) + b'\r\n')
+            self._parts.append(fobj)
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+        self._len = sum(
+            len(p) if isinstance(p, bytes) else os.fstat(p.fileno()).st_size - p.tell()
+            for p in self._parts
+        )
+        self._idx = 0
+
+    def _part_header(self, name: str, filename: str = None) -> bytes:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        header = f'--{self.boundary}\r\nContent-Disposition: {disposition}\r\n'
+        if filename is not None:
+            header += 'Content-Type: application/octet-stream\r\n'
+        return header.encode()
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self) -> int:
+        return self._len
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._idx < len(self._parts) and size != 0:
+            part = self._parts[self._idx]
+            if isinstance(part, bytes):
+                chunk = part if size < 0 else part[:size]
+                if len(chunk) < len(part):
+                    self._parts[self._idx] = part[len(chunk):]
+                else:
+                    self._idx += 1
+            else:
+                chunk = part.read(size)
+                if size < 0 or len(chunk) < size:
+                    self._idx += 1
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
 
 
 class TelegramPoster:
     """
     Bare-bones class to post videos to a Telegram chat.
     Uses per default credentials stored in environment.
+
+    Connections are pooled in a `requests.Session`, and videos are streamed from disk.
+
+    :param api_token: The bot API token. Read from the environment if not supplied.
+    :param chat_id: The chat to post to. Read from the environment if not supplied.
+    :param api_url: The base URL of the Bot API.
+    :param timeout: Seconds to wait for connecting, and for the response after sending.
     """
 
     API_URL = 'https://api.telegram.org'
     API_TOKEN_ENV_VAR = 'RPICAM_TG_API_TOKEN'
     CHAT_ID_ENV_VAR = 'RPICAM_TG_CHAT_ID'
+    CONNECT_TIMEOUT = 10  # sec
+    READ_TIMEOUT = 120  # sec
 
-    def __init__(self, api_token: str = None, chat_id: str = None):
+    def __init__(
+        self,
+        api_token: str = None,
+        chat_id: str = None,
+        api_url: str = API_URL,
+        timeout: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT),
+    ):
         if api_token is not None and chat_id is not None:
             self.api_token = api_token
             self.chat_id = chat_id
         else:
             self.api_token = os.getenv(self.API_TOKEN_ENV_VAR, None)
             self.chat_id = os.getenv(self.CHAT_ID_ENV_VAR, None)
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._session = None
         self._logger = get_logger(self.__class__.__name__, verb=True)
         if self.api_token is None or self.chat_id is None:
             raise RuntimeError('Could not find Telegram credentials in environment.')
 
+    def _get_session(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
     def send_video(self, p: Union[Path, str]):
-        """Post the given video to Telegram using stored credentials."""
+        """
+        Post the given video to Telegram using stored credentials.
+
+        :raises RuntimeError: if the file does not exist or the upload was not accepted.
+        :raises requests.RequestException: if the request failed, e.g. timed out.
+        """
+        import requests
+
         p = Path(str(p)).resolve()
         if not p.is_file():
             raise RuntimeError(f'file not found: {p}')
-        url = f'{self.API_URL}/bot{self.api_token}/sendVideo'
-        files = {
-            'chat_id': (None, self.chat_id),
-            'video': (str(p), open(p, 'rb'))
-        }
-        r = requests.post(url, files=files)
+        url = f'{self.api_url}/bot{self.api_token}/sendVideo'
+        with open(p, 'rb') as fin, metrics.UPLOAD_SECONDS.time():
+            body = MultipartStream(fields=[('chat_id', self.chat_id)], files=[('video', p.name, fin)])
+            try:
+                r = self._get_session().post(
+                    url,
+                    data=body,
+                    headers={'Content-Type': body.content_type},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException:
+                metrics.UPLOAD_FAILURES.inc()
+                raise
         if r.status_code != 200:
-            self._logger.error(f'Could not upload file. Exit code was {r.status_code}: "{r.text}"')
-        else:
-            self._logger.info(f'Successfully uploaded file to Telegram.')
+            metrics.UPLOAD_FAILURES.inc()
+            err = f'Could not upload file. Exit code was {r.status_code}: "{r.text}"'
+            self._logger.error(err)
+            raise RuntimeError(err)
+        self._logger.info(f'Successfully uploaded file to Telegram.')
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+from typing import List, NamedTuple, Optional, Tuple
+from datetime import datetime, timedelta
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+import os
+import re
+import shutil
+
+from rpicam.utils.logging_utils import get_logger
+
+
+class RetentionTier(NamedTuple):
+    """
+    A retention tier, applied to files older than `min_age`.
+    `scale` and `decimate` are relative to the original recording, so tiers can be skipped.
+
+    :param min_age: The age from which files are moved into this tier.
+    :param scale: The factor to scale width and height of the original by.
+    :param fps: The frame rate of the re-encoded video.
+    :param bitrate: The video bitrate of the re-encoded video, e.g. '500k'.
+    :param decimate: Keep only every n-th frame of the original.
+    """
+
+    min_age: timedelta
+    scale: Optional[float] = None
+    fps: Optional[int] = None
+    bitrate: Optional[str] = None
+    decimate: Optional[int] = None
+
+    @classmethod
+    def parse(cls, s: str) -> 'RetentionTier':
+        """
+        Parse a tier from a string of the form `MIN_AGE_DAYS[:key=value,...]`,
+        e.g. `7:scale=0.5,decimate=2` or `30:fps=10,bitrate=300k`.
+        """
+        min_age, _, opts = s.partition(':')
+        kwargs = {}
+        types = {'scale': float, 'fps': int, 'bitrate': str, 'decimate': int}
+        try:
+            for opt in filter(None, opts.split(',')):
+                k, _, v = opt.partition('=')
+                if k not in types:
+                    raise RuntimeError(f'Unknown retention tier option "{k}" in "{s}".')
+                kwargs[k] = types[k](v)
+            min_age = timedelta(days=float(min_age))
+        except ValueError as e:
+            raise RuntimeError(f'Invalid retention tier "{s}": {e}') from e
+        return cls(min_age=min_age, **kwargs)
+
+
+class TieredRetention:
+    """
+    Moves files into lower fidelity tiers as they age, by re-encoding them at lower resolution,
+    frame rate or bitrate, or by dropping frames. The tier of a file is recorded in its name,
+    e.g. `timelapse_1650000000_123.t2.mp4`. Re-encoding runs one file at a time in a background
+    thread, with ffmpeg at the lowest CPU priority, so that capturing is not disturbed.
+
+    :param tiers: The retention tiers, by ascending `min_age`. Tier numbers start at 1,
+                  tier 0 being the original recording.
+    :param niceness: The niceness to run ffmpeg with.
+    :param verbose: whether to write info logs to stderr.
+    """
+
+    TIER_RE = re.compile(r'^\.t(\d+)$')
+    PARTIAL_PREFIX = '.'
+
+    def __init__(self, tiers: List[RetentionTier], niceness: int = 19, verbose: bool = False):
+        if not len(tiers):
+            raise RuntimeError('At least one retention tier must be supplied.')
+        if list(tiers) != sorted(tiers, key=lambda t: t.min_age):
+            raise RuntimeError('Retention tiers must be given by ascending min_age.')
+        self.tiers = list(tiers)
+        self.niceness = niceness
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+        self._q = Queue()
+        self._finished = Queue()
+        self._pending = set()
+        self._worker = None
+
+    @property
+    def final_tier(self) -> int:
+        return len(self.tiers)
+
+    @classmethod
+    def get_tier(cls, p: Path) -> int:
+        """Get the tier a file is in from its name."""
+        m = cls.TIER_RE.match(Path(Path(str(p)).stem).suffix)
+        return int(m.group(1)) if m is not None else 0
+
+    @classmethod
+    def get_tier_path(cls, p: Path, tier: int) -> Path:
+        """Get the name of the given file in the given tier."""
+        p = Path(str(p))
+        stem = p.stem
+        if cls.get_tier(p) > 0:
+            stem = Path(stem).stem
+        return p.with_name(f'{stem}.t{tier}{p.suffix}')
+
+    def get_due_tier(self, created: float, now: float = None) -> int:
+        """
+        Get the tier a file should be in.
+
+        :param created: The unix timestamp the file was created at.
+        :param now: The current unix timestamp. Defaults to now.
+        :return: The tier number, 0 if no tier applies yet.
+        """
+        now = now if now is not None else datetime.now().timestamp()
+        age = timedelta(seconds=now - created)
+        due = 0
+        for i, tier in enumerate(self.tiers):
+            if age >= tier.min_age:
+                due = i + 1
+        return due
+
+    def is_pending(self, p: Path) -> bool:
+        return str(p) in self._pending
+
+    def submit(self, p: Path, tier: int):
+        """Queue a file for re-encoding into the given tier."""
+        if self.is_pending(p):
+            return
+        self._pending.add(str(p))
+        if self._worker is None:
+            self._worker = Thread(target=self._work, name='tiered-retention', daemon=True)
+            self._worker.start()
+        self._q.put((Path(str(p)), tier))
+
+    def pop_finished(self) -> List[Tuple[Path, Path, Optional[int]]]:
+        """
+        Get all re-encodings finished since the last call.
+
+        :return: Tuples of source path, new path and new size in bytes.
+                 The size is None if re-encoding failed and the source was kept.
+        """
+        res = []
+        while not self._finished.empty():
+            src, dst, size = self._finished.get_nowait()
+            self._pending.discard(str(src))
+            res.append((src, dst, size))
+        return res
+
+    def close(self):
+        """Stop the worker after the currently running re-encoding."""
+        if self._worker is not None:
+            self._q.put(None)
+            self._worker.join()
+            self._worker = None
+
+    def _work(self):
+        while True:
+            job = self._q.get()
+            if job is None:
+                return
+            src, tier = job
+            dst = self.get_tier_path(src, tier)
+            try:
+                if not src.is_file():
+                    raise FileNotFoundError(f'File was removed before re-encoding: {src}')
+                self._transcode(src, dst, tier)
+                size = dst.stat().st_size
+                src.unlink()
+                self._logger.info(f'Moved {src.name} to retention tier {tier}.')
+                self._finished.put((src, dst, size))
+            except Exception as e:
+                self._logger.warning(f'Could not move {src.name} to retention tier {tier}: {e}')
+                self._finished.put((src, dst, None))
+
+    def _transcode(self, src: Path, dst: Path, tier: int):
+        import ffmpeg
+
+        target = self.tiers[tier - 1]
+        current = self.tiers[self.get_tier(src) - 1] if self.get_tier(src) > 0 else None
+        cur_scale = current.scale if current is not None and current.scale is not None else 1
+        cur_decimate = current.decimate if current is not None and current.decimate is not None else 1
+
+        stream = ffmpeg.input(str(src)).video
+        if target.decimate is not None and target.decimate // cur_decimate > 1:
+            stream = stream.filter('select', f'not(mod(n\\,{target.decimate // cur_decimate}))')
+            stream = stream.filter('setpts', 'N/FRAME_RATE/TB')
+        if target.scale is not None and target.scale / cur_scale < 1:
+            factor = target.scale / cur_scale
+            stream = stream.filter('scale', f'trunc(iw*{factor}/2)*2', f'trunc(ih*{factor}/2)*2')
+        if target.fps is not None:
+            stream = stream.filter('fps', fps=target.fps)
+        output_kwargs = dict(pix_fmt='yuv420p')
+        if target.bitrate is not None:
+            output_kwargs['video_bitrate'] = target.bitrate
+
+        partial = dst.with_name(f'{self.PARTIAL_PREFIX}{dst.name}')
+        cmd = ['nice', '-n', str(self.niceness), 'ffmpeg'] if shutil.which('nice') else 'ffmpeg'
+        try:
+            stream.output(str(partial), **output_kwargs).run(cmd=cmd, quiet=True, overwrite_output=True)
+            os.replace(partial, dst)
+        finally:
+            if partial.is_file():
+                partial.unlink()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+from typing import Dict, List, Optional, Union
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Condition, Thread
+import fcntl
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from rpicam.utils.logging_utils import get_logger
+
+
+class UploadQueue:
+    """
+    A persistent queue of files to upload, drained by a background worker thread.
+
+    Every queued upload is journaled as a JSON file in `journal_dir` until it succeeds, so
+    uploads survive restarts and can be queued from other processes, e.g. stack encoders:
+    `put` only writes the journal entry, and the worker picks up new entries when woken or
+    at the latest after `poll_interval`. Failed uploads are retried with exponential backoff.
+
+    :param uploader: An object with a blocking `send_video(path)` method raising on failure,
+                     e.g. a TelegramPoster.
+    :param journal_dir: The directory to journal queued uploads in.
+    :param max_attempts: Attempts after which an upload is given up. If None, retry forever.
+    :param backoff_base: Seconds to wait after the first failed attempt. Doubles with each failure.
+    :param backoff_max: Maximum seconds to wait between attempts.
+    :param poll_interval: Seconds between checks for entries journaled by other processes.
+    :param verbose: whether to write info logs to stderr.
+    """
+
+    JOURNAL_SUFFIX = '.json'
+    LOCK_FILE_NAME = '.lock'
+    DEFAULT_JOURNAL_DIR = Path.home() / '.cache' / 'rpicam' / 'upload-queue'
+
+    def __init__(
+        self,
+        uploader,
+        journal_dir: Path = None,
+        max_attempts: Optional[int] = 10,
+        backoff_base: float = 5,
+        backoff_max: float = 3600,
+        poll_interval: float = 5,
+        verbose: bool = False,
+    ):
+        self.uploader = uploader
+        self.journal_dir = Path(str(journal_dir)) if journal_dir is not None else self.DEFAULT_JOURNAL_DIR
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self._logger = get_logger(self.__class__.__name__, verb=verbose)
+        self._cond = Condition()
+        self._stopping = False
+        self._busy = False
+        self._worker = None
+
+    def __enter__(self) -> 'UploadQueue':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_entry(self, entry: Dict):
+        fp = self.journal_dir / f'{entry["id"]}{self.JOURNAL_SUFFIX}'
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{fp.name}.', dir=str(self.journal_dir))
+        try:
+            with os.fdopen(fd, 'w') as fout:
+                json.dump(entry, fout)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(tmp_path, fp)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _remove_entry(self, entry: Dict):
+        fp = self.journal_dir / f'{entry["id"]}{self.JOURNAL_SUFFIX}'
+        if fp.is_file():
+            fp.unlink()
+
+    @contextmanager
+    def _journal_lock(self):
+        """Hold an exclusive lock on the journal, so that only one worker attempts an entry."""
+        with open(self.journal_dir / self.LOCK_FILE_NAME, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def pending(self) -> List[Dict]:
+        """Get the journaled uploads, by queue order."""
+        entries = []
+        for fp in self.journal_dir.glob(f'*{self.JOURNAL_SUFFIX}'):
+            try:
+                entries.append(json.loads(fp.read_text()))
+            except (OSError, ValueError):
+                # removed or being replaced concurrently
+                continue
+        return sorted(entries, key=lambda e: (e['queued_at'], e['id']))
+
+    def put(self, path: Union[Path, str]):
+        """Queue a file for upload. Returns immediately."""
+        now = time.time()
+        # ids sort by queue time, so that entries of several processes keep their order
+        entry = dict(
+            id=f'{int(now * 1e6):017d}-{uuid.uuid4().hex[:8]}',
+            path=str(Path(str(path)).resolve()),
+            queued_at=now,
+            attempts=0,
+            next_attempt_at=now,
+        )
+        self._write_entry(entry)
+        self._logger.info(f'Queued upload of {entry["path"]}.')
+        with self._cond:
+            self._cond.notify_all()
+
+    def _get_backoff(self, attempts: int) -> float:
+        backoff = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        # jitter avoids retrying in lockstep with other devices after an outage
+        return backoff * random.uniform(0.8, 1.0)
+
+    def _attempt(self, entry: Dict):
+        path = Path(entry['path'])
+        if not path.is_file():
+            self._logger.error(f'Dropping upload of {path}: file not found.')
+            self._remove_entry(entry)
+            return
+        try:
+            self.uploader.send_video(path)
+        except Exception as e:
+            entry['attempts'] += 1
+            if self.max_attempts is not None and entry['attempts'] >= self.max_attempts:
+                self._logger.error(f'Giving up upload of {path} after {entry["attempts"]} attempts: {e}')
+                self._remove_entry(entry)
+                return
+            backoff = self._get_backoff(entry['attempts'])
+            entry['next_attempt_at'] = time.time() + backoff
+            self._write_entry(entry)
+            self._logger.warning(
+                f'Upload of {path} failed (attempt {entry["attempts"]}), retrying in {round(backoff, 1)} sec: {e}'
+            )
+            return
+        self._remove_entry(entry)
+        self._logger.info(f'Uploaded {path}.')
+
+    def _work(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                self._busy = True
+            with self._journal_lock():
+                entries = self.pending()
+                now = time.time()
+                due = [e for e in entries if e['next_attempt_at'] <= now]
+                if len(due):
+                    self._attempt(due[0])
+                    continue
+            wait = self.poll_interval
+            if len(entries):
+                wait = min(wait, min(e['next_attempt_at'] for e in entries) - now)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                if not self._stopping:
+                    self._cond.wait(max(wait, 0))
+
+    def start(self):
+        """Start the worker, resuming any uploads journaled before."""
+        if self._worker is not None:
+            return
+        self._stopping = False
+        self._worker = Thread(target=self._work, name='upload-queue', daemon=True)
+        self._worker.start()
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Wait until no uploads are queued.
+
+        :param timeout: Seconds to wait at most. If not supplied, wait indefinitely.
+        :return: Whether the queue was emptied.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            # wake the worker to pick up entries journaled by other processes
+            self._cond.notify_all()
+            while self._busy or len(self.pending()):
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        """Stop the worker after the running attempt. Queued uploads stay journaled."""
+        if self._worker is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._worker.join()
+        self._worker = None
@@ -0,0 +1,137 @@
+from pathlib import Path
+from threading import Event
+from types import SimpleNamespace
+import sys
+
+import pytest
+
+from rpicam.utils.pipe_encoder import PipeEncoder
+
+
+class FakeRequest:
+    def __init__(self, cam):
+        self.cam = cam
+
+    def make_array(self, name):
+        import numpy as np
+
+        width, height = self.cam.config['main']['size']
+        return np.full((height, width, 3), self.cam.n_requests % 256, dtype=np.uint8)
+
+    def get_metadata(self):
+        return {'FrameIdx': self.cam.n_requests}
+
+    def release(self):
+        pass
+
+
+class FakePicamera2:
+    """
+    Stands in for `picamera2.Picamera2`. Stills are written as empty files, and stream
+    requests hold uniform frames of the configured size, valued by their count.
+    """
+
+    camera_properties = {'ScalerCropMaximum': (0, 0, 4000, 3000)}
+    sensor_modes = []
+
+    def __init__(self, *args, **kwargs):
+        self.config = None
+        self.n_requests = 0
+
+    def create_still_configuration(self, **kwargs):
+        return kwargs
+
+    def create_video_configuration(self, **kwargs):
+        return kwargs
+
+    def set_controls(self, controls):
+        pass
+
+    def configure(self, config):
+        self.config = config
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+    def capture_file(self, path, *args, **kwargs):
+        Path(path).touch()
+        return {}
+
+    def capture_metadata(self):
+        return {'ExposureTime': 10000, 'AnalogueGain': 1.0}
+
+    def capture_request(self):
+        self.n_requests += 1
+        return FakeRequest(self)
+
+
+@pytest.fixture
+def fake_picamera2(monkeypatch):
+    """Let Cams be created without a camera, see `FakePicamera2`."""
+    monkeypatch.setitem(sys.modules, 'picamera2', SimpleNamespace(Picamera2=FakePicamera2))
+    monkeypatch.setitem(
+        sys.modules,
+        'libcamera',
+        SimpleNamespace(
+            Transform=lambda **kwargs: kwargs,
+            controls=SimpleNamespace(AwbModeEnum=SimpleNamespace(Indoor=0)),
+        ),
+    )
+
+
+class StubStdin:
+    def __init__(self, process):
+        self.process = process
+        self.frames = []
+        self.closed = False
+
+    def write(self, data):
+        if self.process.killed.is_set():
+            raise BrokenPipeError()
+        self.frames.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+
+class StubProcess:
+    """Collects the frames piped to it and writes the outfile on exit, like ffmpeg."""
+
+    def __init__(self, outfile, returncode=0):
+        self.outfile = outfile
+        self.returncode = returncode
+        self.killed = Event()
+        self.stdin = StubStdin(self)
+
+    def wait(self):
+        if self.killed.is_set():
+            return -9
+        if self.returncode == 0:
+            self.outfile.write_bytes(b''.join(self.stdin.frames))
+        return self.returncode
+
+    def kill(self):
+        self.killed.set()
+
+
+class StubPipeEncoder(PipeEncoder):
+    def __init__(self, *args, returncode=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.returncode = returncode
+        self.process = None
+
+    def _run_ffmpeg(self):
+        self.process = StubProcess(self._outfile, returncode=self.returncode)
+        return self.process
+
+
+@pytest.fixture
+def stub_pipe_encoder():
+    """A PipeEncoder piping into a `StubProcess` instead of ffmpeg."""
+    return StubPipeEncoder
@@ -0,0 +1,165 @@
+from concurrent.futures import CancelledError
+from threading import Event
+import asyncio
+import os
+import time
+
+import pytest
+
+from rpicam.platform import AsyncPlatform
+from rpicam.servo import Servo, SimulatedGPIOBackend, cw, ccw
+from rpicam.utils.keyboard_input import KeyboardReader
+from rpicam.utils.upload_queue import UploadQueue
+
+
+class FakeCam:
+    """Records instantly, or until stopped if `block` is set."""
+
+    def __init__(self, block: bool = False):
+        self.block = block
+        self.started = Event()
+        self.stop_requested = Event()
+
+    def request_stop(self):
+        self.stop_requested.set()
+
+    def clear_stop_request(self):
+        self.stop_requested.clear()
+
+    def record(self, outfile=None, *args, **kwargs):
+        self.started.set()
+        if self.block:
+            self.stop_requested.wait(5)
+            raise CancelledError('Recording was stopped before completion.')
+        return outfile
+
+
+def moves(backend, pin, since=0):
+    return [ev.duty_cycle for ev in backend.get_timeline(pin=pin)[since:] if ev.duty_cycle]
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_record():
+    async def main():
+        async with AsyncPlatform(FakeCam()) as p:
+            assert await p.record(outfile='out.mp4') == 'out.mp4'
+            assert await p.start_recording(outfile='next.mp4') == 'next.mp4'
+
+    asyncio.run(main())
+
+
+def test_cancel_running_recording():
+    cam = FakeCam(block=True)
+
+    async def main():
+        async with AsyncPlatform(cam) as p:
+            task = p.start_recording()
+            await wait_for(cam.started.is_set)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert cam.stop_requested.is_set()
+
+    asyncio.run(main())
+
+
+def test_servo_jobs_are_coalesced():
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    n_events = len(backend.get_timeline(pin=7))
+
+    async def main():
+        async with AsyncPlatform(FakeCam(), servos={'s': servo}, servo_coalesce_window=0.2) as p:
+            for _ in range(3):
+                p.submit_servo_sequence('s', [cw])
+            # the coordinated move is held back behind the merged sequences
+            await p.move_servos({'s': 180})
+
+    asyncio.run(main())
+    assert servo.angle == 180
+    assert moves(backend, 7, since=n_events) == [Servo._angle_to_duty_cycle(180)]
+
+
+def test_keyboard_control():
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    n_events = len(backend.get_timeline(pin=7))
+    r, w = os.pipe()
+
+    async def main():
+        async with AsyncPlatform(FakeCam(), servos={'s': servo}, servo_coalesce_window=None) as p:
+            task = asyncio.ensure_future(p.keyboard_control('s', reader=KeyboardReader(fd=r)))
+            os.write(w, b'ddax')
+            await wait_for(lambda: len(moves(backend, 7, since=n_events)) == 3)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        asyncio.run(main())
+    finally:
+        os.close(r)
+        os.close(w)
+    assert servo.angle == 120
+    assert moves(backend, 7, since=n_events) == [
+        Servo._angle_to_duty_cycle(angle) for angle in (120, 150, 120)
+    ]
+
+
+def test_close_stops_cycling_servo():
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    n_events = len(backend.get_timeline(pin=7))
+
+    async def main():
+        async with AsyncPlatform(FakeCam(), servos={'s': servo}) as p:
+            p.submit_servo_sequence('s', [cw, ccw], cycle=True)
+            await wait_for(lambda: len(moves(backend, 7, since=n_events)) >= 4)
+
+    asyncio.run(main())
+    n_moves = len(moves(backend, 7, since=n_events))
+    time.sleep(0.05)
+    assert len(moves(backend, 7, since=n_events)) == n_moves
+
+
+class FakeUploader:
+    def __init__(self, n_failures: int = 0):
+        self.n_failures = n_failures
+        self.uploads = []
+
+    def send_video(self, path):
+        if self.n_failures > 0:
+            self.n_failures -= 1
+            raise RuntimeError('Upload failed.')
+        self.uploads.append(path)
+
+
+def test_upload_is_queued(tmp_path):
+    video = tmp_path / 'timelapse.mp4'
+    video.write_bytes(b'video')
+    uploader = FakeUploader(n_failures=1)
+
+    async def main():
+        with UploadQueue(uploader, journal_dir=tmp_path / 'journal', backoff_base=0.01) as q:
+            async with AsyncPlatform(FakeCam()) as p:
+                await p.start_upload(video, q)
+            assert q.join(timeout=5)
+
+    asyncio.run(main())
+    assert uploader.uploads == [video]
+
+
+def test_close_without_start():
+    async def main():
+        p = AsyncPlatform(FakeCam())
+        await p.close()
+        async with p:
+            pass
+        await p.close()
+
+    asyncio.run(main())
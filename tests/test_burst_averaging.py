@@ -0,0 +1,48 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from rpicam.utils.burst_averaging import accumulate_frame, average_frames
+
+
+def average(buffer, frames):
+    for i, frame in enumerate(frames):
+        buffer = accumulate_frame(buffer, frame, first=i == 0)
+    return buffer, average_frames(buffer, len(frames))
+
+
+def test_average_is_rounded():
+    frames = [np.full((2, 3, 3), v, dtype=np.uint8) for v in (10, 11, 11, 255)]
+    # (10 + 11 + 11 + 255) / 4 = 71.75
+    _, avg = average(None, frames)
+    assert avg.dtype == np.uint8
+    assert avg.shape == (2, 3, 3)
+    assert (avg == 72).all()
+    _, avg = average(None, frames[:2])
+    assert (avg == 11).all()
+
+
+def test_no_overflow():
+    frames = [np.full((2, 2, 3), 255, dtype=np.uint8)] * 8
+    _, avg = average(None, frames)
+    assert (avg == 255).all()
+
+
+def test_buffer_is_reused():
+    frames = [np.full((2, 3, 3), v, dtype=np.uint8) for v in (1, 3)]
+    buffer, avg = average(None, frames)
+    assert (avg == 2).all()
+    # the first frame of the next burst overwrites the previous sum
+    reused, avg = average(buffer, [np.full((2, 3, 3), 9, dtype=np.uint8)])
+    assert reused is buffer
+    assert (avg == 9).all()
+
+
+def test_buffer_is_reallocated_on_shape_change():
+    buffer, _ = average(None, [np.zeros((2, 3, 3), dtype=np.uint8)])
+    frames = [np.full((4, 2, 3), v, dtype=np.uint8) for v in (4, 6)]
+    resized, avg = average(buffer, frames)
+    assert resized is not buffer
+    assert resized.dtype == np.float32
+    assert avg.shape == (4, 2, 3)
+    assert (avg == 5).all()
@@ -0,0 +1,144 @@
+from threading import Event
+import os
+import time
+
+from rpicam.cams.callbacks import Callback, ExecPoint
+from rpicam.utils.callback_handler import CallbackHandler
+from rpicam.utils.profiling import PhaseProfiler
+
+
+class Recorder(Callback):
+    def __init__(self, exec_at, calls, name, delay=0.0, exc=None, **kwargs):
+        super().__init__(exec_at=exec_at, **kwargs)
+        self.calls = calls
+        self.name = name
+        self.delay = delay
+        self.exc = exc
+
+    def __call__(self, *args, **kwargs):
+        time.sleep(self.delay)
+        self.calls.append((self.name, kwargs))
+        if self.exc is not None:
+            raise self.exc
+
+
+class Catcher(Callback):
+    def __init__(self):
+        super().__init__(exec_at=ExecPoint.ON_EXCEPTION)
+        self.excs = []
+        self.caught = Event()
+
+    def __call__(self, exc, *args, **kwargs):
+        self.excs.append(exc)
+        self.caught.set()
+
+
+def test_offloaded_callbacks_do_not_block_and_keep_order():
+    calls = []
+    slow = Recorder(ExecPoint.AFTER_FRAME_CAPTURE, calls, 'slow', delay=0.05, offload=True)
+    cbh = CallbackHandler([slow])
+    t0 = time.monotonic()
+    for i in range(5):
+        cbh.execute_callbacks(ExecPoint.AFTER_FRAME_CAPTURE, frame_idx=i)
+    assert time.monotonic() - t0 < 0.05
+    cbh.shutdown(wait=True)
+    assert [kwargs['frame_idx'] for _, kwargs in calls] == list(range(5))
+
+
+def test_offloaded_exceptions_are_routed_to_on_exception():
+    calls = []
+    catcher = Catcher()
+    failing = Recorder(
+        ExecPoint.AFTER_FRAME_CAPTURE, calls, 'failing', exc=ValueError('boom'), offload=True
+    )
+    cbh = CallbackHandler([failing, catcher])
+    cbh.execute_callbacks(ExecPoint.AFTER_FRAME_CAPTURE)
+    cbh.shutdown(wait=True)
+    assert len(catcher.excs) == 1
+    assert isinstance(catcher.excs[0], ValueError)
+
+
+def test_offloaded_timeout():
+    calls = []
+    catcher = Catcher()
+    hanging = Recorder(
+        ExecPoint.BEFORE_FRAME_CAPTURE, calls, 'hanging', delay=1, offload=True, offload_timeout=0.05
+    )
+    cbh = CallbackHandler([hanging, catcher])
+    cbh.execute_callbacks(ExecPoint.BEFORE_FRAME_CAPTURE)
+    assert catcher.caught.wait(0.5)
+    assert isinstance(catcher.excs[0], TimeoutError)
+    cbh.shutdown(wait=False)
+
+
+class Hanging(Callback):
+    def __init__(self, release, **kwargs):
+        super().__init__(exec_at=ExecPoint.AFTER_FRAME_CAPTURE, priority=1, offload=True, **kwargs)
+        self.release = release
+        self.n_calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.n_calls += 1
+        if self.n_calls == 1:
+            self.release.wait(5)
+
+
+def test_calls_behind_a_timed_out_callback_still_run():
+    calls = []
+    release = Event()
+    catcher = Catcher()
+    hanging = Hanging(release, offload_timeout=0.05)
+    later = Recorder(ExecPoint.AFTER_FRAME_CAPTURE, calls, 'later', offload=True)
+    cbh = CallbackHandler([hanging, later, catcher])
+    try:
+        for i in range(3):
+            cbh.execute_callbacks(ExecPoint.AFTER_FRAME_CAPTURE, frame_idx=i)
+        deadline = time.monotonic() + 1
+        while len(calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [kwargs['frame_idx'] for _, kwargs in calls] == [0, 1, 2]
+        assert hanging.n_calls == 3
+        assert [type(e) for e in catcher.excs] == [TimeoutError]
+        assert cbh._pending[ExecPoint.AFTER_FRAME_CAPTURE] == 0
+    finally:
+        release.set()
+    cbh.shutdown(wait=True)
+    assert cbh._pending[ExecPoint.AFTER_FRAME_CAPTURE] == 0
+
+
+def test_inline_callbacks_run_immediately():
+    calls = []
+    cbh = CallbackHandler([Recorder(ExecPoint.AFTER_INIT, calls, 'inline')])
+    cbh.execute_callbacks(ExecPoint.AFTER_INIT)
+    assert calls == [('inline', {})]
+
+
+def test_timing_stats():
+    calls = []
+    cbh = CallbackHandler([Recorder(ExecPoint.BEFORE_FRAME_CAPTURE, calls, 'annotate', delay=0.01)])
+    for _ in range(3):
+        cbh.execute_callbacks(ExecPoint.BEFORE_FRAME_CAPTURE)
+        time.sleep(0.02)
+        cbh.execute_callbacks(ExecPoint.AFTER_FRAME_CAPTURE)
+    stats = cbh.get_timing_stats()
+    frame = stats['phases']['frame_capture']
+    assert frame['count'] == 3
+    assert frame['p50_ms'] >= 20
+    cb = stats['callbacks']['BEFORE_FRAME_CAPTURE/Recorder']
+    assert cb['count'] == 3
+    assert cb['max_ms'] >= 10
+
+
+def test_phase_profiler(tmp_path):
+    profiler = PhaseProfiler('frame_capture', out_dir=tmp_path)
+    cbh = CallbackHandler(profiler=profiler)
+    cbh.execute_callbacks(ExecPoint.BEFORE_FRAME_CAPTURE)
+    sorted(range(1000))
+    cbh.execute_callbacks(ExecPoint.AFTER_FRAME_CAPTURE)
+    assert 'sorted' in profiler.summary()
+    out = profiler.dump()
+    assert out.is_file()
+    assert str(os.getpid()) in out.name
+    tagged = profiler.dump(tag='timelapse_pos_1')
+    assert tagged.is_file() and tagged != out
+    assert tagged.name.endswith('-timelapse_pos_1.prof')
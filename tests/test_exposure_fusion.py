@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Thread
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from rpicam.cams import timelapse_cam
+from rpicam.cams.timelapse_cam import TimelapseCam
+from rpicam.utils import exposure_fusion
+from rpicam.utils.exposure_fusion import ExposureFuser, fuse_exposures
+
+
+def make_bracket(shape=(32, 48, 3)):
+    return [np.full(shape, v, dtype=np.uint8) for v in (20, 120, 230)]
+
+
+class ThreadedExposureFuser(ExposureFuser):
+    """Fuses in threads, so that the fusion function can be monkeypatched."""
+
+    def _make_pool(self):
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+
+@pytest.fixture
+def fake_fusion(monkeypatch):
+    """Fuse by writing the path into the file, failing for file names containing 'fail'."""
+
+    def fuse_exposures_to_file(frames, path):
+        if 'fail' in Path(path).name:
+            raise RuntimeError('Fusion failed.')
+        with open(path, 'w') as f:
+            f.write(path)
+        return path
+
+    monkeypatch.setattr(exposure_fusion, 'fuse_exposures_to_file', fuse_exposures_to_file)
+
+
+def test_fuse_exposures():
+    pytest.importorskip('cv2')
+    fused = fuse_exposures(make_bracket())
+    assert fused.shape == (32, 48, 3)
+    assert fused.dtype == np.uint8
+
+
+def test_fuser_writes_all_frames(tmp_path):
+    pytest.importorskip('cv2')
+    fuser = ExposureFuser(workers=2, max_pending=1)
+    paths = [tmp_path / f'{i}.png' for i in range(4)]
+    for p in paths:
+        fuser.submit(make_bracket(), p)
+    fuser.join()
+    fuser.close()
+    assert all(p.is_file() for p in paths)
+
+
+def test_submit_blocks_while_max_pending(monkeypatch, tmp_path):
+    release = Event()
+    started = []
+
+    def fuse_exposures_to_file(frames, path):
+        started.append(path)
+        release.wait(5)
+        return path
+
+    monkeypatch.setattr(exposure_fusion, 'fuse_exposures_to_file', fuse_exposures_to_file)
+    fuser = ThreadedExposureFuser(workers=1, max_pending=2)
+    fuser.submit(make_bracket(), tmp_path / '0.png')
+    fuser.submit(make_bracket(), tmp_path / '1.png')
+    third = Thread(target=fuser.submit, args=(make_bracket(), tmp_path / '2.png'))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+    release.set()
+    third.join(5)
+    assert not third.is_alive()
+    fuser.join()
+    fuser.close()
+    assert started == [str(tmp_path / f'{i}.png') for i in range(3)]
+
+
+def test_on_done_reports_failures(fake_fusion, tmp_path):
+    done = []
+    fuser = ThreadedExposureFuser(workers=2, on_done=lambda path, exc: done.append((path, exc)))
+    fuser.submit(make_bracket(), tmp_path / 'ok.png')
+    fuser.submit(make_bracket(), tmp_path / 'fail.png')
+    fuser.join()
+    fuser.close()
+    results = {path.name: exc for path, exc in done}
+    assert results['ok.png'] is None
+    assert isinstance(results['fail.png'], RuntimeError)
+
+
+@pytest.fixture
+def make_bracket_cam(monkeypatch, tmp_path, fake_picamera2, fake_fusion):
+    monkeypatch.setattr(timelapse_cam, 'ExposureFuser', ThreadedExposureFuser)
+    cams = []
+
+    def make(**kwargs):
+        cam = TimelapseCam(tmpdir=tmp_path, bracket=(-1, 0, 1), resolution=(4, 2), **kwargs)
+        cams.append(cam)
+        return cam
+
+    yield make
+    for cam in cams:
+        cam.close()
+
+
+def capture(cam, stack_dir, name):
+    cam._capture_bracket(stack_dir / name)
+    cam._fuser.join()
+
+
+def test_failed_fusion_is_healed(make_bracket_cam, tmp_path):
+    cam = make_bracket_cam(capture_failover_strategy='heal')
+    capture(cam, tmp_path, '0.png')
+    capture(cam, tmp_path, '1_fail.png')
+    assert (tmp_path / '1_fail.png').read_text() == str(tmp_path / '0.png')
+
+
+def test_failed_fusion_is_raised(make_bracket_cam, tmp_path):
+    cam = make_bracket_cam(capture_failover_strategy='raise')
+    capture(cam, tmp_path, '0_fail.png')
+    with pytest.raises(RuntimeError, match='Could not fuse frame'):
+        cam._capture_frame(tmp_path, frame_idx=1)
+    # raised once only
+    cam._capture_frame(tmp_path, frame_idx=2)
+    capture(cam, tmp_path, '3_fail.png')
+    with pytest.raises(RuntimeError, match='Could not fuse frame'):
+        cam._start_encoders(tmp_path, fps=24, outfile=tmp_path / 'out.mp4')
+
+
+def test_failed_fusion_is_skipped(make_bracket_cam, tmp_path):
+    cam = make_bracket_cam()
+    capture(cam, tmp_path, '0.png')
+    capture(cam, tmp_path, '1_fail.png')
+    cam._capture_frame(tmp_path, frame_idx=2)
+    assert not (tmp_path / '1_fail.png').is_file()
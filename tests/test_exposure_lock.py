@@ -0,0 +1,50 @@
+from rpicam.cams.callbacks import ExposureLock
+
+
+class FakeCam:
+    """Reports converging AE/AWB results while enabled, and records set controls."""
+
+    def __init__(self, lux: float = 100.0):
+        self.lux = lux
+        self.controls = {}
+        self.n_metadata = 0
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+
+    def capture_metadata(self):
+        self.n_metadata += 1
+        exposure = 10000 + 5000 / self.n_metadata ** 2
+        return dict(ExposureTime=exposure, AnalogueGain=2.0, ColourGains=(1.5, 1.8), Lux=self.lux)
+
+
+def test_meters_then_locks():
+    cam = FakeCam()
+    lock = ExposureLock(remeter_interval=None, lux_drift=None, settle_frames=50, tolerance=0.01)
+    lock(cam=cam)
+    assert cam.controls['AeEnable'] is False and cam.controls['AwbEnable'] is False
+    assert cam.controls['AnalogueGain'] == 2.0
+    assert cam.controls['ColourGains'] == (1.5, 1.8)
+    assert lock.MIN_SETTLE_FRAMES < cam.n_metadata < 50
+    n_metadata = cam.n_metadata
+    lock(cam=cam)
+    assert cam.n_metadata == n_metadata
+
+
+def test_remeters_on_lux_drift():
+    cam = FakeCam(lux=100.0)
+    lock = ExposureLock(remeter_interval=None, lux_drift=0.5)
+    lock(cam=cam)
+    lock.monitor(metadata=dict(Lux=130.0))
+    assert not lock.needs_metering()
+    lock.monitor(metadata=dict(Lux=300.0))
+    assert lock.needs_metering()
+    cam.lux = 300.0
+    lock(cam=cam)
+    assert not lock.needs_metering()
+
+
+def test_remeters_on_interval():
+    lock = ExposureLock(remeter_interval=0, lux_drift=None)
+    lock(cam=FakeCam())
+    assert lock.needs_metering()
@@ -0,0 +1,25 @@
+from rpicam.utils.frame_stats import FrameStats, FrameTiming, percentile
+
+
+def test_percentile():
+    vals = list(range(1, 101))
+    assert percentile(vals, 50) == 51
+    assert percentile(vals, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_frame_stats():
+    stats = FrameStats(window=10)
+    for i in range(20):
+        t = float(i)
+        stats.record_displayed(
+            FrameTiming(sensor=t, captured=t + 0.01, enqueued=t + 0.02, displayed=t + 0.05)
+        )
+    stats.record_dropped(3)
+    s = stats.get_stats()
+    assert s['frames_displayed'] == 20
+    assert s['frames_dropped'] == 3
+    assert round(s['fps'], 3) == 1.0
+    assert round(s['total_p50_ms']) == 50
+    assert round(s['capture_p99_ms']) == 10
+    assert 'dropped: 3' in stats.format_overlay()
@@ -0,0 +1,54 @@
+"""Guard the startup time of short CLI invocations against heavy eager imports."""
+import subprocess
+import sys
+
+HEAVY_MODULES = ['picamera2', 'libcamera', 'cv2', 'ffmpeg', 'PIL', 'tkinter', 'requests', 'numpy']
+LIGHT_MODULES = [
+    'rpicam.cams',
+    'rpicam.cams.timelapse_cam',
+    'rpicam.cams.panorama_cam',
+    'rpicam.cams.live_preview_cam',
+    'rpicam.gui',
+    'rpicam.platform',
+    'rpicam.servo',
+    'rpicam.utils.rotating_storage',
+    'rpicam.utils.stack_encoder',
+    'rpicam.utils.state',
+]
+# generous, to only catch regressions such as a camera stack being imported again
+IMPORT_BUDGET_US = 1_500_000
+
+
+def _import_times(modules):
+    """
+    Import the given modules in a fresh interpreter, and return the cumulative import time
+    in microseconds of every module, and whether it was imported at top level.
+    """
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        # nested imports are indented by two spaces per level
+        times[name.strip()] = (int(cumulative), not name[1:].startswith(' '))
+    return times
+
+
+def test_no_heavy_imports():
+    times = _import_times(LIGHT_MODULES)
+    imported_heavy = [m for m in times if m.split('.')[0] in HEAVY_MODULES]
+    assert not imported_heavy
+
+
+def test_import_time_budget():
+    times = _import_times(LIGHT_MODULES)
+    total = sum(t for m, (t, top_level) in times.items() if top_level and m.startswith('rpicam'))
+    assert total < IMPORT_BUDGET_US
@@ -0,0 +1,16 @@
+import os
+
+from rpicam.utils.keyboard_input import KeyboardReader
+
+
+def test_keyboard_reader_delivers_every_key():
+    r, w = os.pipe()
+    try:
+        with KeyboardReader(fd=r) as kb:
+            assert kb.read_key(timeout=0) is None
+            os.write(w, b'ddda')
+            assert [kb.read_key(timeout=1) for _ in range(4)] == ['d', 'd', 'd', 'a']
+            assert kb.read_key(timeout=0) is None
+    finally:
+        os.close(r)
+        os.close(w)
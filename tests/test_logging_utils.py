@@ -0,0 +1,62 @@
+import json
+import logging
+
+import pytest
+
+from rpicam.utils.logging_utils import (
+    get_logger,
+    configure_logging,
+    shutdown_logging,
+    RateLimitFilter,
+)
+
+
+@pytest.fixture
+def reset_logging():
+    yield
+    configure_logging()
+
+
+def test_rate_limit_filter():
+    f = RateLimitFilter(interval=60)
+    records = [
+        logging.LogRecord('x', logging.WARNING, 'file.py', 10, f'overtime {i}', None, None)
+        for i in range(3)
+    ]
+    assert [f.filter(r) for r in records] == [True, False, False]
+    other_line = logging.LogRecord('x', logging.WARNING, 'file.py', 11, 'other', None, None)
+    assert f.filter(other_line)
+    f.interval = 0
+    again = logging.LogRecord('x', logging.WARNING, 'file.py', 10, 'overtime 3', None, None)
+    assert f.filter(again)
+    assert again.getMessage() == 'overtime 3 (suppressed 2 similar messages)'
+
+
+def test_queued_json_logging(capsys, reset_logging):
+    configure_logging(queued=True, json_format=True, rate_limit=60)
+    logger = get_logger('test-queued', verb=True)
+    for i in range(5):
+        logger.info(f'frame {i}')
+    shutdown_logging()
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record['name'] == 'test-queued'
+    assert record['level'] == 'INFO'
+    assert record['message'] == 'frame 0'
+
+
+def test_queued_json_exception(capsys, reset_logging):
+    configure_logging(queued=True, json_format=True)
+    logger = get_logger('test-queued-exc', verb=True)
+    try:
+        raise RuntimeError('capture failed')
+    except RuntimeError:
+        logger.exception('frame %d', 3)
+    shutdown_logging()
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record['message'] == 'frame 3'
+    assert record['exc_info'].startswith('Traceback')
+    assert 'RuntimeError: capture failed' in record['exc_info']
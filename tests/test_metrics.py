@@ -0,0 +1,53 @@
+from urllib.request import urlopen
+
+from rpicam.utils.metrics import (
+    MetricsRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsServer,
+    write_textfile,
+)
+
+
+def _registry():
+    registry = MetricsRegistry()
+    c = Counter('test_frames_total', 'Frames.', registry=registry)
+    g = Gauge('test_fill_percent', 'Fill.', registry=registry)
+    h = Histogram('test_capture_seconds', 'Capture.', buckets=(0.1, 1), registry=registry)
+    c.inc()
+    c.inc(2)
+    g.set(42.5)
+    for v in (0.05, 0.5, 0.7, 3):
+        h.observe(v)
+    return registry
+
+
+def test_render():
+    text = _registry().render()
+    assert '# TYPE test_frames_total counter\ntest_frames_total 3\n' in text
+    assert 'test_fill_percent 42.5\n' in text
+    assert 'test_capture_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'test_capture_seconds_bucket{le="1"} 3\n' in text
+    assert 'test_capture_seconds_bucket{le="+Inf"} 4\n' in text
+    assert 'test_capture_seconds_sum 4.25\n' in text
+    assert 'test_capture_seconds_count 4\n' in text
+
+
+def test_textfile(tmp_path):
+    path = tmp_path / 'rpicam.prom'
+    registry = _registry()
+    write_textfile(path, registry)
+    assert path.read_text() == registry.render()
+    assert [p.name for p in tmp_path.iterdir()] == ['rpicam.prom']
+
+
+def test_http_server():
+    registry = _registry()
+    server = MetricsServer(0, registry=registry)
+    server.start()
+    try:
+        with urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=5) as r:
+            assert r.read().decode() == registry.render()
+    finally:
+        server.stop()
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from rpicam.cams import panorama_cam
+from rpicam.cams.panorama_cam import PanoramaTimelapseCam
+
+
+class FakeServo:
+    def __init__(self):
+        self.angles = []
+
+    def move_to(self, angle):
+        self.angles.append(angle)
+
+
+class FakeEncoder:
+    def __init__(self, stack_dir, outfile, **kwargs):
+        self.stack_dir = stack_dir
+        self.outfile = outfile
+
+    def start(self):
+        pass
+
+    def join(self):
+        pass
+
+
+@pytest.fixture
+def make_cam(monkeypatch, tmp_path, fake_picamera2):
+    encoders = []
+
+    def make_encoder(**kwargs):
+        encoders.append(FakeEncoder(**kwargs))
+        return encoders[-1]
+
+    monkeypatch.setattr(panorama_cam, 'StackEncoder', make_encoder)
+    cams = []
+
+    def make(**kwargs):
+        cam = PanoramaTimelapseCam(FakeServo(), tmpdir=tmp_path, **kwargs)
+        cam.encoders = encoders
+        cams.append(cam)
+        return cam
+
+    yield make
+    for cam in cams:
+        cam.close()
+
+
+def test_sweep_direction_alternates(make_cam, tmp_path):
+    cam = make_cam(angles=[0, 90, 180])
+    for frame_idx in range(3):
+        cam._capture_frame(tmp_path, frame_idx=frame_idx)
+    assert cam.servo.angles == [0, 90, 180, 180, 90, 0, 0, 90, 180]
+
+
+def test_frames_are_stacked_per_position(make_cam, tmp_path):
+    cam = make_cam(angles=[30, 150])
+    for frame_idx in range(3):
+        cam._capture_frame(tmp_path, frame_idx=frame_idx)
+    pos_dirs = cam._position_dirs(tmp_path)
+    assert pos_dirs == [tmp_path / 'pos_0', tmp_path / 'pos_1']
+    for pos_dir in pos_dirs:
+        assert len(list(pos_dir.glob('*.png'))) == 3
+
+
+def test_position_outfile(make_cam, tmp_path):
+    cam = make_cam(angles=[30, 150])
+    assert cam._position_outfile(Path('videos/out.mp4'), tmp_path, 1) == Path('videos/out_pos_1.mp4')
+    assert cam._position_outfile(None, tmp_path, 1) == tmp_path / 'pos_1' / 'out.mp4'
+
+
+def test_record_one_video_per_position(make_cam, tmp_path):
+    cam = make_cam(angles=[30, 90, 150])
+    outfile = tmp_path / 'out.mp4'
+    res = cam.record(outfile, sec_per_frame=0.02, duration=timedelta(seconds=0.05))
+    assert res == [tmp_path / f'out_pos_{i}.mp4' for i in range(3)]
+    assert [e.outfile for e in cam.encoders] == res
+    assert [e.stack_dir.name for e in cam.encoders] == ['pos_0', 'pos_1', 'pos_2']
+
+
+def test_record_stitched(make_cam, tmp_path):
+    cam = make_cam(angles=[30, 150], stitch=True)
+    outfile = tmp_path / 'out.mp4'
+    assert cam.record(outfile, sec_per_frame=0.02, duration=timedelta(seconds=0.05)) == outfile
+    (encoder,) = cam.encoders
+    assert [d.name for d in encoder.stack_dir] == ['pos_0', 'pos_1']
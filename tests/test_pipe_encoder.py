@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from rpicam.utils import metrics
+
+
+def make_frames(n, size=(4, 2)):
+    width, height = size
+    return [np.full((height, width, 3), i, dtype=np.uint8) for i in range(n)]
+
+
+def test_frames_are_piped_in_order(stub_pipe_encoder, tmp_path):
+    outfile = tmp_path / 'out.mp4'
+    encoder = stub_pipe_encoder(callbacks=[], size=(4, 2), fps=24, outfile=outfile, max_queued=2)
+    encoder.start()
+    frames = make_frames(5)
+    for frame in frames:
+        encoder.write(frame)
+    encoder.close()
+    encoder.join(timeout=5)
+    assert encoder.process.stdin.closed
+    assert encoder.process.stdin.frames == [f.tobytes() for f in frames]
+    assert outfile.read_bytes() == b''.join(f.tobytes() for f in frames)
+
+
+def test_non_contiguous_frames_are_piped(stub_pipe_encoder, tmp_path):
+    encoder = stub_pipe_encoder(callbacks=[], size=(2, 2), fps=24, outfile=tmp_path / 'out.mp4')
+    encoder.start()
+    frame = np.arange(4 * 2 * 3, dtype=np.uint8).reshape(2, 4, 3)[:, ::2]
+    encoder.write(frame)
+    encoder.close()
+    encoder.join(timeout=5)
+    assert encoder.process.stdin.frames == [np.ascontiguousarray(frame).tobytes()]
+
+
+def test_ffmpeg_failure_is_counted(stub_pipe_encoder, tmp_path):
+    failures = metrics.ENCODE_FAILURES.value
+    encoder = stub_pipe_encoder(
+        callbacks=[], size=(4, 2), fps=24, outfile=tmp_path / 'out.mp4', returncode=1
+    )
+    encoder.start()
+    encoder.write(make_frames(1)[0])
+    encoder.close()
+    encoder.join(timeout=5)
+    assert metrics.ENCODE_FAILURES.value == failures + 1
+
+
+def test_abort_removes_partial_video(stub_pipe_encoder, tmp_path):
+    outfile = tmp_path / 'out.mp4'
+    encoder = stub_pipe_encoder(callbacks=[], size=(4, 2), fps=24, outfile=outfile)
+    encoder.start()
+    encoder.write(make_frames(1)[0])
+    outfile.write_bytes(b'partial')
+    encoder.abort()
+    assert encoder.process.killed.is_set()
+    assert encoder.process.stdin.closed
+    assert not outfile.is_file()
@@ -0,0 +1,187 @@
+from concurrent.futures import CancelledError
+from threading import Event
+
+import pytest
+
+from rpicam.platform import Platform
+from rpicam.servo import Servo, ServoOp, SimulatedGPIOBackend, cw, ccw, pause
+
+
+class FakeCam:
+    """
+    Reports `n_frames` frames to its callbacks and returns its outfile. If `block` is set,
+    waits for `proceed` after starting, then stops if requested, like a Cam.
+    """
+
+    def __init__(self, n_frames: int = 0, block: bool = False):
+        self.n_frames = n_frames
+        self.block = block
+        self.callbacks = []
+        self.started = Event()
+        self.proceed = Event()
+        self._stop_requested = Event()
+
+    def add_callback(self, cb):
+        self.callbacks.append(cb)
+
+    def remove_callback(self, cb):
+        self.callbacks.remove(cb)
+
+    def request_stop(self):
+        self._stop_requested.set()
+
+    def clear_stop_request(self):
+        self._stop_requested.clear()
+
+    def record(self, outfile=None, *args, **kwargs):
+        self.started.set()
+        if self.block:
+            self.proceed.wait(5)
+        for i in range(self.n_frames):
+            for cb in list(self.callbacks):
+                cb(frame_idx=i, t_end=None)
+        if self._stop_requested.is_set():
+            self._stop_requested.clear()
+            raise CancelledError('Recording was stopped before completion.')
+        return outfile
+
+
+@pytest.fixture
+def make_platform():
+    platforms = []
+
+    def make(cam=None, **kwargs):
+        p = Platform(cam=cam if cam is not None else FakeCam(), **kwargs)
+        platforms.append(p)
+        return p
+
+    yield make
+    for p in platforms:
+        p.close()
+
+
+def moves(backend, pin, since=0):
+    """Get the duty cycles set after the given timeline index, without stops."""
+    return [ev.duty_cycle for ev in backend.get_timeline(pin=pin)[since:] if ev.duty_cycle]
+
+
+def test_queued_moves_are_coalesced(make_platform):
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    p = make_platform(servos={'s': servo}, servo_coalesce_window=0.2)
+    n_events = len(backend.get_timeline(pin=7))
+    for _ in range(3):
+        p.submit_servo_sequence('s', [cw])
+    p._servo_in_qs['s'].join()
+    assert servo.angle == 180
+    assert moves(backend, 7, since=n_events) == [Servo._angle_to_duty_cycle(180)]
+
+
+def test_non_move_jobs_are_held_back_in_order(make_platform):
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    p = make_platform(servos={'s': servo}, servo_coalesce_window=0.2)
+    n_events = len(backend.get_timeline(pin=7))
+    for sequence in ([cw], [cw], [pause], [ccw]):
+        p.submit_servo_sequence('s', sequence)
+    p._servo_in_qs['s'].join()
+    assert servo.angle == 120
+    assert moves(backend, 7, since=n_events) == [
+        Servo._angle_to_duty_cycle(150),
+        Servo._angle_to_duty_cycle(120),
+    ]
+    stops = [ev.t for ev in backend.get_timeline(pin=7)[n_events:] if ev.duty_cycle == 0]
+    starts = [ev.t for ev in backend.get_timeline(pin=7)[n_events:] if ev.duty_cycle]
+    assert round(starts[1] - stops[0], 6) == pause.sleep
+
+
+def test_no_coalescing_without_window(make_platform):
+    backend = SimulatedGPIOBackend()
+    servo = Servo(7, backend=backend, init_angle=90)
+    p = make_platform(servos={'s': servo}, servo_coalesce_window=None)
+    n_events = len(backend.get_timeline(pin=7))
+    p.submit_servo_sequence('s', [ServoOp(20, 'CW')])
+    p.submit_servo_sequence('s', [ServoOp(20, 'CW')])
+    p._servo_in_qs['s'].join()
+    assert moves(backend, 7, since=n_events) == [
+        Servo._angle_to_duty_cycle(110),
+        Servo._angle_to_duty_cycle(130),
+    ]
+
+
+def test_coordinated_move_arrives_together(make_platform):
+    backend = SimulatedGPIOBackend()
+    a = Servo(7, backend=backend)
+    b = Servo(11, backend=backend)
+    p = make_platform(servos={'a': a, 'b': b})
+    t0 = backend.time()
+    # let axis b start late, the move must still start and end together
+    p.submit_servo_sequence('b', [ServoOp(sleep=0.5)])
+    move = p.move_servos({'a': 180, 'b': 60}, wait=True)
+    assert (a.angle, b.angle) == (180, 60)
+    assert round(move.duration, 6) == 0.6
+    end_a = backend.get_timeline(pin=7)[-1].t
+    end_b = backend.get_timeline(pin=11)[-1].t
+    assert round(end_a, 6) == round(end_b, 6) == round(t0 + 0.5 + 0.6 + 0.1, 6)
+
+
+def test_coordinated_move_refused_while_cycling(make_platform):
+    from threading import Event
+
+    backend = SimulatedGPIOBackend()
+    a = Servo(7, backend=backend)
+    b = Servo(11, backend=backend)
+    release = Event()
+    a.execute_sequence = lambda *args, **kwargs: release.wait()
+    p = make_platform(servos={'a': a, 'b': b})
+    p.submit_servo_sequence('a', [cw], cycle=True)
+    try:
+        with pytest.raises(RuntimeError):
+            p.move_servos({'a': 90, 'b': 90})
+        p.move_servos({'b': 90})
+        assert b.angle == 90
+    finally:
+        release.set()
+
+
+def test_recording_futures(make_platform):
+    p = make_platform()
+    futs = [p.start_recording(keep_alive=True, outfile=f'{i}.mp4') for i in range(3)]
+    assert [f.result(timeout=5) for f in futs] == ['0.mp4', '1.mp4', '2.mp4']
+    assert [p.poll_cam_result() for _ in range(3)] == ['0.mp4', '1.mp4', '2.mp4']
+
+
+def test_progress_callback(make_platform):
+    cam = FakeCam(n_frames=3)
+    p = make_platform(cam=cam)
+    progress = []
+    p.start_recording(progress_callback=progress.append).result(timeout=5)
+    assert [pr.frames_captured for pr in progress] == [1, 2, 3]
+    assert not len(cam.callbacks)
+
+
+def test_cancel_pending_and_stop_running_recordings(make_platform):
+    cam = FakeCam(block=True)
+    p = make_platform(cam=cam)
+    running = p.start_recording(keep_alive=True, outfile='running.mp4')
+    pending = p.start_recording(keep_alive=True, outfile='pending.mp4')
+    assert cam.started.wait(5)
+    assert pending.cancel()
+    assert pending.cancelled()
+    # a running recording cannot be cancelled, like any Future, only stopped
+    assert not running.cancel()
+    assert not running.cancelled()
+    # the stop lands before record checks for stop requests, and must not be lost
+    assert running.stop()
+    cam.proceed.set()
+    with pytest.raises(CancelledError):
+        running.result(timeout=5)
+    assert not running.cancelled()
+    assert not running.stop()
+
+
+def test_stop_request_before_start_is_withdrawn(make_platform):
+    cam = FakeCam()
+    cam.request_stop()
+    p = make_platform(cam=cam)
+    assert p.start_recording(outfile='out.mp4').result(timeout=5) == 'out.mp4'
@@ -0,0 +1,20 @@
+import pytest
+
+from rpicam.utils.roi import fit_size, roi_to_scaler_crop
+
+
+def test_roi_to_scaler_crop():
+    assert roi_to_scaler_crop((0, 0, 1, 1), (16, 8, 4000, 3000)) == (16, 8, 4000, 3000)
+    assert roi_to_scaler_crop((0.25, 0.5, 0.5, 0.5), (0, 0, 4000, 3000)) == (1000, 1500, 2000, 1500)
+
+
+@pytest.mark.parametrize('roi', [(0.5, 0, 0.6, 1), (0, 0, 0, 1), (-0.1, 0, 0.5, 0.5)])
+def test_invalid_roi(roi):
+    with pytest.raises(RuntimeError):
+        roi_to_scaler_crop(roi, (0, 0, 4000, 3000))
+
+
+def test_fit_size():
+    assert fit_size((1024, 768), aspect=1.0) == (768, 768)
+    assert fit_size((1024, 768), aspect=4.0) == (1024, 256)
+    assert fit_size((1001, 1001), aspect=1.0) == (1000, 1000)
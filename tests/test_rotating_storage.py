@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import time
+
+import pytest
+
+from rpicam.utils.rotating_storage import RotatingStorage
+from rpicam.utils.tiered_retention import TieredRetention, RetentionTier
+
+
+def _make_file(d: Path, unixtime: float, size: int) -> Path:
+    p = d / f'file_{str(unixtime).replace(".", "_")}.mp4'
+    p.write_bytes(b'\0' * size)
+    return p
+
+
+def test_index_built_once_in_creation_order(tmp_path):
+    now = datetime.now().timestamp()
+    files = [_make_file(tmp_path, now - 100 + i, 100) for i in range(5)]
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_bytes=350)
+    # 500 managed bytes plus an expected 100 for the next file: free 250 in one pass
+    next(rs)
+    assert [p.is_file() for p in files] == [False, False, False, True, True]
+
+
+def test_issued_files_are_indexed(tmp_path):
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_bytes=250)
+    first = Path(next(rs))
+    first.write_bytes(b'\0' * 100)
+    second = Path(next(rs))
+    second.write_bytes(b'\0' * 100)
+    assert first.is_file()
+    next(rs)
+    assert not first.is_file()
+    assert second.is_file()
+
+
+def test_files_written_per_issued_name_are_indexed(tmp_path):
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_bytes=400)
+    first = Path(next(rs))
+    # e.g. a panorama without stitching writes one video per position
+    parts = [first.with_name(f'{first.stem}_pos_{i}{first.suffix}') for i in range(3)]
+    for p in parts:
+        p.write_bytes(b'\0' * 100)
+    next(rs)
+    assert first not in rs._issued
+    assert rs._managed_bytes == 300
+    rs._max_bytes = 350
+    next(rs)
+    assert not parts[0].is_file()
+    assert parts[1].is_file() and parts[2].is_file()
+
+
+def test_max_age(tmp_path):
+    now = datetime.now().timestamp()
+    old = _make_file(tmp_path, now - 3 * 86400, 10)
+    new = _make_file(tmp_path, now - 60, 10)
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_age=timedelta(days=1))
+    next(rs)
+    assert not old.is_file()
+    assert new.is_file()
+
+
+def test_unmanaged_files_are_kept(tmp_path):
+    other = tmp_path / 'notes.txt'
+    other.write_text('keep')
+    _make_file(tmp_path, datetime.now().timestamp(), 100)
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_bytes=150)
+    next(rs)
+    assert other.is_file()
+    assert not len(list(tmp_path.glob('file_*.mp4')))
+
+
+class CopyingRetention(TieredRetention):
+    """Re-encodes by truncating the file to half its size, without ffmpeg."""
+
+    def _transcode(self, src, dst, tier):
+        dst.write_bytes(src.read_bytes()[: src.stat().st_size // 2])
+
+
+def _wait_for_retention(retention):
+    while retention._finished.qsize() < len(retention._pending):
+        time.sleep(0.01)
+
+
+def test_retention_tier_names():
+    p = Path('/x/file_1_2.mp4')
+    assert TieredRetention.get_tier(p) == 0
+    t2 = TieredRetention.get_tier_path(p, 2)
+    assert t2 == Path('/x/file_1_2.t2.mp4')
+    assert TieredRetention.get_tier(t2) == 2
+    assert TieredRetention.get_tier_path(t2, 3) == Path('/x/file_1_2.t3.mp4')
+
+
+def test_retention_tier_parse():
+    tier = RetentionTier.parse('7:scale=0.5,decimate=2')
+    assert tier == RetentionTier(min_age=timedelta(days=7), scale=0.5, decimate=2)
+    assert RetentionTier.parse('1') == RetentionTier(min_age=timedelta(days=1))
+
+
+@pytest.mark.parametrize('s', ['7:size=2', '7:fps=ten', 'week'])
+def test_invalid_retention_tier(s):
+    with pytest.raises(RuntimeError):
+        RetentionTier.parse(s)
+
+
+def test_retention_downsamples_then_deletes_final_tier_first(tmp_path):
+    now = datetime.now().timestamp()
+    oldest = _make_file(tmp_path, now - 10 * 86400, 100)
+    old = _make_file(tmp_path, now - 3 * 86400, 100)
+    new = _make_file(tmp_path, now - 60, 100)
+    retention = CopyingRetention(
+        [RetentionTier(min_age=timedelta(days=1)), RetentionTier(min_age=timedelta(days=7))]
+    )
+    rs = RotatingStorage(tmp_path, rotate_fill_perc=None, max_bytes=1000, retention=retention)
+    next(rs)
+    _wait_for_retention(retention)
+    next(rs)
+    assert TieredRetention.get_tier_path(oldest, 2).is_file()
+    assert TieredRetention.get_tier_path(old, 1).is_file()
+    assert not oldest.is_file() and not old.is_file()
+    assert rs._managed_bytes == 50 + 50 + 100
+
+    # over budget: the final tier file goes first, even though the tier 1 file is not much newer
+    rs._max_bytes = 250
+    next(rs)
+    assert not TieredRetention.get_tier_path(oldest, 2).is_file()
+    assert TieredRetention.get_tier_path(old, 1).is_file()
+    assert new.is_file()
+    retention.close()
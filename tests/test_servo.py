@@ -1,10 +1,11 @@
 import pytest
 
-from rpicam.servo import Servo, full_ccw, full_cw, noon, pause
+from rpicam.servo import Servo, ServoOp, SimulatedGPIOBackend, full_ccw, full_cw, noon, pause
 
 
 def test_execute_sequence():
-    s = Servo(7, verbose=True)
+    backend = SimulatedGPIOBackend()
+    s = Servo(7, verbose=True, backend=backend)
     s.execute_sequence(
         [
             full_cw,
@@ -16,3 +17,86 @@ def test_execute_sequence():
             pause,
         ]
     )
+    assert s.angle == 90
+    duty_cycles = [ev.duty_cycle for ev in backend.get_timeline(pin=7) if ev.duty_cycle]
+    assert duty_cycles[-1] == Servo._angle_to_duty_cycle(90)
+    # 1.5 sec init, 3 sec pauses, moves of 180°, 90°, 90° and 90° at 300°/sec + 0.1 sec settling
+    assert round(backend.time(), 6) == round(1.5 + 3 + 450 / 300 + 4 * 0.1, 6)
+
+
+def test_distance_aware_settle_time():
+    backend = SimulatedGPIOBackend()
+    s = Servo(7, backend=backend, init_angle=90)
+    t0 = backend.time()
+    s.execute_sequence([ServoOp(5, 'CW')])
+    assert s.angle == 95
+    assert round(backend.time() - t0, 6) == round(5 / 300 + 0.1, 6)
+
+
+def test_resolve_target_angle():
+    s = Servo(7, backend=SimulatedGPIOBackend(), init_angle=90, on_invalid_angle='ignore')
+    seq = [ServoOp(30, 'CW'), ServoOp(30, 'CW'), ServoOp(30, 'CW'), ServoOp(30, 'CCW')]
+    assert s.resolve_target_angle(seq) == 150
+    assert s.angle == 90
+
+
+def test_motion_planner_scales_with_distance():
+    from rpicam.servo import MotionPlanner
+
+    mp = MotionPlanner(speed=300, min_settle=0.1)
+    short = sum(d for _, d in mp.plan(90, 95))
+    full = sum(d for _, d in mp.plan(0, 180))
+    assert short < full
+    assert round(full, 6) == 0.7
+    assert mp.plan(0, 180) == [(180, full)]
+
+
+def test_motion_planner_eased_trajectory():
+    from rpicam.servo import MotionPlanner
+
+    mp = MotionPlanner(speed=300, min_settle=0.1, easing='cosine', step_interval=0.02)
+    steps = mp.plan(0, 90)
+    angles = [a for a, _ in steps]
+    assert angles == sorted(angles)
+    assert angles[-1] == 90
+    assert round(sum(d for _, d in steps), 6) == round(mp.move_time(0, 90), 6)
+    stretched = mp.plan(0, 90, duration=1.0)
+    assert round(sum(d for _, d in stretched), 6) == 1.1
+
+
+def test_servo_program_pop_due():
+    from rpicam.servo import ServoProgram, ServoOp
+
+    a, b = ServoOp(10, 'CW'), ServoOp(10, 'CCW')
+    prog = ServoProgram([(0, a), (5, b)], period=10)
+    assert prog.pop_due(1) == [a]
+    assert prog.pop_due(4) == []
+    assert prog.pop_due(12) == [b, a]
+    prog.push_back([a])
+    assert prog.pop_due(12) == [a]
+    assert prog.pop_due(15) == [b]
+
+
+def test_simulated_clocks_of_concurrent_moves_overlap():
+    from threading import Thread
+
+    backend = SimulatedGPIOBackend()
+    a = Servo(7, backend=backend)
+    b = Servo(11, backend=backend)
+    t0 = backend.time()
+    threads = [
+        Thread(target=a.move_to, args=(180,)),  # 0.6 sec travel + 0.1 sec settling
+        Thread(target=b.move_to, args=(90,)),  # 0.3 sec travel + 0.1 sec settling
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert backend.time() == t0
+    assert round(backend.latest() - t0, 6) == 0.7
+    end_a = backend.get_timeline(pin=7)[-1].t
+    end_b = backend.get_timeline(pin=11)[-1].t
+    assert round(end_a - t0, 6) == 0.7
+    assert round(end_b - t0, 6) == 0.4
+    backend.wait_until(backend.latest())
+    assert backend.time() == backend.latest()
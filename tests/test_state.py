@@ -0,0 +1,46 @@
+import pytest
+
+from rpicam.utils.state import State
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    return tmp_path
+
+
+def test_set_and_get(state_dir):
+    s = State()
+    s['servo', '(A/D)', 'angle'] = 90
+    s['uuu'] = 2
+    assert s['servo', '(A/D)', 'angle'] == 90
+    assert s['uuu'] == 2
+    assert s['servo', 'missing'] is None
+    assert State()['servo', '(A/D)', 'angle'] == 90
+
+
+def test_cache_sees_writes_of_other_instances(state_dir):
+    s1 = State()
+    s2 = State()
+    s1['a'] = 1
+    assert s2['a'] == 1
+    s2['a'] = 2
+    s2['b'] = 3
+    assert s1['a'] == 2
+    assert s1['b'] == 3
+
+
+def test_batched_writes_merge_on_flush(state_dir):
+    other = State()
+    with State(autoflush=False) as s:
+        s['x', 'y'] = 1
+        assert s['x', 'y'] == 1
+        assert other['x', 'y'] is None
+        other['z'] = 5
+        assert s['z'] == 5
+    assert other['x', 'y'] == 1
+    assert other['z'] == 5
+    assert sorted(p.name for p in state_dir.iterdir()) == [
+        State.STATE_FILE_NAME,
+        State.STATE_FILE_NAME + State.LOCK_FILE_SUFFIX,
+    ]
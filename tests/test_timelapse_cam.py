@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from rpicam.cams import timelapse_cam
+from rpicam.cams.timelapse_cam import TimelapseCam
+
+
+@pytest.fixture
+def make_stream_cam(monkeypatch, tmp_path, fake_picamera2, stub_pipe_encoder):
+    encoders = []
+
+    def make_encoder(**kwargs):
+        encoders.append(stub_pipe_encoder(**kwargs))
+        return encoders[-1]
+
+    monkeypatch.setattr(timelapse_cam, 'PipeEncoder', make_encoder)
+    cams = []
+
+    def make(**kwargs):
+        tmpdir = tmp_path / 'tmp'
+        tmpdir.mkdir()
+        cam = TimelapseCam(tmpdir=tmpdir, stream=True, resolution=(4, 2), **kwargs)
+        cam.encoders = encoders
+        cams.append(cam)
+        return cam
+
+    yield make
+    for cam in cams:
+        cam.close()
+
+
+def record(cam, outfile):
+    return cam.record(outfile, sec_per_frame=0.01, duration=timedelta(seconds=0.05))
+
+
+def test_stream_leaves_no_stack_dir(make_stream_cam, tmp_path):
+    cam = make_stream_cam()
+    for i in range(2):
+        outfile = tmp_path / f'{i}.mp4'
+        assert record(cam, outfile) == outfile
+        assert outfile.is_file()
+    assert [len(e.process.stdin.frames) > 0 for e in cam.encoders] == [True, True]
+    assert not len(list(cam._tmpdir.iterdir()))
+
+
+def test_failed_stream_recording_aborts_encoder(make_stream_cam, tmp_path):
+    cam = make_stream_cam()
+    capture_request = cam.cam.capture_request
+
+    def failing_capture_request():
+        if cam.cam.n_requests == 2:
+            raise RuntimeError('Camera timed out.')
+        return capture_request()
+
+    cam.cam.capture_request = failing_capture_request
+    with pytest.raises(RuntimeError):
+        record(cam, tmp_path / 'failed.mp4')
+    assert cam._pipe_encoder is None
+    assert cam.encoders[0].process.killed.is_set()
+    assert not (tmp_path / 'failed.mp4').is_file()
+
+    cam.cam.capture_request = capture_request
+    record(cam, tmp_path / 'next.mp4')
+    assert (tmp_path / 'next.mp4').is_file()
+    assert len(cam.encoders) == 2
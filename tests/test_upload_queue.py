@@ -0,0 +1,104 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+
+import pytest
+
+from rpicam.utils.telegram_poster import TelegramPoster
+from rpicam.utils.upload_queue import UploadQueue
+
+
+class StandInBotApi:
+    """A local stand-in for the Telegram Bot API, failing the first `n_failures` uploads."""
+
+    def __init__(self, n_failures: int = 0):
+        self.n_failures = n_failures
+        self.uploads = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if api.n_failures > 0:
+                    api.n_failures -= 1
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                api.uploads.append((self.path, self.headers['Content-Type'], body))
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'{"ok": true}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def api():
+    api = StandInBotApi()
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def video(tmp_path):
+    p = tmp_path / 'timelapse.mp4'
+    p.write_bytes(b'\x00video\x01' * 1000)
+    return p
+
+
+def _poster(api):
+    return TelegramPoster(api_token='token', chat_id='1234', api_url=api.url)
+
+
+def test_send_video_streams_multipart(api, video):
+    _poster(api).send_video(video)
+    path, content_type, body = api.uploads[0]
+    assert path == '/bottoken/sendVideo'
+    boundary = content_type.split('boundary=')[1]
+    assert body.startswith(f'--{boundary}\r\nContent-Disposition: form-data; name="chat_id"'.encode())
+    assert b'\r\n1234\r\n' in body
+    assert video.read_bytes() in body
+    assert body.endswith(f'--{boundary}--\r\n'.encode())
+
+
+def test_send_video_raises_on_error(api, video):
+    api.n_failures = 1
+    with pytest.raises(RuntimeError):
+        _poster(api).send_video(video)
+
+
+def test_retries_with_backoff(api, video, tmp_path):
+    api.n_failures = 2
+    with UploadQueue(_poster(api), journal_dir=tmp_path / 'journal', backoff_base=0.01) as q:
+        q.put(video)
+        assert q.join(timeout=10)
+    assert len(api.uploads) == 1
+    assert not len(q.pending())
+
+
+def test_resume_after_restart(api, video, tmp_path):
+    journal_dir = tmp_path / 'journal'
+    UploadQueue(_poster(api), journal_dir=journal_dir).put(video)
+    assert not len(api.uploads)
+    with UploadQueue(_poster(api), journal_dir=journal_dir) as q:
+        assert q.join(timeout=10)
+    assert len(api.uploads) == 1
+
+
+def test_gives_up_after_max_attempts(api, video, tmp_path):
+    api.n_failures = 5
+    with UploadQueue(
+        _poster(api), journal_dir=tmp_path / 'journal', max_attempts=2, backoff_base=0.01
+    ) as q:
+        q.put(video)
+        assert q.join(timeout=10)
+    assert not len(api.uploads)
+    assert api.n_failures == 3